@@ -0,0 +1,98 @@
+"""Benchmark: Spark JDBC append vs COPY loader for the Gold write
+
+Generates synthetic orders in local[*] Spark, runs them through the same
+transform as 04_spark_transform.py and loads them into a local PostgreSQL
+with each writer, one scratch target table per writer.
+
+Run with:
+  /opt/spark/bin/spark-submit \
+    --packages org.postgresql:postgresql:42.7.1 \
+    bench/bench_gold_load.py --rows 3000000 --pg-host localhost --pg-user postgres
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import psycopg2
+from pyspark.sql import SparkSession
+
+from synthetic_orders import generate_orders
+
+SPARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "spark")
+sys.path.insert(0, SPARK_DIR)
+
+
+def load_transform_module():
+    spec = importlib.util.spec_from_file_location(
+        "spark_transform", os.path.join(SPARK_DIR, "04_spark_transform.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Gold writers on generated orders")
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--partitions", type=int, default=8)
+    parser.add_argument("--writers", nargs="+", choices=("jdbc", "copy"), default=["jdbc", "copy"])
+    parser.add_argument("--max-connections", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--pg-host", default="localhost")
+    parser.add_argument("--pg-port", type=int, default=5432)
+    parser.add_argument("--pg-db", default="postgres")
+    parser.add_argument("--pg-user", default="postgres")
+    parser.add_argument("--pg-password", default=os.environ.get("PGPASSWORD", ""))
+    bench_args = parser.parse_args()
+
+    transform_job = load_transform_module()
+    spark = SparkSession.builder.master("local[*]").appName("bench_gold_load").getOrCreate()
+    try:
+        gold = transform_job.transform(generate_orders(spark, bench_args.rows, partitions=bench_args.partitions)).cache()
+        expected = gold.count()
+        print(f"[*] Generated {expected:,} gold rows in {gold.rdd.getNumPartitions()} partitions")
+
+        results = []
+        for writer in bench_args.writers:
+            target = f"public.gold_orders_bench_{writer}"
+            args = transform_job.parse_args([
+                "--writer", writer,
+                "--pg-host", bench_args.pg_host,
+                "--pg-port", str(bench_args.pg_port),
+                "--pg-db", bench_args.pg_db,
+                "--pg-user", bench_args.pg_user,
+                "--pg-password", bench_args.pg_password,
+                "--target-table", target,
+                "--max-connections", str(bench_args.max_connections),
+                "--batch-size", str(bench_args.batch_size),
+            ])
+            conn = psycopg2.connect(**transform_job.conn_params(args))
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {target}")
+
+            print(f"[*] Loading with {writer}...")
+            start = time.perf_counter()
+            transform_job.write_gold(spark, gold, args)
+            elapsed = time.perf_counter() - start
+
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT count(*) FROM {target}")
+                loaded = cur.fetchone()[0]
+                cur.execute(f"DROP TABLE {target}")
+            conn.close()
+            results.append((writer, loaded, elapsed))
+
+        print()
+        print(f"{'writer':<8} {'rows':>12} {'seconds':>9} {'rows/s':>12}")
+        for writer, loaded, elapsed in results:
+            status = "" if loaded == expected else f"  [!] expected {expected:,}"
+            print(f"{writer:<8} {loaded:>12,} {elapsed:>9.2f} {loaded / elapsed:>12,.0f}{status}")
+    finally:
+        spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Benchmark: Bronze → Silver → Gold → dbt staging on synthetic orders
+
+Runs the whole pipeline locally so a change to 04_spark_transform.py, the
+silver_orders DDL or the stg_orders model can be measured before and after:
+
+  1. bronze     generate orders as Parquet in <workdir>/bronze/mssql/orders/dt=...
+  2. silver     create local.silver_orders (03_iceberg_tables.md DDL) and load Bronze
+  3. gold       run 04_spark_transform.py against a file-based Hadoop catalog
+  4. stg_orders time the dbt stg_orders model SQL on the local Postgres
+
+Spark runs in local[*]. For each stage it reports wall time, rows/s and the
+peak JVM heap seen by the driver/executor, plus the Python driver's peak RSS;
+--output appends the results as a JSON line so runs can be diffed.
+
+Run with:
+  /opt/spark/bin/spark-submit \
+    --packages org.postgresql:postgresql:42.7.1,org.apache.iceberg:iceberg-spark-runtime-3.4_2.12:1.4.3 \
+    bench/bench_pipeline.py --rows 5000000 --skew 2 --pg-host localhost --pg-user postgres
+"""
+
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import urllib.request
+
+import psycopg2
+from pyspark.sql import SparkSession
+
+from synthetic_orders import generate_orders, write_bronze
+
+PIPELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SPARK_DIR = os.path.join(PIPELINE_DIR, "spark")
+STG_ORDERS_SQL = os.path.join(PIPELINE_DIR, "dbt", "models", "stg_orders.sql")
+sys.path.insert(0, SPARK_DIR)
+
+from run_metrics import RunMetrics  # noqa: E402  (lives in ../spark)
+
+SILVER_DDL = """
+CREATE TABLE local.silver_orders (
+  order_id BIGINT,
+  customer_id BIGINT,
+  order_ts TIMESTAMP,
+  amount DECIMAL(12,2),
+  dt DATE
+)
+USING iceberg
+PARTITIONED BY (dt)
+"""
+
+
+def load_transform_module():
+    spec = importlib.util.spec_from_file_location(
+        "spark_transform", os.path.join(SPARK_DIR, "04_spark_transform.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_spark(warehouse):
+    return (
+        SparkSession.builder
+        .master("local[*]")
+        .appName("bench_pipeline")
+        .config("spark.sql.catalog.local", "org.apache.iceberg.spark.SparkCatalog")
+        .config("spark.sql.catalog.local.type", "hadoop")
+        .config("spark.sql.catalog.local.warehouse", warehouse)
+        .getOrCreate()
+    )
+
+
+def peak_jvm_heap(spark):
+    """Largest peak JVM heap across the application's executors (bytes), or None"""
+    sc = spark.sparkContext
+    if not sc.uiWebUrl:
+        return None
+    url = f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/allexecutors"
+    try:
+        with urllib.request.urlopen(url, timeout=10) as resp:
+            executors = json.load(resp)
+    except OSError:
+        return None
+    peaks = [e.get("peakMemoryMetrics", {}).get("JVMHeapMemory", 0) for e in executors]
+    return max(peaks) if peaks else None
+
+
+def driver_peak_rss():
+    """Peak RSS of this Python process in bytes (ru_maxrss is KiB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def stg_orders_query():
+    """The dbt model's SELECT with the Jinja config block removed"""
+    with open(STG_ORDERS_SQL, encoding="utf-8") as fh:
+        sql = fh.read()
+    sql = re.sub(r"\{\{.*?\}\}", "", sql, flags=re.S)
+    sql = "\n".join(line for line in sql.splitlines() if not line.strip().startswith("--"))
+    return sql.strip().rstrip(";")
+
+
+class Stages:
+    def __init__(self, spark):
+        self.spark = spark
+        self.results = []
+
+    def record(self, name, seconds, rows, spark_stage=True):
+        self.results.append({
+            "stage": name,
+            "seconds": round(seconds, 3),
+            "rows": rows,
+            "rows_per_second": round(rows / seconds) if seconds else None,
+            "jvm_peak_heap_bytes": peak_jvm_heap(self.spark) if spark_stage else None,
+            "driver_peak_rss_bytes": driver_peak_rss(),
+        })
+
+    def print_table(self):
+        print()
+        print(f"{'stage':<11} {'rows':>12} {'seconds':>9} {'rows/s':>12} {'JVM heap MB':>12} {'py RSS MB':>10}")
+        for r in self.results:
+            heap = r["jvm_peak_heap_bytes"]
+            heap_mb = f"{heap / (1 << 20):,.0f}" if heap else "-"
+            rate = f"{r['rows_per_second']:,}" if r["rows_per_second"] else "-"
+            print(f"{r['stage']:<11} {r['rows']:>12,} {r['seconds']:>9.2f} {rate:>12} "
+                  f"{heap_mb:>12} {r['driver_peak_rss_bytes'] / (1 << 20):>10,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Bronze→Silver→Gold pipeline locally")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=365, help="date spread of dt partitions")
+    parser.add_argument("--skew", type=float, default=1.0, help="1 = uniform, higher = more skewed")
+    parser.add_argument("--customers", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", help="keep Bronze/warehouse here instead of a temp dir")
+    parser.add_argument("--pg-host", default="localhost")
+    parser.add_argument("--pg-port", type=int, default=5432)
+    parser.add_argument("--pg-db", default="postgres")
+    parser.add_argument("--pg-user", default="postgres")
+    parser.add_argument("--pg-password", default=os.environ.get("PGPASSWORD", ""))
+    parser.add_argument("--target-table", default="public.gold_orders_bench",
+                        help="scratch Gold table, dropped at the start of every run")
+    parser.add_argument("--transform-args", default="",
+                        help="extra arguments for 04_spark_transform.py, e.g. \"--writer jdbc\"")
+    parser.add_argument("--output", help="append the results as one JSON line to this file")
+    bench_args = parser.parse_args()
+
+    workdir = bench_args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    bronze = f"file://{os.path.abspath(workdir)}/bronze"
+    warehouse = f"file://{os.path.abspath(workdir)}/warehouse"
+    shutil.rmtree(os.path.join(workdir, "warehouse"), ignore_errors=True)
+
+    transform_job = load_transform_module()
+    args = transform_job.parse_args([
+        "--warehouse", warehouse,
+        "--pg-host", bench_args.pg_host,
+        "--pg-port", str(bench_args.pg_port),
+        "--pg-db", bench_args.pg_db,
+        "--pg-user", bench_args.pg_user,
+        "--pg-password", bench_args.pg_password,
+        "--target-table", bench_args.target_table,
+        *bench_args.transform_args.split(),
+    ])
+    conn = psycopg2.connect(**transform_job.conn_params(args))
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {args.target_table} CASCADE")
+
+    spark = build_spark(warehouse)
+    stages = Stages(spark)
+
+    # 1. Bronze
+    start = time.perf_counter()
+    orders = generate_orders(spark, bench_args.rows, bench_args.days, bench_args.skew,
+                             bench_args.customers, seed=bench_args.seed)
+    bronze_path = write_bronze(orders, bronze)
+    stages.record("bronze", time.perf_counter() - start, bench_args.rows)
+
+    # 2. Silver
+    start = time.perf_counter()
+    spark.sql(SILVER_DDL)
+    spark.sql(f"""
+        INSERT INTO local.silver_orders
+        SELECT
+          CAST(order_id AS BIGINT), CAST(customer_id AS BIGINT), CAST(order_ts AS TIMESTAMP),
+          CAST(amount AS DECIMAL(12,2)), CAST(dt AS DATE)
+        FROM parquet.`{bronze_path}`
+    """)
+    stages.record("silver", time.perf_counter() - start, spark.table("local.silver_orders").count())
+
+    # 3. Gold, through write_gold rather than main() so the session stays up for the memory figures
+    transform_metrics = RunMetrics(spark, "bench_pipeline")
+    start = time.perf_counter()
+    transform_job.write_gold(spark, transform_job.transform(spark.table("local.silver_orders")),
+                             args, transform_metrics)
+    seconds = time.perf_counter() - start
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT count(*) FROM {args.target_table}")
+        stages.record("gold", seconds, cur.fetchone()[0])
+    transform_metrics.finish("succeeded")
+    spark.stop()
+
+    # 4. dbt stg_orders
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE " + args.target_table)
+        query = stg_orders_query().replace("public.gold_orders", args.target_table)
+        start = time.perf_counter()
+        cur.execute(f"SELECT count(*) FROM ({query}) stg")
+        stages.record("stg_orders", time.perf_counter() - start, cur.fetchone()[0], spark_stage=False)
+    conn.close()
+
+    stages.print_table()
+    print("\n[*] Gold stage breakdown:")
+    transform_metrics.print_summary()
+    if bench_args.output:
+        with open(bench_args.output, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps({
+                "at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "rows": bench_args.rows,
+                "days": bench_args.days,
+                "skew": bench_args.skew,
+                "transform_args": bench_args.transform_args,
+                "stages": stages.results,
+                "transform_stages": transform_metrics.run["stages"],
+            }) + "\n")
+        print(f"[+] Appended results to {bench_args.output}")
+    if not bench_args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
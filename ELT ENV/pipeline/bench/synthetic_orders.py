@@ -0,0 +1,77 @@
+"""Synthetic orders generator for the pipeline benchmarks
+
+Writes Parquet in the Bronze layout NiFi produces
+(<bronze>/<source>/orders/dt=YYYY-MM-DD/), with the columns
+03_iceberg_tables.md expects.
+
+--skew > 1 concentrates rows on low customer ids and on the most recent days
+(the value is the exponent applied to a uniform draw, 1 = uniform), which is
+what real order data looks like and what exposes partition/task skew.
+
+Run standalone with:
+  /opt/spark/bin/spark-submit bench/synthetic_orders.py \
+    --rows 5000000 --days 365 --skew 2 --bronze file:///tmp/bench/bronze
+"""
+
+import argparse
+import datetime
+
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import col, date_add, expr, floor, lit, rand
+from pyspark.sql.functions import pow as spow, round as sround
+
+START_DATE = datetime.date(2025, 1, 1)
+
+
+def generate_orders(spark, rows, days=365, skew=1.0, customers=100_000,
+                    start_date=START_DATE, partitions=None, seed=42):
+    """Return a DataFrame of synthetic orders with a dt date column"""
+    df = spark.range(rows, numPartitions=partitions) if partitions else spark.range(rows)
+    last_day = days - 1
+    return (
+        df
+        .select(
+            col("id").alias("order_id"),
+            floor(spow(rand(seed), lit(skew)) * customers).cast("bigint").alias("customer_id"),
+            # 1 - u^skew puts the mass near the end of the range, i.e. recent days
+            floor((lit(1) - spow(rand(seed + 1), lit(skew))) * days).cast("int").alias("day"),
+            floor(rand(seed + 2) * 86400).cast("int").alias("second"),
+            # ~2% non-positive amounts so the transform's filter has work to do
+            sround(rand(seed + 3) * 500 - 10, 2).cast("decimal(12,2)").alias("amount"),
+        )
+        .withColumn("day", expr(f"least(day, {last_day})"))
+        .withColumn("dt", date_add(lit(start_date), col("day")))
+        .withColumn("order_ts", expr("timestamp_seconds(unix_timestamp(cast(dt AS timestamp)) + second)"))
+        .select("order_id", "customer_id", "order_ts", "amount", "dt")
+    )
+
+
+def write_bronze(orders, bronze, source="mssql"):
+    """Write orders as Parquet under <bronze>/<source>/orders/dt=.../ and return that path"""
+    path = f"{bronze.rstrip('/')}/{source}/orders"
+    orders.write.mode("overwrite").partitionBy("dt").parquet(path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Bronze orders")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=365, help="date spread of dt partitions")
+    parser.add_argument("--skew", type=float, default=1.0, help="1 = uniform, higher = more skewed")
+    parser.add_argument("--customers", type=int, default=100_000)
+    parser.add_argument("--source", default="mssql")
+    parser.add_argument("--bronze", default="file:///tmp/bench/bronze")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.master("local[*]").appName("synthetic_orders").getOrCreate()
+    try:
+        orders = generate_orders(spark, args.rows, args.days, args.skew, args.customers, seed=args.seed)
+        path = write_bronze(orders, args.bronze, args.source)
+        print(f"[+] Wrote {args.rows:,} orders over {args.days} days to {path}")
+    finally:
+        spark.stop()
+
+
+if __name__ == "__main__":
+    main()
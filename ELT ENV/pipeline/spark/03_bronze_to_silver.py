@@ -0,0 +1,256 @@
+"""Bronze (Parquet on HDFS) → Silver (Iceberg)
+
+Run with:
+  /opt/spark/bin/spark-submit spark/03_bronze_to_silver.py \
+    [--source-path hdfs://namenode:8020/bronze/mssql/orders] [--table local.silver_orders] \
+    [--keys order_id] [--updated-column LastModified]
+
+Each run lists the dt=YYYY-MM-DD directories under --source-path and ingests
+only the ones that are new, or that received files since they were last
+ingested (NiFi keeps appending to the current day). Progress is kept per
+directory in local.bronze_ingest_state.
+
+The Parquet schema is resolved once per source and cached in
+local.bronze_schema_cache, so later runs read with an explicit schema instead
+of inferring it from the Bronze footers; --refresh-schema re-infers it after a
+source table change.
+
+Rows are deduplicated on --keys keeping the newest --updated-column (the
+column NiFi's incremental `LastModified >= ?` extract is driven by) and then
+applied with MERGE INTO, so re-ingesting a directory is idempotent.
+
+--updated-column is kept in Silver (it is added to an existing table that
+lacks it) and a matched Silver row is only replaced when the Bronze row is at
+least as new, so re-ingesting an older directory cannot roll it back. A Bronze
+source without that column is refused. MERGE commits overwrite snapshots when keys already exist; the next
+04_spark_transform.py --incremental upsert run detects them and re-reads
+Silver in full instead of skipping the updated rows.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+
+from pyspark.sql import SparkSession, Window
+from pyspark.sql.functions import col, lit, row_number
+from pyspark.sql.types import DateType, StructField, StructType
+
+# Configuration
+WAREHOUSE = "hdfs://namenode:8020/warehouse/iceberg"
+SOURCE_PATH = "hdfs://namenode:8020/bronze/mssql/orders"
+TABLE = "local.silver_orders"
+KEYS = ["order_id"]
+UPDATED_COLUMN = "LastModified"
+STATE_TABLE = "local.bronze_ingest_state"
+SCHEMA_CACHE_TABLE = "local.bronze_schema_cache"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental Bronze (Parquet) → Silver (Iceberg) ingestion")
+    parser.add_argument("--source-path", default=SOURCE_PATH,
+                        help="Bronze table directory containing dt=YYYY-MM-DD partitions")
+    parser.add_argument("--table", default=TABLE, help="Silver Iceberg table to merge into")
+    parser.add_argument("--warehouse", default=os.environ.get("ICEBERG_WAREHOUSE", WAREHOUSE),
+                        help="Iceberg Hadoop-catalog warehouse location")
+    parser.add_argument("--keys", nargs="+", default=KEYS, help="primary key columns")
+    parser.add_argument("--updated-column", default=UPDATED_COLUMN,
+                        help="column deciding which duplicate is newest")
+    parser.add_argument("--refresh-schema", action="store_true",
+                        help="re-infer and re-cache the Bronze Parquet schema")
+    parser.add_argument("--max-partitions", type=int,
+                        help="ingest at most this many dt directories per run (oldest first)")
+    return parser.parse_args(argv)
+
+
+def build_spark(warehouse):
+    return (
+        SparkSession.builder
+        .appName("bronze_to_silver")
+        .config("spark.sql.extensions", "org.apache.iceberg.spark.extensions.IcebergSparkSessionExtensions")
+        .config("spark.sql.catalog.local", "org.apache.iceberg.spark.SparkCatalog")
+        .config("spark.sql.catalog.local.type", "hadoop")
+        .config("spark.sql.catalog.local.warehouse", warehouse)
+        .getOrCreate()
+    )
+
+
+def ensure_state_tables(spark):
+    spark.sql(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+          source_path STRING,
+          dt DATE,
+          max_modified_ms BIGINT,
+          rows BIGINT,
+          ingested_at TIMESTAMP
+        )
+        USING iceberg
+    """)
+    spark.sql(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_CACHE_TABLE} (
+          source_path STRING,
+          schema_json STRING,
+          cached_at TIMESTAMP
+        )
+        USING iceberg
+    """)
+
+
+def list_bronze_partitions(spark, source_path):
+    """Return {dt: (path, newest file modification time in ms)} for each dt= directory"""
+    jvm = spark.sparkContext._jvm
+    conf = spark.sparkContext._jsc.hadoopConfiguration()
+    root = jvm.org.apache.hadoop.fs.Path(source_path)
+    fs = root.getFileSystem(conf)
+    if not fs.exists(root):
+        return {}
+
+    partitions = {}
+    for status in fs.listStatus(root):
+        name = status.getPath().getName()
+        if not status.isDirectory() or not name.startswith("dt="):
+            continue
+        try:
+            dt = datetime.date.fromisoformat(name[3:])
+        except ValueError:
+            continue
+        files = [f for f in fs.listStatus(status.getPath())
+                 if f.isFile() and not f.getPath().getName().startswith(("_", "."))]
+        if files:
+            partitions[dt] = (status.getPath().toString(), max(f.getModificationTime() for f in files))
+    return partitions
+
+
+def pending_partitions(spark, source_path, partitions):
+    """Keep the directories that are new or changed since they were last ingested"""
+    ingested = {
+        row["dt"]: row["max_modified_ms"]
+        for row in spark.sql(f"""
+            SELECT dt, max(max_modified_ms) AS max_modified_ms
+            FROM {STATE_TABLE}
+            WHERE source_path = '{source_path}'
+            GROUP BY dt
+        """).collect()
+    }
+    return {
+        dt: info for dt, info in partitions.items()
+        if dt not in ingested or info[1] > ingested[dt]
+    }
+
+
+def bronze_schema(spark, source_path, sample_path, refresh):
+    """Return the cached data-file schema for source_path, inferring it on first use"""
+    if not refresh:
+        rows = spark.sql(f"""
+            SELECT schema_json FROM {SCHEMA_CACHE_TABLE}
+            WHERE source_path = '{source_path}'
+            ORDER BY cached_at DESC
+            LIMIT 1
+        """).collect()
+        if rows:
+            return StructType.fromJson(json.loads(rows[0]["schema_json"]))
+
+    schema = spark.read.parquet(sample_path).schema
+    print(f"[*] Inferred Bronze schema from {sample_path}: {schema.simpleString()}")
+    spark.createDataFrame(
+        [(source_path, schema.json())], "source_path STRING, schema_json STRING"
+    ).withColumn("cached_at", lit(datetime.datetime.now())).writeTo(SCHEMA_CACHE_TABLE).append()
+    return schema
+
+
+def read_partitions(spark, source_path, pending, schema):
+    """Read only the pending dt directories; dt comes from the directory name"""
+    read_schema = StructType(
+        [f for f in schema.fields if f.name != "dt"] + [StructField("dt", DateType())]
+    )
+    paths = [path for path, _ in pending.values()]
+    return spark.read.schema(read_schema).option("basePath", source_path).parquet(*paths)
+
+
+def dedupe_latest(df, keys, updated_column):
+    """Keep one row per key, the one with the newest updated_column"""
+    if updated_column not in df.columns:
+        print(f"[!] {updated_column} not in Bronze schema, keeping an arbitrary row per key")
+        return df.dropDuplicates(keys)
+    window = Window.partitionBy(*keys).orderBy(col(updated_column).desc_nulls_last())
+    return df.withColumn("_rn", row_number().over(window)).filter(col("_rn") == 1).drop("_rn")
+
+
+def merge_into_silver(spark, batch, table, keys, updated_column):
+    if updated_column not in batch.columns:
+        raise RuntimeError(f"{updated_column} is not in the Bronze schema; without it an older row "
+                           f"could overwrite a newer one in {table} (see --updated-column)")
+    if not spark.catalog.tableExists(table):
+        batch.writeTo(table).using("iceberg").partitionedBy(col("dt")).create()
+        print(f"[+] Created {table} from the first Bronze batch")
+        return
+
+    if updated_column not in spark.table(table).columns:
+        # Silver tables created before the guard existed: evolve the schema once
+        data_type = batch.schema[updated_column].dataType.simpleString()
+        spark.sql(f"ALTER TABLE {table} ADD COLUMN {updated_column} {data_type}")
+        print(f"[+] Added {updated_column} {data_type} to {table}")
+
+    # Align to the Silver schema (drops other Bronze-only columns)
+    silver = spark.table(table).schema
+    aligned = batch.select([
+        (col(f.name) if f.name in batch.columns else lit(None)).cast(f.dataType).alias(f.name)
+        for f in silver.fields
+    ])
+    aligned.createOrReplaceTempView("bronze_batch")
+    on = " AND ".join(f"t.{k} = s.{k}" for k in keys)
+    # never let an older Bronze row overwrite a newer Silver one; rows merged
+    # before the column was added have no value yet and take the Bronze row
+    newer = f"t.{updated_column} IS NULL OR t.{updated_column} <= s.{updated_column}"
+    spark.sql(f"""
+        MERGE INTO {table} t
+        USING bronze_batch s
+        ON {on}
+        WHEN MATCHED AND ({newer}) THEN UPDATE SET *
+        WHEN NOT MATCHED THEN INSERT *
+    """)
+
+
+def record_ingested(spark, source_path, pending, counts):
+    rows = [(source_path, dt, modified, counts.get(dt, 0)) for dt, (_, modified) in pending.items()]
+    (
+        spark.createDataFrame(rows, "source_path STRING, dt DATE, max_modified_ms BIGINT, rows BIGINT")
+        .withColumn("ingested_at", lit(datetime.datetime.now()))
+        .writeTo(STATE_TABLE)
+        .append()
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    spark = build_spark(args.warehouse)
+    try:
+        ensure_state_tables(spark)
+        partitions = list_bronze_partitions(spark, args.source_path)
+        pending = pending_partitions(spark, args.source_path, partitions)
+        if args.max_partitions:
+            pending = dict(sorted(pending.items())[:args.max_partitions])
+        print(f"[*] {len(partitions)} dt partitions under {args.source_path}, {len(pending)} to ingest")
+        if not pending:
+            return True
+
+        newest_path = pending[max(pending)][0]
+        schema = bronze_schema(spark, args.source_path, newest_path, args.refresh_schema)
+        batch = dedupe_latest(read_partitions(spark, args.source_path, pending, schema),
+                              args.keys, args.updated_column).cache()
+        counts = {row["dt"]: row["count"] for row in batch.groupBy("dt").count().collect()}
+        print(f"[*] {sum(counts.values()):,} deduplicated rows from "
+              f"{min(pending)} .. {max(pending)}")
+
+        merge_into_silver(spark, batch, args.table, args.keys, args.updated_column)
+        record_ingested(spark, args.source_path, pending, counts)
+        print(f"[+] Merged {len(pending)} partitions into {args.table}")
+        batch.unpersist()
+        return True
+    finally:
+        spark.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
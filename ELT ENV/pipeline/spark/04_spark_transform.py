@@ -3,42 +3,366 @@
 Run with:
   /opt/spark/bin/spark-submit \
     --packages org.postgresql:postgresql:42.7.1 \
-    spark/04_spark_transform.py
+    spark/04_spark_transform.py [--incremental] [--writer copy|jdbc] [--mode append|upsert]
+                                [--from-dt YYYY-MM-DD] [--to-dt YYYY-MM-DD | --last-days N]
+
+The Gold write streams each partition into PostgreSQL with COPY through an
+unlogged staging table (pg_copy_loader.py, needs psycopg2 on the executors);
+--writer jdbc keeps the old batched-INSERT path for comparison.
+
+--mode upsert merges the staged batch into the target on --key-columns
+(order_id by default) with INSERT ... ON CONFLICT, so re-runs and retries do
+not duplicate Gold rows. It requires the copy writer.
+
+Write parallelism is bounded: Gold is hash-repartitioned on the key columns
+into ceil(rows / --rows-per-partition) partitions, capped at
+--max-connections, so one partition is one Postgres connection and the load
+never exceeds that many sessions on postgres-staging. --batch-size sets the
+JDBC batchsize and the rows rendered per COPY buffer fill.
+
+--from-dt/--to-dt (inclusive) or --last-days restrict the run to a window of
+Silver's dt partitions. The predicate is pushed into the Iceberg scan, so only
+the matching partitions' data files are planned and read; the number of files
+and partitions pruned is logged before the read. A window run is a backfill and
+does not touch the --incremental state.
+
+Every run emits one JSON line of per-stage metrics (wall time, rows and bytes
+in/out, Spark tasks and task skew; see run_metrics.py) to --metrics-file,
+stdout by default. --metrics-history also inserts it into
+public.pipeline_run_history on the staging database.
+
+--incremental reads only the Silver snapshots appended since the last
+successful run (tracked in local.pipeline_state). Iceberg's incremental scan
+skips overwrite and delete snapshots (MERGE INTO in 03_bronze_to_silver.py), so
+when the range contains one an upsert run falls back to a full read of the
+current snapshot and an append run fails without advancing the state. Point
+--warehouse at a local directory (e.g. file:///tmp/iceberg-warehouse) to run
+against a Hadoop catalog without HDFS.
 """
 
+import argparse
+import contextlib
+import datetime
+import math
+import os
+import sys
+import time
+
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import col, to_date
-
-spark = (
-    SparkSession.builder
-    .appName("iceberg_to_postgres")
-    .config("spark.sql.catalog.local", "org.apache.iceberg.spark.SparkCatalog")
-    .config("spark.sql.catalog.local.type", "hadoop")
-    .config("spark.sql.catalog.local.warehouse", "hdfs://namenode:8020/warehouse/iceberg")
-    .getOrCreate()
+from pyspark.sql.functions import col, lit, to_date
+
+from iceberg_incremental import (
+    current_snapshot_id,
+    ensure_state_table,
+    is_current_ancestor,
+    last_processed_snapshot,
+    non_append_snapshots,
+    read_snapshot_range,
+    record_processed_snapshot,
 )
+from run_metrics import RUN_HISTORY_TABLE, RunMetrics
 
-# Read Iceberg (Silver)
-orders = spark.table("local.silver_orders")
+# Configuration
+WAREHOUSE = "hdfs://namenode:8020/warehouse/iceberg"
+SOURCE_TABLE = "local.silver_orders"
+JOB_NAME = "silver_orders_to_gold"
+PG_HOST = "postgres-staging"
+PG_PORT = 5432
+PG_DB = "staging"
+TARGET_TABLE = "public.gold_orders"
+KEY_COLUMNS = ["order_id"]
+DB_USER = "staging_user"
+DB_PASSWORD = "StrongPassword"
+MAX_CONNECTIONS = 8
+ROWS_PER_PARTITION = 500_000
+BATCH_SIZE = 10_000
+EXCLUDE_COLUMNS = ["LastModified"]  # Silver-only: 03_bronze_to_silver.py's MERGE ordering column
 
-# Transform (Gold)
-gold = (
-    orders
-    .filter(col("amount") > 0)
-    .withColumn("order_date", to_date(col("order_ts")))
-)
 
-# Write to PostgreSQL Staging
-(
-    gold.write
-    .format("jdbc")
-    .option("url", "jdbc:postgresql://postgres-staging:5432/staging")
-    .option("dbtable", "public.gold_orders")
-    .option("user", "staging_user")
-    .option("password", "StrongPassword")
-    .option("driver", "org.postgresql.Driver")
-    .mode("append")
-    .save()
-)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Silver (Iceberg) → Gold (PostgreSQL) transform")
+    parser.add_argument("--incremental", action="store_true",
+                        help="read only Silver snapshots appended since the last successful run")
+    parser.add_argument("--warehouse", default=os.environ.get("ICEBERG_WAREHOUSE", WAREHOUSE),
+                        help="Iceberg Hadoop-catalog warehouse location")
+    parser.add_argument("--source-table", default=SOURCE_TABLE,
+                        help="Silver Iceberg table to read")
+    parser.add_argument("--job-name", default=JOB_NAME,
+                        help="key under which the processed snapshot is recorded")
+    parser.add_argument("--writer", choices=("copy", "jdbc"), default="copy",
+                        help="Gold write path: COPY via staging table (default) or Spark JDBC")
+    parser.add_argument("--pg-host", default=PG_HOST)
+    parser.add_argument("--pg-port", type=int, default=PG_PORT)
+    parser.add_argument("--pg-db", default=PG_DB)
+    parser.add_argument("--pg-user", default=DB_USER)
+    parser.add_argument("--pg-password", default=os.environ.get("STAGING_PASSWORD", DB_PASSWORD))
+    parser.add_argument("--target-table", default=TARGET_TABLE)
+    parser.add_argument("--exclude-columns", nargs="*", default=EXCLUDE_COLUMNS,
+                        help="Silver columns not written to Gold")
+    parser.add_argument("--mode", choices=("append", "upsert"), default="append",
+                        help="publish the batch as a plain append or an upsert on --key-columns")
+    parser.add_argument("--key-columns", nargs="+", default=KEY_COLUMNS,
+                        help="columns identifying a Gold row for --mode upsert")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help="upper bound on concurrent Postgres connections for the Gold write")
+    parser.add_argument("--rows-per-partition", type=int, default=ROWS_PER_PARTITION,
+                        help="target Gold rows per write task before the connection cap applies")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="rows per JDBC batch / COPY buffer fill")
+    parser.add_argument("--metrics-file", default=os.environ.get("PIPELINE_METRICS_FILE", "-"),
+                        help="append the run's JSON metrics line here ('-' for stdout)")
+    parser.add_argument("--metrics-history", action="store_true",
+                        help=f"also insert the run metrics into {RUN_HISTORY_TABLE}")
+    parser.add_argument("--from-dt", type=datetime.date.fromisoformat,
+                        help="first Silver dt partition to process (inclusive)")
+    parser.add_argument("--to-dt", type=datetime.date.fromisoformat,
+                        help="last Silver dt partition to process (inclusive)")
+    parser.add_argument("--last-days", type=int,
+                        help="process only the last N dt partitions up to today")
+    args = parser.parse_args(argv)
+    if args.mode == "upsert" and args.writer != "copy":
+        parser.error("--mode upsert requires --writer copy")
+    for name in ("max_connections", "rows_per_partition", "batch_size"):
+        if getattr(args, name) < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+    if args.last_days is not None:
+        if args.from_dt or args.to_dt:
+            parser.error("--last-days cannot be combined with --from-dt/--to-dt")
+        if args.last_days < 1:
+            parser.error("--last-days must be at least 1")
+        args.to_dt = datetime.date.today()
+        args.from_dt = args.to_dt - datetime.timedelta(days=args.last_days - 1)
+    if args.from_dt and args.to_dt and args.from_dt > args.to_dt:
+        parser.error("--from-dt is after --to-dt")
+    if args.incremental and (args.from_dt or args.to_dt):
+        # The recorded snapshot would also cover rows outside the window
+        parser.error("--incremental cannot be combined with a dt window")
+    return args
+
+
+def build_spark(warehouse, app_name="iceberg_to_postgres", conf=None):
+    builder = (
+        SparkSession.builder
+        .appName(app_name)
+        .config("spark.sql.catalog.local", "org.apache.iceberg.spark.SparkCatalog")
+        .config("spark.sql.catalog.local.type", "hadoop")
+        .config("spark.sql.catalog.local.warehouse", warehouse)
+    )
+    for key, value in (conf or {}).items():
+        builder = builder.config(key, value)
+    return builder.getOrCreate()
+
+
+def dt_predicate(args):
+    """Return the Column filter for the requested dt window, or None for all partitions"""
+    predicate = None
+    if args.from_dt:
+        predicate = col("dt") >= lit(args.from_dt)
+    if args.to_dt:
+        upper = col("dt") <= lit(args.to_dt)
+        predicate = upper if predicate is None else predicate & upper
+    return predicate
+
+
+def log_partition_pruning(spark, table, predicate):
+    """Report how many data files and dt partitions the window skips"""
+    files = spark.table(f"{table}.files").select(col("partition.dt").alias("dt"))
+    total = files.count()
+    total_parts = files.select("dt").distinct().count()
+    selected = files.filter(predicate)
+    kept = selected.count()
+    kept_parts = selected.select("dt").distinct().count()
+    print(f"[*] dt window keeps {kept:,}/{total:,} files in {kept_parts:,}/{total_parts:,} partitions "
+          f"(pruned {total - kept:,} files, {total_parts - kept_parts:,} partitions)")
+
+
+def read_silver(spark, args):
+    """Return (orders DataFrame, snapshot id to record) or (None, None) if there is nothing new"""
+    predicate = dt_predicate(args)
+    if predicate is not None:
+        print(f"[*] Restricting {args.source_table} to dt in [{args.from_dt or '-inf'}, {args.to_dt or '+inf'}]")
+        log_partition_pruning(spark, args.source_table, predicate)
+
+    orders, snapshot_id = read_silver_snapshots(spark, args)
+    if orders is not None and predicate is not None:
+        # Filtering on the partition column lets Iceberg skip whole manifests and files at planning time
+        orders = orders.filter(predicate)
+    if orders is not None and args.exclude_columns:
+        orders = orders.drop(*args.exclude_columns)
+    return orders, snapshot_id
+
+
+def read_silver_snapshots(spark, args):
+    if not args.incremental:
+        return spark.table(args.source_table), None
+
+    ensure_state_table(spark)
+    end_snapshot = current_snapshot_id(spark, args.source_table)
+    if end_snapshot is None:
+        print(f"[*] {args.source_table} has no snapshots yet, nothing to do")
+        return None, None
+
+    start_snapshot = last_processed_snapshot(spark, args.job_name, args.source_table)
+    if start_snapshot == end_snapshot:
+        print(f"[*] No new snapshots in {args.source_table} since {start_snapshot}")
+        return None, None
+    if start_snapshot is not None and not is_current_ancestor(spark, args.source_table, start_snapshot):
+        print(f"[!] Snapshot {start_snapshot} is no longer in the history of {args.source_table}, "
+              "falling back to a full read")
+        start_snapshot = None
+    if start_snapshot is not None:
+        skipped = non_append_snapshots(spark, args.source_table, start_snapshot, end_snapshot)
+        if skipped:
+            operations = ", ".join(f"{snapshot} ({operation})" for snapshot, operation in skipped)
+            if args.mode != "upsert":
+                # a full read appended to Gold would duplicate every row already there
+                raise RuntimeError(
+                    f"{args.source_table} has non-append snapshots since {start_snapshot}: {operations}; "
+                    "an incremental read would drop their changes. Re-run with --mode upsert")
+            print(f"[!] {args.source_table} has non-append snapshots since {start_snapshot}: {operations}, "
+                  "falling back to a full upsert read")
+            start_snapshot = None
+
+    print(f"[*] Reading {args.source_table} snapshots ({start_snapshot}, {end_snapshot}]")
+    return read_snapshot_range(spark, args.source_table, start_snapshot, end_snapshot), end_snapshot
+
+
+def transform(orders):
+    return (
+        orders
+        .filter(col("amount") > 0)
+        .withColumn("order_date", to_date(col("order_ts")))
+    )
+
+
+def conn_params(args):
+    return {
+        "host": args.pg_host,
+        "port": args.pg_port,
+        "dbname": args.pg_db,
+        "user": args.pg_user,
+        "password": args.pg_password,
+    }
+
+
+def size_partitions(gold, args):
+    """Hash-repartition gold on the key columns to bound the number of write tasks.
+
+    Returns (DataFrame, row count). One partition maps to one connection.
+    """
+    rows = gold.count()
+    partitions = max(1, min(args.max_connections, math.ceil(rows / args.rows_per_partition)))
+    print(f"[*] Writing {rows:,} Gold rows as {partitions} partitions "
+          f"(~{rows // partitions:,} rows each, max {args.max_connections} connections)")
+    return gold.repartition(partitions, *[col(c) for c in args.key_columns]), rows
+
+
+def write_gold_jdbc(gold, args):
+    (
+        gold.write
+        .format("jdbc")
+        .option("url", f"jdbc:postgresql://{args.pg_host}:{args.pg_port}/{args.pg_db}")
+        .option("dbtable", args.target_table)
+        .option("user", args.pg_user)
+        .option("password", args.pg_password)
+        .option("driver", "org.postgresql.Driver")
+        .option("numPartitions", args.max_connections)
+        .option("batchsize", args.batch_size)
+        .option("isolationLevel", "READ_COMMITTED")
+        .mode("append")
+        .save()
+    )
+
+
+def write_gold_copy(spark, gold, args):
+    import pg_copy_loader
+
+    spark.sparkContext.addPyFile(pg_copy_loader.__file__)
+    return pg_copy_loader.copy_load(gold, conn_params(args), args.target_table,
+                                    mode=args.mode, key_columns=args.key_columns,
+                                    batch_rows=args.batch_size)
+
+
+def write_gold(spark, gold, args, metrics=None):
+    """Materialize gold and load it into PostgreSQL.
+
+    Spark is lazy, so the Silver scan and the transform run in the
+    "transform" stage (the count that sizes the write), not in "read".
+    """
+    stage = metrics.stage if metrics else (lambda name: contextlib.nullcontext({}))
+    gold = gold.persist()
+    try:
+        with stage("transform") as record:
+            gold, rows = size_partitions(gold, args)
+            record["gold_rows"] = rows
+
+        with stage("write") as record:
+            start = time.perf_counter()
+            if args.writer == "jdbc":
+                write_gold_jdbc(gold, args)
+            else:
+                copied = write_gold_copy(spark, gold, args)
+                record["bytes_written"] = sum(m["bytes"] for m in copied)
+            seconds = time.perf_counter() - start
+            record["rows_written"] = rows
+        partitions = gold.rdd.getNumPartitions()
+        rate = rows / seconds if seconds else 0.0
+        print(f"[+] {args.writer} wrote {rows:,} rows in {seconds:.2f}s "
+              f"({rate:,.0f} rows/s, {rate / partitions:,.0f} rows/s per task)")
+    finally:
+        gold.unpersist()
+
+
+def run(spark, args, transform_fn=transform):
+    """Run one Silver → Gold job on an existing session; return True on success"""
+    metrics = RunMetrics(spark, args.job_name)
+    status = "failed"
+    try:
+        # Read Iceberg (Silver)
+        with metrics.stage("read"):
+            orders, snapshot_id = read_silver(spark, args)
+        if orders is None:
+            status = "no_data"
+            return True
+
+        # Transform (Gold)
+        gold = transform_fn(orders)
+
+        # Write to PostgreSQL Staging
+        write_gold(spark, gold, args, metrics)
+
+        # Only advance the state once Gold has the data
+        if snapshot_id is not None:
+            with metrics.stage("state"):
+                record_processed_snapshot(spark, args.job_name, args.source_table, snapshot_id)
+            print(f"[+] Recorded snapshot {snapshot_id} for {args.job_name}")
+        status = "succeeded"
+        return True
+    finally:
+        report_metrics(metrics, status, args)
+
+
+def report_metrics(metrics, status, args):
+    metrics.finish(status)
+    print(f"[*] Run {metrics.run['run_id']} {status} in {metrics.run['seconds']:.2f}s")
+    metrics.print_summary()
+    metrics.write_json_line(args.metrics_file)
+    if args.metrics_history:
+        try:
+            metrics.insert_history(conn_params(args))
+        except Exception as exc:
+            # Never fail (or mask the failure of) the run because of its metrics
+            print(f"[!] Could not record run metrics in {RUN_HISTORY_TABLE}: {exc}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    spark = build_spark(args.warehouse)
+    try:
+        return run(spark, args)
+    finally:
+        spark.stop()
+
 
-spark.stop()
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
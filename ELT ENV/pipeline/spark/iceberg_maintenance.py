@@ -0,0 +1,185 @@
+"""Iceberg (Silver) table maintenance
+
+Run with:
+  /opt/spark/bin/spark-submit spark/iceberg_maintenance.py \
+    [--table local.silver_orders] [--target-file-mb 256] [--retain-days 7]
+
+Bin-packs small data files inside each dt partition up to the target file
+size, expires snapshots older than the retention window and rewrites the
+manifests, printing file counts and scan-planning time before and after.
+Schedule it after 04_spark_transform.py, not concurrently with it.
+
+Snapshots still recorded in local.pipeline_state are never expired, so an
+--incremental transform run can always resume from its last snapshot.
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+from pyspark.sql import SparkSession
+
+from iceberg_incremental import STATE_TABLE
+
+# Configuration
+WAREHOUSE = "hdfs://namenode:8020/warehouse/iceberg"
+TABLE = "local.silver_orders"
+TARGET_FILE_MB = 256
+MIN_INPUT_FILES = 5
+RETAIN_DAYS = 7
+RETAIN_LAST = 10
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compact, expire and rewrite manifests of an Iceberg table")
+    parser.add_argument("--table", default=TABLE)
+    parser.add_argument("--warehouse", default=os.environ.get("ICEBERG_WAREHOUSE", WAREHOUSE),
+                        help="Iceberg Hadoop-catalog warehouse location")
+    parser.add_argument("--target-file-mb", type=int, default=TARGET_FILE_MB,
+                        help="target data file size for bin-packing")
+    parser.add_argument("--min-input-files", type=int, default=MIN_INPUT_FILES,
+                        help="only rewrite a file group with at least this many small files")
+    parser.add_argument("--where", help="restrict compaction, e.g. \"dt >= '2026-01-01'\"")
+    parser.add_argument("--retain-days", type=int, default=RETAIN_DAYS,
+                        help="expire snapshots older than this many days")
+    parser.add_argument("--retain-last", type=int, default=RETAIN_LAST,
+                        help="always keep at least this many snapshots")
+    parser.add_argument("--skip-compaction", action="store_true")
+    parser.add_argument("--skip-expiry", action="store_true")
+    parser.add_argument("--skip-manifests", action="store_true")
+    return parser.parse_args(argv)
+
+
+def build_spark(warehouse):
+    return (
+        SparkSession.builder
+        .appName("iceberg_maintenance")
+        .config("spark.sql.extensions", "org.apache.iceberg.spark.extensions.IcebergSparkSessionExtensions")
+        .config("spark.sql.catalog.local", "org.apache.iceberg.spark.SparkCatalog")
+        .config("spark.sql.catalog.local.type", "hadoop")
+        .config("spark.sql.catalog.local.warehouse", warehouse)
+        .getOrCreate()
+    )
+
+
+def split_table(table):
+    """local.silver_orders -> ("local", "silver_orders")"""
+    catalog, _, name = table.partition(".")
+    return catalog, name
+
+
+def table_stats(spark, table):
+    """Return data file, manifest and snapshot counts plus a scan-planning time"""
+    files = spark.sql(f"SELECT count(*) AS n, coalesce(sum(file_size_in_bytes), 0) AS bytes FROM {table}.files").first()
+    manifests = spark.sql(f"SELECT count(*) FROM {table}.manifests").first()[0]
+    snapshots = spark.sql(f"SELECT count(*) FROM {table}.snapshots").first()[0]
+
+    # inputFiles() plans the scan (manifest reads + file listing) without reading data
+    start = time.perf_counter()
+    spark.table(table).inputFiles()
+    planning = time.perf_counter() - start
+
+    return {
+        "files": files["n"],
+        "bytes": files["bytes"],
+        "avg_file_mb": files["bytes"] / files["n"] / (1 << 20) if files["n"] else 0.0,
+        "manifests": manifests,
+        "snapshots": snapshots,
+        "planning_seconds": planning,
+    }
+
+
+def print_stats(label, stats):
+    print(f"[*] {label}: {stats['files']:,} data files (avg {stats['avg_file_mb']:.1f} MB), "
+          f"{stats['manifests']:,} manifests, {stats['snapshots']:,} snapshots, "
+          f"scan planning {stats['planning_seconds']:.2f}s")
+
+
+def compact(spark, table, args):
+    catalog, name = split_table(table)
+    options = (
+        f"map('target-file-size-bytes', '{args.target_file_mb * (1 << 20)}', "
+        f"'min-input-files', '{args.min_input_files}', "
+        f"'partial-progress.enabled', 'true')"
+    )
+    where = f", where => \"{args.where}\"" if args.where else ""
+    # binpack groups files per partition, so each dt is compacted on its own
+    row = spark.sql(f"""
+        CALL {catalog}.system.rewrite_data_files(
+          table => '{name}', strategy => 'binpack', options => {options}{where})
+    """).first()
+    print(f"[+] Compaction rewrote {row['rewritten_data_files_count']:,} files "
+          f"into {row['added_data_files_count']:,}")
+
+
+def oldest_protected_snapshot(spark, table):
+    """Commit time of the oldest snapshot a job still resumes from, or None"""
+    if not spark.catalog.tableExists(STATE_TABLE):
+        return None
+    latest = spark.sql(f"""
+        SELECT job, max_by(snapshot_id, committed_at) AS snapshot_id
+        FROM {STATE_TABLE}
+        WHERE source_table = '{table}'
+        GROUP BY job
+    """)
+    row = (
+        spark.table(f"{table}.snapshots")
+        .join(latest, "snapshot_id")
+        .agg({"committed_at": "min"})
+        .first()
+    )
+    return row[0] if row else None
+
+
+def expire(spark, table, args):
+    catalog, name = split_table(table)
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=args.retain_days)
+    protected = oldest_protected_snapshot(spark, table)
+    if protected is not None and protected <= cutoff:
+        print(f"[*] Keeping snapshots from {protected} onward for incremental jobs")
+        cutoff = protected - datetime.timedelta(seconds=1)
+    row = spark.sql(f"""
+        CALL {catalog}.system.expire_snapshots(
+          table => '{name}',
+          older_than => TIMESTAMP '{cutoff:%Y-%m-%d %H:%M:%S}',
+          retain_last => {args.retain_last})
+    """).first()
+    print(f"[+] Expired snapshots older than {cutoff:%Y-%m-%d %H:%M:%S}: "
+          f"removed {row['deleted_data_files_count']:,} data files, "
+          f"{row['deleted_manifest_files_count']:,} manifests")
+
+
+def rewrite_manifests(spark, table):
+    catalog, name = split_table(table)
+    row = spark.sql(f"CALL {catalog}.system.rewrite_manifests('{name}')").first()
+    print(f"[+] Rewrote {row['rewritten_manifests_count']:,} manifests "
+          f"into {row['added_manifests_count']:,}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    spark = build_spark(args.warehouse)
+    try:
+        before = table_stats(spark, args.table)
+        print_stats(f"{args.table} before", before)
+
+        if not args.skip_compaction:
+            compact(spark, args.table, args)
+        if not args.skip_expiry:
+            expire(spark, args.table, args)
+        if not args.skip_manifests:
+            rewrite_manifests(spark, args.table)
+
+        after = table_stats(spark, args.table)
+        print_stats(f"{args.table} after", after)
+        print(f"[+] Data files {before['files']:,} -> {after['files']:,}, "
+              f"scan planning {before['planning_seconds']:.2f}s -> {after['planning_seconds']:.2f}s")
+        return True
+    finally:
+        spark.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,256 @@
+"""Bulk COPY loader for the Gold stage.
+
+Each Spark partition streams its rows into ``COPY ... FROM STDIN (FORMAT csv)``
+on its own connection, landing in an UNLOGGED staging table. Once every
+partition has finished the driver moves the batch into the target table with a
+single set-based statement and drops the staging table, so the target only
+ever sees complete batches.
+
+With ``mode="upsert"`` the publish step is one ``INSERT ... ON CONFLICT DO
+UPDATE`` keyed on ``key_columns`` instead of a plain append, so re-running a
+batch rewrites the same rows rather than duplicating them. The unique index
+the conflict target needs is created on first use unless the target already
+has one on exactly those columns (primary key, unique constraint or index); a
+target holding duplicate keys is refused rather than cleaned up.
+
+Executors need psycopg2 installed and this module shipped with
+``--py-files`` (04_spark_transform.py adds it via ``addPyFile``).
+"""
+
+import csv
+import io
+import time
+import uuid
+
+import psycopg2
+
+from pyspark.sql.types import (
+    BooleanType, DateType, DecimalType, DoubleType, FloatType, IntegerType,
+    LongType, ShortType, StringType, TimestampType,
+)
+
+COPY_BUFFER_SIZE = 1 << 20
+
+
+class _Null(float):
+    """Written by csv.writer as a bare empty field, which COPY reads as NULL.
+
+    QUOTE_NONNUMERIC quotes every field except numbers, so "" stays an empty
+    string; a plain None would be written as "" too. Subclassing float makes
+    this the one unquoted empty field.
+    """
+
+    def __str__(self):
+        return ""
+
+    __repr__ = __str__
+
+
+NULL = _Null()
+
+
+class CsvRowStream:
+    """File-like object that renders Spark rows as CSV on demand for copy_expert"""
+
+    def __init__(self, rows, batch_rows=5000):
+        self._rows = iter(rows)
+        self._batch_rows = batch_rows
+        self._buf = bytearray()
+        self.rows = 0
+        self.bytes = 0
+
+    def _fill(self):
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n", quoting=csv.QUOTE_NONNUMERIC)
+        count = 0
+        for row in self._rows:
+            writer.writerow([NULL if value is None else value for value in row])
+            count += 1
+            if count >= self._batch_rows:
+                break
+        if not count:
+            return False
+        self.rows += count
+        self._buf += out.getvalue().encode("utf-8")
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            if not self._fill():
+                break
+        if size < 0 or size > len(self._buf):
+            size = len(self._buf)
+        chunk = bytes(self._buf[:size])
+        del self._buf[:size]
+        self.bytes += len(chunk)
+        return chunk
+
+
+def pg_type(data_type):
+    """Map a Spark SQL type to the PostgreSQL column type used for new targets"""
+    if isinstance(data_type, DecimalType):
+        return f"NUMERIC({data_type.precision},{data_type.scale})"
+    mapping = {
+        LongType: "BIGINT",
+        IntegerType: "INTEGER",
+        ShortType: "SMALLINT",
+        DoubleType: "DOUBLE PRECISION",
+        FloatType: "REAL",
+        BooleanType: "BOOLEAN",
+        DateType: "DATE",
+        TimestampType: "TIMESTAMP",
+        StringType: "TEXT",
+    }
+    return mapping.get(type(data_type), "TEXT")
+
+
+def create_target_sql(schema, target_table):
+    columns = ",\n  ".join(f"{field.name} {pg_type(field.dataType)}" for field in schema.fields)
+    return f"CREATE TABLE IF NOT EXISTS {target_table} (\n  {columns}\n)"
+
+
+def copy_partitions(df, conn_params, stage_table, batch_rows=5000):
+    """COPY every partition of df into stage_table; return per-partition metrics"""
+    column_list = ", ".join(df.columns)
+    copy_sql = f"COPY {stage_table} ({column_list}) FROM STDIN WITH (FORMAT csv)"
+
+    def _copy(index, rows):
+        start = time.perf_counter()
+        stream = CsvRowStream(rows, batch_rows)
+        conn = psycopg2.connect(**conn_params)
+        try:
+            with conn, conn.cursor() as cur:
+                cur.copy_expert(copy_sql, stream, size=COPY_BUFFER_SIZE)
+        finally:
+            conn.close()
+        yield {
+            "partition": index,
+            "rows": stream.rows,
+            "bytes": stream.bytes,
+            "seconds": time.perf_counter() - start,
+        }
+
+    return df.rdd.mapPartitionsWithIndex(_copy).collect()
+
+
+def publish_append(cur, stage_table, target_table, columns):
+    column_list = ", ".join(columns)
+    cur.execute(f"INSERT INTO {target_table} ({column_list}) SELECT {column_list} FROM {stage_table}")
+    return cur.rowcount
+
+
+def table_name(qualified_table):
+    return qualified_table.split(".")[-1]
+
+
+def has_unique_index(cur, target_table, key_columns):
+    """True if target_table has a unique index on exactly key_columns.
+
+    PRIMARY KEY and UNIQUE constraints are backed by pg_index entries, so
+    they count; partial and expression indexes cannot serve ON CONFLICT and
+    are ignored. The relation is resolved with to_regclass, so schema and
+    search_path are honoured.
+    """
+    cur.execute("""
+        SELECT array_agg(a.attname::text)
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey::int2[])
+        WHERE i.indrelid = to_regclass(%s)
+          AND i.indisunique AND i.indisvalid
+          AND i.indpred IS NULL AND i.indexprs IS NULL
+          AND i.indnatts = %s
+        GROUP BY i.indexrelid
+    """, (target_table, len(key_columns)))
+    wanted = {c.lower() for c in key_columns}
+    return any(set(columns) == wanted for (columns,) in cur.fetchall())
+
+
+def ensure_unique_index(cur, target_table, key_columns):
+    """Create the unique index ON CONFLICT needs unless an equivalent one exists
+
+    Raises RuntimeError if the target already holds duplicate keys (left by
+    earlier append runs): which copy to keep is not this loader's decision.
+    """
+    if has_unique_index(cur, target_table, key_columns):
+        return False
+
+    key_list = ", ".join(key_columns)
+    cur.execute(f"""
+        SELECT count(*), coalesce(sum(n - 1), 0)
+        FROM (SELECT count(*) AS n FROM {target_table} GROUP BY {key_list} HAVING count(*) > 1) d
+    """)
+    keys, extra_rows = cur.fetchone()
+    if keys:
+        raise RuntimeError(f"{target_table} has {keys:,} duplicated ({key_list}) keys ({extra_rows:,} extra rows); "
+                           "remove them before the first upsert run")
+
+    index_name = f"{table_name(target_table)}_{'_'.join(key_columns)}_key"
+    cur.execute(f"CREATE UNIQUE INDEX {index_name} ON {target_table} ({key_list})")
+    print(f"[+] Created unique index {index_name} on {target_table} ({key_list})")
+    return True
+
+
+def publish_upsert(cur, stage_table, target_table, columns, key_columns):
+    column_list = ", ".join(columns)
+    key_list = ", ".join(key_columns)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c not in key_columns)
+    action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    # DISTINCT ON keeps one row per key so a batch can't hit the same target row twice;
+    # ordering on every column makes the kept row the same on every retry
+    order = ", ".join([*key_columns, *(f"{c} DESC" for c in columns if c not in key_columns)])
+    cur.execute(f"""
+        INSERT INTO {target_table} ({column_list})
+        SELECT DISTINCT ON ({key_list}) {column_list} FROM {stage_table}
+        ORDER BY {order}
+        ON CONFLICT ({key_list}) {action}
+    """)
+    return cur.rowcount
+
+
+def print_partition_metrics(metrics):
+    for m in sorted(metrics, key=lambda m: m["partition"]):
+        rate = m["rows"] / m["seconds"] if m["seconds"] else 0.0
+        print(f"    partition {m['partition']:>4}: {m['rows']:>10,} rows "
+              f"in {m['seconds']:7.2f}s ({rate:,.0f} rows/s)")
+
+
+def copy_load(df, conn_params, target_table, mode="append", key_columns=("order_id",),
+              batch_rows=5000):
+    """Load df into target_table through an UNLOGGED staging table.
+
+    mode is "append" or "upsert"; upsert merges on key_columns.
+    Returns the per-partition metrics collected from the executors.
+    """
+    key_columns = list(key_columns)
+    stage_table = f"{target_table}_stage_{uuid.uuid4().hex[:8]}"
+    conn = psycopg2.connect(**conn_params)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(create_target_sql(df.schema, target_table))
+            if mode == "upsert":
+                ensure_unique_index(cur, target_table, key_columns)
+            cur.execute(f"CREATE UNLOGGED TABLE {stage_table} (LIKE {target_table} INCLUDING DEFAULTS)")
+
+        start = time.perf_counter()
+        metrics = copy_partitions(df, conn_params, stage_table, batch_rows)
+        copy_seconds = time.perf_counter() - start
+        staged = sum(m["rows"] for m in metrics)
+        print(f"[*] Staged {staged:,} rows into {stage_table} in {copy_seconds:.2f}s "
+              f"({staged / copy_seconds if copy_seconds else 0:,.0f} rows/s)")
+        print_partition_metrics(metrics)
+
+        with conn, conn.cursor() as cur:
+            if mode == "upsert":
+                published = publish_upsert(cur, stage_table, target_table, df.columns, key_columns)
+            else:
+                published = publish_append(cur, stage_table, target_table, df.columns)
+            cur.execute(f"DROP TABLE {stage_table}")
+        print(f"[+] Published {published:,} rows into {target_table} ({mode})")
+        return metrics
+    except Exception:
+        conn.rollback()
+        with conn, conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {stage_table}")
+        raise
+    finally:
+        conn.close()
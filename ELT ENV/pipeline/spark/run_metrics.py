@@ -0,0 +1,165 @@
+"""Per-stage run metrics for the Spark transform.
+
+Each pipeline stage runs under its own Spark job group. When the stage ends,
+the Spark stages of those jobs are looked up in the application status store
+(the data the UI's listener collects, served by the REST API on the driver)
+and summed into input/output rows and bytes, task counts and task skew.
+
+A run produces one JSON line, optionally also inserted into a run-history
+table in the staging database.
+"""
+
+import contextlib
+import datetime
+import json
+import time
+import urllib.request
+import uuid
+
+RUN_HISTORY_TABLE = "public.pipeline_run_history"
+
+
+def _get_json(url):
+    with urllib.request.urlopen(url, timeout=10) as resp:
+        return json.load(resp)
+
+
+class RunMetrics:
+    """Collects wall time and Spark task metrics for each named stage of a run"""
+
+    def __init__(self, spark, job_name):
+        self.spark = spark
+        self.sc = spark.sparkContext
+        self.run = {
+            "run_id": uuid.uuid4().hex,
+            "job": job_name,
+            "app_id": self.sc.applicationId,
+            "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "stages": [],
+        }
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a block and attach the Spark metrics of every job it triggered.
+
+        Yields the stage record so callers can add figures Spark does not
+        track itself (e.g. rows written through JDBC or COPY).
+        """
+        group = f"{self.run['run_id']}:{name}"
+        record = {"stage": name}
+        self.sc.setJobGroup(group, name)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 3)
+            self.sc.setLocalProperty("spark.jobGroup.id", None)
+            record.update(self._spark_stage_metrics(group))
+            self.run["stages"].append(record)
+
+    def _spark_stage_metrics(self, group):
+        tracker = self.sc.statusTracker()
+        stage_ids = set()
+        for job_id in tracker.getJobIdsForGroup(group):
+            job = tracker.getJobInfo(job_id)
+            if job:
+                stage_ids.update(job.stageIds)
+        totals = {
+            "spark_jobs": len(tracker.getJobIdsForGroup(group)),
+            "spark_stages": 0,
+            "tasks": 0,
+            "input_rows": 0,
+            "input_bytes": 0,
+            "output_rows": 0,
+            "output_bytes": 0,
+            "shuffle_read_bytes": 0,
+            "shuffle_write_bytes": 0,
+            "max_task_skew": None,
+        }
+        base = self.sc.uiWebUrl
+        if not base or not stage_ids:
+            return totals
+
+        api = f"{base}/api/v1/applications/{self.sc.applicationId}/stages"
+        for stage_id in sorted(stage_ids):
+            try:
+                attempts = _get_json(f"{api}/{stage_id}")
+            except OSError:
+                continue
+            # Skipped stages (cached/shuffle-reused) have no completed attempt
+            done = [a for a in attempts if a.get("status") == "COMPLETE"]
+            if not done:
+                continue
+            attempt = done[-1]
+            totals["spark_stages"] += 1
+            totals["tasks"] += attempt.get("numCompleteTasks", 0)
+            totals["input_rows"] += attempt.get("inputRecords", 0)
+            totals["input_bytes"] += attempt.get("inputBytes", 0)
+            totals["output_rows"] += attempt.get("outputRecords", 0)
+            totals["output_bytes"] += attempt.get("outputBytes", 0)
+            totals["shuffle_read_bytes"] += attempt.get("shuffleReadBytes", 0)
+            totals["shuffle_write_bytes"] += attempt.get("shuffleWriteBytes", 0)
+            skew = self._task_skew(api, stage_id, attempt["attemptId"])
+            if skew is not None and (totals["max_task_skew"] is None or skew > totals["max_task_skew"]):
+                totals["max_task_skew"] = skew
+        return totals
+
+    @staticmethod
+    def _task_skew(api, stage_id, attempt_id):
+        """Slowest task run time over the median one, or None if unavailable"""
+        try:
+            summary = _get_json(f"{api}/{stage_id}/{attempt_id}/taskSummary?quantiles=0.5,1.0")
+        except OSError:
+            return None
+        median, slowest = summary.get("executorRunTime", [0, 0])
+        if not median:
+            return None
+        return round(slowest / median, 2)
+
+    def finish(self, status):
+        self.run["status"] = status
+        self.run["seconds"] = round(time.perf_counter() - self._start, 3)
+        return self.run
+
+    def print_summary(self):
+        for s in self.run["stages"]:
+            skew = f", skew {s['max_task_skew']}x" if s.get("max_task_skew") else ""
+            print(f"    {s['stage']:<10} {s['seconds']:8.2f}s  in {s['input_rows']:>12,} rows "
+                  f"{s['input_bytes']:>14,} B  out {s.get('rows_written', s['output_rows']):>12,} rows  "
+                  f"{s['tasks']:>5} tasks{skew}")
+
+    def write_json_line(self, path):
+        """Append the run as one JSON line to path ("-" for stdout)"""
+        line = json.dumps(self.run, default=str)
+        if path == "-":
+            print(line)
+            return
+        with open(path, "a", encoding="utf-8") as fh:
+            fh.write(line + "\n")
+
+    def insert_history(self, conn_params, table=RUN_HISTORY_TABLE):
+        """Insert the run into the run-history table, creating it if needed"""
+        import psycopg2
+
+        conn = psycopg2.connect(**conn_params)
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                      run_id TEXT PRIMARY KEY,
+                      job TEXT NOT NULL,
+                      started_at TIMESTAMPTZ NOT NULL,
+                      seconds DOUBLE PRECISION,
+                      status TEXT,
+                      metrics JSONB NOT NULL
+                    )
+                """)
+                cur.execute(
+                    f"INSERT INTO {table} (run_id, job, started_at, seconds, status, metrics) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)",
+                    (self.run["run_id"], self.run["job"], self.run["started_at"],
+                     self.run.get("seconds"), self.run.get("status"), json.dumps(self.run, default=str)),
+                )
+        finally:
+            conn.close()
@@ -0,0 +1,151 @@
+"""Config-driven Silver → Gold runner
+
+Runs many Silver → Gold jobs in one SparkSession, so JVM and session startup
+is paid once per batch instead of once per table.
+
+Run with:
+  /opt/spark/bin/spark-submit \
+    --packages org.postgresql:postgresql:42.7.1 \
+    spark/transform_runner.py --config spark/jobs.yaml [--max-concurrent-jobs 3] [--only gold_orders]
+
+The config (YAML, or JSON if PyYAML is not installed) has a `defaults`
+mapping and a `jobs` list. Each job has:
+
+  name      job name (also the --incremental state key and metrics job)
+  filter    optional SQL predicate applied to the Silver rows
+  columns   optional mapping of derived column name -> SQL expression
+  pool      optional FAIR scheduler pool (defaults to the job name)
+
+Every other key is an option of 04_spark_transform.py with dashes written as
+underscores (source_table, target_table, mode, key_columns, writer,
+incremental, max_connections, ...); job keys override `defaults`.
+
+Jobs run on a thread pool of --max-concurrent-jobs workers with
+spark.scheduler.mode=FAIR, each in its own scheduler pool, so a large table
+cannot starve the others. Every job opens up to its own max_connections
+Postgres sessions, so keep max_concurrent_jobs * max_connections under the
+staging server's max_connections.
+"""
+
+import argparse
+import concurrent.futures
+import importlib.util
+import json
+import os
+import sys
+
+from pyspark.sql.functions import expr
+
+SPARK_DIR = os.path.dirname(os.path.abspath(__file__))
+JOB_KEYS = ("name", "filter", "columns", "pool")
+MAX_CONCURRENT_JOBS = 2
+
+
+def load_transform_module():
+    spec = importlib.util.spec_from_file_location(
+        "spark_transform", os.path.join(SPARK_DIR, "04_spark_transform.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_config(path):
+    with open(path, encoding="utf-8") as fh:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                sys.exit(f"[!] PyYAML is required to read {path}; install it or use a .json config")
+            config = yaml.safe_load(fh)
+        else:
+            config = json.load(fh)
+    if not config or not config.get("jobs"):
+        sys.exit(f"[!] {path} defines no jobs")
+    return config
+
+
+def job_argv(options):
+    """Turn a job's option mapping into 04_spark_transform.py arguments"""
+    argv = []
+    for key, value in options.items():
+        flag = "--" + key.replace("_", "-")
+        if isinstance(value, bool):
+            if value:
+                argv.append(flag)
+        elif isinstance(value, (list, tuple)):
+            argv += [flag, *map(str, value)]
+        elif value is not None:
+            argv += [flag, str(value)]
+    return argv
+
+
+def make_transform(job):
+    """Build the job's transform from its filter and derived columns"""
+    def transform_fn(df):
+        if job.get("filter"):
+            df = df.filter(job["filter"])
+        for name, expression in (job.get("columns") or {}).items():
+            df = df.withColumn(name, expr(expression))
+        return df
+    return transform_fn
+
+
+def run_job(spark, transform_job, job, args):
+    sc = spark.sparkContext
+    sc.setLocalProperty("spark.scheduler.pool", job.get("pool", job["name"]))
+    try:
+        print(f"[*] Starting {job['name']}: {args.source_table} -> {args.target_table} ({args.mode})")
+        return transform_job.run(spark, args, make_transform(job))
+    finally:
+        sc.setLocalProperty("spark.scheduler.pool", None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run config-defined Silver → Gold jobs in one SparkSession")
+    parser.add_argument("--config", required=True, help="YAML or JSON job definitions")
+    parser.add_argument("--max-concurrent-jobs", type=int, default=MAX_CONCURRENT_JOBS)
+    parser.add_argument("--only", nargs="+", help="run only these job names")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    defaults = config.get("defaults") or {}
+    jobs = [j for j in config["jobs"] if not args.only or j["name"] in args.only]
+    if not jobs:
+        print("[!] No jobs selected")
+        return False
+
+    transform_job = load_transform_module()
+    # Parse every job's options up front so a bad config fails before Spark starts
+    planned = []
+    for job in jobs:
+        options = {**defaults, **{k: v for k, v in job.items() if k not in JOB_KEYS}}
+        planned.append((job, transform_job.parse_args(job_argv({"job_name": job["name"], **options}))))
+
+    # All jobs share one session, hence one catalog: the first job's warehouse
+    spark = transform_job.build_spark(planned[0][1].warehouse, app_name="silver_to_gold_runner",
+                                      conf={"spark.scheduler.mode": "FAIR"})
+    results = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_concurrent_jobs) as pool:
+            futures = {
+                pool.submit(run_job, spark, transform_job, job, job_args): job["name"]
+                for job, job_args in planned
+            }
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                try:
+                    results[name] = future.result()
+                except Exception as exc:
+                    print(f"[!] Job {name} failed: {exc}")
+                    results[name] = False
+    finally:
+        spark.stop()
+
+    failed = [name for name, ok in results.items() if not ok]
+    print(f"[+] {len(results) - len(failed)}/{len(results)} jobs succeeded"
+          + (f"; failed: {', '.join(failed)}" if failed else ""))
+    return not failed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -2,12 +2,24 @@
 """
 PostgreSQL pg_hba.conf Configuration Fix
 Connects to the server and adds the necessary pg_hba.conf entry
+All steps share one multiplexed SSH connection (ssh_session.py); the rule
+check and edit run locally on the parsed file (pg_hba.py)
+
+An existing rule for the same connections with another method (conflict), or
+an earlier rule with another method matching some or all of them (shadowed),
+stops the run; --force inserts the entry before that rule anyway.
+
+Run with:
+  python3 fix_postgresql.py [--force]
 """
 
-import subprocess
+import argparse
 import json
 import sys
 
+import pg_hba
+from ssh_session import get_session
+
 # Configuration
 HOST = "192.168.180.166"
 USERNAME = "bob.wabusa"
@@ -19,41 +31,26 @@ DB_NAME = "claimant_db"
 PG_HBA_CONF = "/etc/postgresql/15/main/pg_hba.conf"
 
 def run_ssh_command(command, show_output=True):
-    """Run a command on the remote server via SSH"""
-    ssh_cmd = [
-        "ssh",
-        "-o", "StrictHostKeyChecking=no",
-        "-o", "ConnectTimeout=20",
-        "-o", "PasswordAuthentication=yes",
-        f"{USERNAME}@{HOST}",
-        command
-    ]
-    
-    try:
-        result = subprocess.run(
-            ssh_cmd,
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-        
-        if show_output and result.stdout:
-            print(result.stdout)
-        
-        if result.stderr and "warning" not in result.stderr.lower():
-            if show_output:
-                print(f"[!] {result.stderr}")
-        
-        return result.returncode == 0, result.stdout, result.stderr
-    
-    except subprocess.TimeoutExpired:
+    """Run a command on the remote server via SSH (over the shared session)"""
+    ok, stdout, stderr = get_session(HOST, USERNAME, PORT).run(command)
+    _report(stdout, stderr, show_output)
+    return ok, stdout, stderr
+
+def _report(stdout, stderr, show_output):
+    if show_output and stdout:
+        print(stdout)
+    if stderr == "Timeout":
         print("[!] SSH command timed out")
-        return False, "", "Timeout"
-    except Exception as e:
-        print(f"[!] Error running SSH command: {e}")
-        return False, "", str(e)
+    elif stderr and "warning" not in stderr.lower():
+        if show_output:
+            print(f"[!] {stderr}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Add the client's pg_hba.conf entry")
+    parser.add_argument("--force", action="store_true",
+                        help="insert before a conflicting or shadowing rule with another method")
+    args = parser.parse_args()
+
     print("=" * 50)
     print("PostgreSQL pg_hba.conf Configuration Fix")
     print("=" * 50)
@@ -64,66 +61,55 @@ def main():
     print(f"[*] User: {DB_USER}")
     print()
     
-    # Step 1: Backup pg_hba.conf
-    print("[1/5] Backing up pg_hba.conf...")
-    success, _, _ = run_ssh_command(
-        f"sudo cp {PG_HBA_CONF} {PG_HBA_CONF}.backup && echo '[+] Backup created'",
-        show_output=False
-    )
-    if not success:
-        print("[!] Could not create backup")
+    session = get_session(HOST, USERNAME, PORT)
+
+    # Step 1: Read pg_hba.conf once; everything up to the push runs locally
+    print("[1/5] Reading pg_hba.conf...")
+    try:
+        original, sha = pg_hba.fetch(session, PG_HBA_CONF)
+        hba = pg_hba.HbaFile(original)
+    except (RuntimeError, ValueError) as e:
+        print(f"[!] {e}")
         return False
-    print("[+] Backup created")
+    print(f"[+] {len(hba.rules)} rules parsed")
     print()
     
-    # Step 2: Check for existing entry
+    # Step 2: Check for an identical, covering or shadowing rule
     print("[2/5] Checking for existing entry...")
-    success, output, _ = run_ssh_command(
-        f"grep -c 'host.*{DB_NAME}.*{DB_USER}.*{CLIENT_IP}' {PG_HBA_CONF} || true",
-        show_output=False
-    )
-    
-    entry_exists = output.strip() != "0"
-    if entry_exists:
-        print("[!] Entry already exists")
+    rule = pg_hba.HbaRule("host", [DB_NAME], [DB_USER], f"{CLIENT_IP}/32", "md5")
+    action, other = hba.add(rule, force=args.force)
+    if action in pg_hba.NEEDS_FORCE:
+        print(f"[!] {other} {'conflicts with' if action == 'conflict' else 'shadows'} the new entry "
+              f"({other.method}, not {rule.method}); re-run with --force to insert it before that line")
+        return False
+    if action in ("present", "covered"):
+        print(f"[!] Entry already {action} by {other}")
+    elif action == "insert":
+        print(f"[!] --force: inserting the new entry before {other}")
     else:
         print("[+] Entry does not exist, adding...")
     print()
     
-    # Step 3: Add new entry if needed
-    if not entry_exists:
+    # Step 3: Edit in memory
+    if action in pg_hba.EDITS:
         print("[3/5] Adding new pg_hba.conf entry...")
-        new_entry = f"host    {DB_NAME}     {DB_USER}    {CLIENT_IP}/32        md5"
-        cmd = f"echo '{new_entry}' | sudo tee -a {PG_HBA_CONF} > /dev/null && echo '[+] Entry added'"
-        success, _, _ = run_ssh_command(cmd, show_output=False)
-        if not success:
-            print("[!] Could not add entry")
-            return False
-        print(f"[+] Added: {new_entry}")
+        print(hba.diff(original))
     else:
         print("[3/5] Skipping (entry already exists)")
-    print()
+        print()
     
-    # Step 4: Verify entry
-    print("[4/5] Verifying pg_hba.conf...")
-    success, output, _ = run_ssh_command(
-        f"sudo tail -5 {PG_HBA_CONF}",
-        show_output=False
-    )
-    print("Last 5 lines of pg_hba.conf:")
-    print(output)
-    print()
-    
-    # Step 5: Reload PostgreSQL
-    print("[5/5] Reloading PostgreSQL...")
-    success, _, _ = run_ssh_command(
-        "sudo systemctl reload postgresql && echo '[+] PostgreSQL reloaded'",
-        show_output=False
-    )
-    if not success:
-        print("[!] Could not reload PostgreSQL")
-        return False
-    print("[+] PostgreSQL reloaded successfully")
+    # Steps 4 and 5: backup, atomic replace, pg_hba_file_rules check and reload in one round trip
+    if action in pg_hba.EDITS:
+        print("[4/5] Backing up and replacing pg_hba.conf...")
+        print("[5/5] Reloading PostgreSQL...")
+        success, error = pg_hba.push(session, PG_HBA_CONF, hba.render(), sha, f"{PG_HBA_CONF}.backup")
+        if not success:
+            print(f"[!] Could not update pg_hba.conf: {error}")
+            return False
+        print("[+] Backup created, pg_hba.conf replaced and PostgreSQL reloaded successfully")
+    else:
+        print("[4/5] Skipping (pg_hba.conf unchanged)")
+        print("[5/5] Skipping reload")
     print()
     
     print("=" * 50)
@@ -4,9 +4,9 @@ PostgreSQL Configuration Fix via Direct SQL Connection
 This script connects directly to PostgreSQL and modifies the configuration
 """
 
-import subprocess
 import sys
-import os
+
+import pg_probe
 
 # Configuration
 HOST = "192.168.180.166"
@@ -57,50 +57,15 @@ def main():
     print(f'  psql -h {HOST} -p {PORT} -d {CLAIMANT_DB} -U {CLAIMANT_USER} -c "SELECT version();"')
     print()
     
-    # Try a test connection with subprocess
-    print("[*] Testing connection with sslmode=disable...")
-    
-    env = os.environ.copy()
-    env['PGPASSWORD'] = CLAIMANT_PASSWORD
-    
-    psql_commands = [
-        # Try different SSL modes
-        [
-            'psql', '-h', HOST, '-p', str(PORT), '-d', CLAIMANT_DB, 
-            '-U', CLAIMANT_USER, '-c', 'SELECT version();', '-v', 'sslmode=disable'
-        ],
-        [
-            'psql', '-h', HOST, '-p', str(PORT), '-d', CLAIMANT_DB, 
-            '-U', CLAIMANT_USER, '-c', 'SELECT version();'
-        ]
-    ]
-    
-    for cmd in psql_commands:
-        try:
-            result = subprocess.run(
-                cmd,
-                env=env,
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            
-            if result.returncode == 0:
-                print("[+] Connection successful!")
-                print(result.stdout)
-                return True
-            else:
-                print(f"[!] Connection failed:")
-                print(result.stderr if result.stderr else result.stdout)
-        
-        except FileNotFoundError:
-            print("[!] psql command not found. Please install PostgreSQL client tools.")
-            return False
-        except subprocess.TimeoutExpired:
-            print("[!] Connection timed out.")
-        except Exception as e:
-            print(f"[!] Error: {e}")
-    
+    # Test every sslmode at once with the native probe (no psql needed)
+    print("[*] Testing connection with sslmode=disable, prefer and require...")
+    results = pg_probe.check([("claimants", HOST)], ports=(PORT,), user=CLAIMANT_USER,
+                             dbname=CLAIMANT_DB, password=CLAIMANT_PASSWORD)
+    working = [mode for (_, _, mode), r in results.items() if r["status"] == "OK"]
+    if working:
+        print(f"[+] Connection successful with sslmode={', '.join(working)}")
+        return True
+    print("[!] Connection failed with every sslmode")
     return False
 
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL pg_hba.conf Fleet Rollout
+fix_postgresql.py for many servers at once: reads an inventory of
+host x (database, user, client CIDR) rules and applies them to every host
+concurrently, up to --workers hosts at a time.
+
+Each host gets one SSH session (ssh_session.py) and two round trips: the
+file is read once, every rule is checked and added in memory (pg_hba.py),
+and backup, atomic replace and reload go out together. The run ends with
+a per-host latency/status table, so a rollout takes about as long as the
+slowest host instead of the sum of all of them.
+
+Inventory (pg_hba_inventory.txt), one rule per line, '#' comments:
+    # host            database     user           client CIDR        [method] [path=...] [user=...]
+    192.168.180.166   claimant_db  claimant_user  192.168.3.106/32   md5
+    192.168.180.175   all          metabase       192.168.180.176/32
+    192.168.180.180   all          metabase       192.168.180.176/32 path=/etc/postgresql/16/main/pg_hba.conf user=dba
+
+path= and user= set that host's pg_hba.conf and SSH user instead of --pg-hba
+and --user; they apply to every rule of the host, so give them on one line or
+repeat the same values.
+
+A rule that conflicts with an existing one for the same connections (another
+method) or is shadowed, wholly or in part, by an earlier rule with another
+method fails its host without touching the file; --force inserts it before
+that rule.
+
+Concurrent SSH logins cannot share one password prompt: use key-based
+authentication for the fleet, or --workers 1.
+
+Run with:
+  python3 fix_postgresql_fleet.py --inventory pg_hba_inventory.txt --dry-run
+  python3 fix_postgresql_fleet.py --inventory pg_hba_inventory.txt --workers 8
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import ipaddress
+import sys
+import time
+
+from fix_postgresql import PG_HBA_CONF, PORT, USERNAME
+import pg_hba
+from ssh_session import get_session
+
+INVENTORY = "pg_hba_inventory.txt"
+WORKERS = 8
+DEFAULT_METHOD = "md5"
+HOST_OPTIONS = ("path", "user")
+
+
+def read_inventory(path):
+    """({host: [(database, user, cidr, method), ...]}, {host: {"path": ..., "user": ...}}) in file order"""
+    hosts, options = {}, {}
+    with open(path) as fh:
+        for lineno, line in enumerate(fh, 1):
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            settings = dict(field.split("=", 1) for field in fields if "=" in field)
+            fields = [field for field in fields if "=" not in field]
+            if len(fields) not in (4, 5) or set(settings) - set(HOST_OPTIONS):
+                raise ValueError(f"{path}:{lineno}: expected host database user cidr [method] [path=...] [user=...]")
+            host, database, user, cidr = fields[:4]
+            method = fields[4] if len(fields) == 5 else DEFAULT_METHOD
+            # a bare address becomes a /32 (or /128) like fix_postgresql.py writes
+            cidr = str(ipaddress.ip_network(cidr, strict=False))
+            rules = hosts.setdefault(host, [])
+            if (database, user, cidr, method) not in rules:
+                rules.append((database, user, cidr, method))
+            host_options = options.setdefault(host, {})
+            for key, value in settings.items():
+                if host_options.setdefault(key, value) != value:
+                    raise ValueError(f"{path}:{lineno}: {host} already has {key}={host_options[key]}")
+    return hosts, options
+
+
+def apply_host(host, rules, args, timestamp, options=None):
+    """Read, edit in memory and push one host's pg_hba.conf; return a result dict for the summary table
+
+    options are the host's inventory settings (path=, user=); missing ones
+    fall back to --pg-hba and --user.
+    """
+    options = options or {}
+    hba_path = options.get("path", args.pg_hba)
+    ssh_user = options.get("user", args.user)
+    backup = f"{hba_path}.backup.{timestamp}"
+    start = time.time()
+    result = {"host": host, "rules": len(rules), "added": 0, "existing": 0, "error": None, "backup": None, "diff": "",
+              "path": hba_path, "user": ssh_user}
+    blocked = []
+    try:
+        session = get_session(host, ssh_user, args.port)
+        original, sha = pg_hba.fetch(session, hba_path)
+        hba = pg_hba.HbaFile(original)
+        for database, user, cidr, method in rules:
+            action, other = hba.add(pg_hba.HbaRule("host", [database], [user], cidr, method), force=args.force)
+            if action in pg_hba.NEEDS_FORCE:
+                blocked.append(f"{database}/{user}/{cidr} {action} by line {other.lineno} ({other.method})")
+            elif action in pg_hba.EDITS:
+                result["added"] += 1
+            else:
+                result["existing"] += 1
+        result["diff"] = hba.diff(original, f"{host}:{hba_path}")
+        if blocked:
+            # leave the host untouched until the conflicts are resolved or forced
+            result["error"] = "; ".join(blocked) + " (use --force)"
+        elif result["added"] and not args.dry_run:
+            result["backup"] = backup
+            ok, error = pg_hba.push(session, hba_path, hba.render(), sha, backup)
+            if not ok:
+                result["error"] = error
+    except (RuntimeError, ValueError, OSError) as e:
+        result["error"] = str(e)
+    result["seconds"] = time.time() - start
+    return result
+
+
+def print_summary(results, total):
+    print()
+    print(f"{'host':<20} {'rules':>5} {'added':>6} {'exist':>6} {'seconds':>8}  status")
+    print("-" * 72)
+    for r in sorted(results, key=lambda r: r["seconds"], reverse=True):
+        status = "OK" if r["error"] is None else f"FAILED ({r['error']})"
+        print(f"{r['host']:<20} {r['rules']:>5} {r['added']:>6} {r['existing']:>6} {r['seconds']:>8.1f}  {status}")
+    print("-" * 72)
+    serial = sum(r["seconds"] for r in results)
+    failed = sum(r["error"] is not None for r in results)
+    print(f"{len(results)} hosts, {failed} failed, wall time {total:.1f}s (sum of hosts {serial:.1f}s)")
+    if failed:
+        print()
+        print("To restore a host from this run's backup (if it got that far):")
+        for r in results:
+            if r["error"] is not None and r["backup"]:
+                print(f"   ssh {r['user']}@{r['host']} 'sudo cp {r['backup']} {r['path']} && sudo systemctl reload postgresql'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pg_hba.conf rules to many PostgreSQL hosts concurrently")
+    parser.add_argument("--inventory", default=INVENTORY)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="hosts configured at the same time")
+    parser.add_argument("--user", default=USERNAME, help="SSH user for hosts without user= in the inventory")
+    parser.add_argument("--port", type=int, default=PORT, help="SSH port")
+    parser.add_argument("--pg-hba", default=PG_HBA_CONF, help="pg_hba.conf for hosts without path= in the inventory")
+    parser.add_argument("--dry-run", action="store_true", help="read and diff every host, change nothing")
+    parser.add_argument("--force", action="store_true",
+                        help="insert rules before conflicting or shadowing rules with another method")
+    args = parser.parse_args()
+
+    hosts, options = read_inventory(args.inventory)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    print("=" * 50)
+    print("PostgreSQL pg_hba.conf Fleet Rollout")
+    print("=" * 50)
+    print(f"[*] Inventory: {args.inventory} ({len(hosts)} hosts, {sum(map(len, hosts.values()))} rules)")
+    print(f"[*] Workers: {args.workers}")
+    print()
+
+    start = time.time()
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(apply_host, host, rules, args, timestamp, options[host])
+                   for host, rules in hosts.items()]
+        for future in concurrent.futures.as_completed(futures):
+            r = future.result()
+            results.append(r)
+            if args.dry_run and r["diff"]:
+                print(r["diff"])
+            if r["error"]:
+                print(f"[!] {r['host']}: {r['error']}")
+            else:
+                print(f"[+] {r['host']}: {r['added']} added, {r['existing']} already present ({r['seconds']:.1f}s)")
+
+    print_summary(results, time.time() - start)
+    return all(r["error"] is None for r in results)
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except (OSError, ValueError) as e:
+        print(f"[!] {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        sys.exit(1)
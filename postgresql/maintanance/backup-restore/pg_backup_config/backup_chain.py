@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL Incremental Backup Chains
+Daily backups whose size and time follow the changed blocks, not the database size.
+
+  backup   take the next backup of the chain:
+             FULL         first run, weekly (--full-weekday), chain at --max-chain, or --full
+             INCREMENTAL  PostgreSQL 17+ with summarize_wal = on:
+                          pg_basebackup --incremental=<previous backup_manifest>
+             WAL          older servers / summarize_wal off: switch WAL and record the
+                          archived LSN range since the previous backup (restore = chain + replay)
+  restore  rebuild a data directory: extract every tar of the chain and
+           pg_combinebackup them into --target
+  list     show the chains in the catalog
+
+Backups are streamed with backup_stream.py. Every backup is recorded in
+public.backup_metadata (postgresql_backup_restore_automation.sql) with its
+chain, parent and LSN range. Nothing is deleted here: retention_engine.py
+expires chain backups with the same GFS plan as every other backup and keeps
+each chain member a kept incremental is built on, so an incremental never
+outlives its full backup.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import backup_stream
+from backup_common import (
+    BACKUP_DIR, LOG_DIR, REMOTE_BACKUP_DIR, RETENTION_DAYS, WAL_ARCHIVE_DIR,
+    Logger, run_sql,
+)
+
+LOG_FILE = f"{LOG_DIR}/pg_backup_chain.log"
+DATABASE_NAME = "cluster"  # backup_metadata.database_name for whole-instance backups
+MAX_CHAIN = 7
+FULL_WEEKDAY = 6  # Sunday
+
+CATALOG_DDL = """
+CREATE TABLE IF NOT EXISTS public.backup_metadata (
+    backup_id SERIAL PRIMARY KEY,
+    backup_name VARCHAR(255) NOT NULL UNIQUE,
+    database_name VARCHAR(255) NOT NULL,
+    backup_type VARCHAR(50) NOT NULL,
+    backup_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    backup_size_bytes BIGINT,
+    backup_location TEXT,
+    duration_seconds INT,
+    status VARCHAR(50) DEFAULT 'PENDING',
+    retention_days INT DEFAULT 30,
+    notes TEXT
+);
+ALTER TABLE public.backup_metadata
+    ADD COLUMN IF NOT EXISTS chain_name VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS parent_backup_name VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS start_lsn PG_LSN,
+    ADD COLUMN IF NOT EXISTS end_lsn PG_LSN,
+    ADD COLUMN IF NOT EXISTS remote_location TEXT;
+CREATE INDEX IF NOT EXISTS backup_metadata_chain_idx ON public.backup_metadata (chain_name, backup_date);
+"""
+
+CHAIN_COLUMNS = ("backup_name", "backup_type", "backup_date", "chain_name", "parent_backup_name",
+                 "start_lsn", "end_lsn", "backup_location", "remote_location", "backup_size_bytes")
+
+
+def fetch_rows(where, order="backup_date", **variables):
+    rows = run_sql(f"""
+        SELECT {', '.join(CHAIN_COLUMNS)}
+        FROM public.backup_metadata
+        WHERE database_name = :'database_name' AND status IN ('COMPLETED', 'VERIFIED') AND {where}
+        ORDER BY {order}
+    """, database_name=DATABASE_NAME, **variables)
+    return [dict(zip(CHAIN_COLUMNS, row)) for row in rows]
+
+
+def chain_members(chain_name):
+    return fetch_rows("chain_name = :'chain_name'", chain_name=chain_name)
+
+
+def latest_backup():
+    rows = fetch_rows("backup_type IN ('FULL', 'INCREMENTAL', 'WAL')", order="backup_date DESC LIMIT 1")
+    return rows[0] if rows else None
+
+
+def register(name, backup_type, chain_name, parent, start_lsn, end_lsn, size, location, remote,
+             duration, retention_days, notes=None):
+    run_sql("""
+        INSERT INTO public.backup_metadata
+            (backup_name, database_name, backup_type, backup_size_bytes, backup_location,
+             duration_seconds, status, retention_days, notes,
+             chain_name, parent_backup_name, start_lsn, end_lsn, remote_location)
+        VALUES
+            (:'name', :'database_name', :'backup_type', NULLIF(:'size', '')::bigint, :'location',
+             NULLIF(:'duration', '')::int, 'COMPLETED', :'retention_days'::int, NULLIF(:'notes', ''),
+             :'chain_name', NULLIF(:'parent', ''), NULLIF(:'start_lsn', '')::pg_lsn,
+             NULLIF(:'end_lsn', '')::pg_lsn, NULLIF(:'remote', ''))
+    """, name=name, database_name=DATABASE_NAME, backup_type=backup_type, size=size,
+        location=location, duration=duration, retention_days=retention_days, notes=notes,
+        chain_name=chain_name, parent=parent, start_lsn=start_lsn, end_lsn=end_lsn, remote=remote)
+
+
+def manifest_lsns(manifest_path):
+    """Return (start_lsn, end_lsn) from a backup_manifest's WAL-Ranges"""
+    with open(manifest_path) as fh:
+        ranges = json.load(fh).get("WAL-Ranges", [])
+    if not ranges:
+        return None, None
+    return ranges[0]["Start-LSN"], ranges[-1]["End-LSN"]
+
+
+def incremental_supported():
+    """True if the server can take pg_basebackup --incremental backups"""
+    rows = run_sql("SELECT current_setting('server_version_num')::int >= 170000 "
+                   "AND coalesce(current_setting('summarize_wal', true), 'off') = 'on'")
+    return rows and rows[0][0] == "t"
+
+
+def choose_type(args, previous, log):
+    if args.full or previous is None:
+        return "FULL"
+    members = chain_members(previous["chain_name"])
+    if len(members) >= args.max_chain:
+        log(f"Chain {previous['chain_name']} has {len(members)} backups, starting a new one")
+        return "FULL"
+    if datetime.date.today().weekday() == args.full_weekday:
+        return "FULL"
+    if incremental_supported():
+        return "INCREMENTAL"
+    log("Incremental backups need PostgreSQL 17 with summarize_wal = on; using the WAL fallback")
+    return "WAL"
+
+
+def parent_manifest(chain_name):
+    """backup_manifest of the newest FULL/INCREMENTAL member, the base for the next incremental"""
+    for member in reversed(chain_members(chain_name)):
+        if member["backup_type"] in ("FULL", "INCREMENTAL"):
+            path = os.path.join(member["backup_location"], "backup_manifest")
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def take_stream_backup(args, backup_type, previous, log):
+    stream_argv = ["--retention-days", "0", "--sudo-user", args.sudo_user,
+                   "--backup-dir", args.backup_dir, "--remote-dir", args.remote_dir]
+    if args.no_remote:
+        stream_argv.append("--no-remote")
+    if backup_type == "INCREMENTAL":
+        manifest = parent_manifest(previous["chain_name"])
+        if manifest is None:
+            log("WARNING: previous backup_manifest not found locally, taking a FULL backup instead")
+            backup_type = "FULL"
+        else:
+            stream_argv += ["--incremental-from", manifest]
+
+    start = time.time()
+    metrics = backup_stream.run(backup_stream.parse_args(stream_argv), log)
+    if metrics is None:
+        return None
+    manifest_path = os.path.join(metrics["local_dir"], "backup_manifest")
+    start_lsn, end_lsn = manifest_lsns(manifest_path) if metrics["manifest_found"] else (None, None)
+    name = metrics["backup_name"]
+    chain_name = name if backup_type == "FULL" else previous["chain_name"]
+    register(name, backup_type, chain_name, None if backup_type == "FULL" else previous["backup_name"],
+             start_lsn, end_lsn, metrics["phases"]["compress"]["bytes"], metrics["local_dir"],
+             metrics["remote_dir"], int(time.time() - start), args.retention_days,
+             notes=f"sha256={metrics['sha256']}")
+    return name
+
+
+def take_wal_checkpoint(args, previous, log):
+    """WAL fallback: the WAL archive since the previous backup is the increment"""
+    start = time.time()
+    end_lsn = run_sql("SELECT pg_switch_wal()")[0][0]
+    start_lsn = previous["end_lsn"] or None
+    size = None
+    if start_lsn:
+        size = run_sql("SELECT pg_wal_lsn_diff(:'end_lsn', :'start_lsn')::bigint",
+                       end_lsn=end_lsn, start_lsn=start_lsn)[0][0]
+    name = f"walrange_{datetime.datetime.now():%Y-%m-%d_%H%M%S}"
+    register(name, "WAL", previous["chain_name"], previous["backup_name"], start_lsn, end_lsn, size,
+             WAL_ARCHIVE_DIR, None, int(time.time() - start), args.retention_days,
+             notes="restore: replay archived WAL up to end_lsn")
+    log(f"Recorded WAL range {start_lsn} .. {end_lsn} ({size or '?'} bytes) on chain {previous['chain_name']}")
+    return name
+
+
+def cmd_backup(args, log):
+    log("========== Starting Chained Backup ==========")
+    run_sql(CATALOG_DDL)
+    previous = latest_backup()
+    backup_type = choose_type(args, previous, log)
+    log(f"Backup type: {backup_type}" + (f" (chain {previous['chain_name']})" if backup_type != "FULL" else ""))
+
+    if backup_type == "WAL":
+        name = take_wal_checkpoint(args, previous, log)
+    else:
+        name = take_stream_backup(args, backup_type, previous, log)
+    if name is None:
+        log("ERROR: Backup failed")
+        return False
+
+    log(f"========== Chained Backup Complete: {name} ==========")
+    return True
+
+
+def extract(archive, directory):
+    os.makedirs(directory, exist_ok=True)
+    decompress = ["lz4", "-dc", archive] if archive.endswith(".lz4") else ["zstd", "-dc", archive]
+    with subprocess.Popen(decompress, stdout=subprocess.PIPE) as proc:
+        subprocess.run(["tar", "-xf", "-", "-C", directory], stdin=proc.stdout, check=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{decompress[0]} failed on {archive}")
+
+
+def restore_chain(backup_name=None):
+    """Return the FULL/INCREMENTAL members needed for backup_name (default latest) and any WAL ranges after"""
+    target = fetch_rows("backup_name = :'name'", name=backup_name) if backup_name else [latest_backup()]
+    if not target or target[0] is None:
+        raise RuntimeError(f"backup {backup_name or '(latest)'} not found in the catalog")
+    members = chain_members(target[0]["chain_name"])
+    upto = [m for m in members if m["backup_date"] <= target[0]["backup_date"]]
+    images = [m for m in upto if m["backup_type"] in ("FULL", "INCREMENTAL")]
+    wal = [m for m in upto if m["backup_type"] == "WAL" and m["backup_date"] > images[-1]["backup_date"]]
+    return images, wal
+
+
+def cmd_restore(args, log):
+    images, wal = restore_chain(args.backup)
+    if os.path.exists(args.target) and os.listdir(args.target):
+        log(f"ERROR: {args.target} is not empty")
+        return False
+    log(f"Restoring chain {images[0]['chain_name']}: {', '.join(m['backup_name'] for m in images)}")
+    work = tempfile.mkdtemp(prefix="pg_combine_", dir=args.work_dir)
+    try:
+        dirs = []
+        for member in images:
+            archive = next(os.path.join(member["backup_location"], f)
+                           for f in os.listdir(member["backup_location"]) if f.startswith("base.tar."))
+            directory = os.path.join(work, member["backup_name"])
+            log(f"Extracting {archive}")
+            extract(archive, directory)
+            dirs.append(directory)
+
+        if len(dirs) == 1:
+            shutil.copytree(dirs[0], args.target, dirs_exist_ok=True)
+        else:
+            log(f"Running pg_combinebackup over {len(dirs)} backups")
+            subprocess.run(["pg_combinebackup", *dirs, "-o", args.target], check=True)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    if wal:
+        log(f"Replay archived WAL up to {wal[-1]['end_lsn']} to reach {wal[-1]['backup_name']}:")
+        log(f"  restore_command = 'gunzip -c {WAL_ARCHIVE_DIR}/%f.gz > %p'")
+        log(f"  recovery_target_lsn = '{wal[-1]['end_lsn']}'  (and touch {args.target}/recovery.signal)")
+    log(f"Restored into {args.target}")
+    return True
+
+
+def cmd_list(args, log):
+    rows = fetch_rows("chain_name IS NOT NULL", order="chain_name, backup_date")
+    chain = None
+    for row in rows:
+        if row["chain_name"] != chain:
+            chain = row["chain_name"]
+            print(f"chain {chain}")
+        size = int(row["backup_size_bytes"] or 0) / (1 << 20)
+        print(f"  {row['backup_type']:<12} {row['backup_name']:<32} {row['backup_date'][:19]}  "
+              f"{size:>10,.1f} MB  {row['start_lsn'] or '-'} .. {row['end_lsn'] or '-'}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full/incremental backup chains with a catalog in backup_metadata")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    backup = sub.add_parser("backup", help="take the next backup of the current chain")
+    backup.add_argument("--full", action="store_true", help="force a new FULL backup")
+    backup.add_argument("--max-chain", type=int, default=MAX_CHAIN, help="backups per chain before a new FULL")
+    backup.add_argument("--full-weekday", type=int, default=FULL_WEEKDAY, help="0=Monday .. 6=Sunday")
+    backup.add_argument("--retention-days", type=int, default=RETENTION_DAYS,
+                        help="recorded in backup_metadata; retention_engine.py does the deleting")
+    backup.add_argument("--backup-dir", default=BACKUP_DIR)
+    backup.add_argument("--remote-dir", default=REMOTE_BACKUP_DIR)
+    backup.add_argument("--no-remote", action="store_true")
+    backup.add_argument("--sudo-user", default="postgres")
+
+    restore = sub.add_parser("restore", help="rebuild a data directory from a chain")
+    restore.add_argument("--target", required=True, help="empty directory to restore into")
+    restore.add_argument("--backup", help="restore up to this backup (default: latest)")
+    restore.add_argument("--work-dir", default=None, help="scratch space for extracted tars")
+
+    sub.add_parser("list", help="list chains in the catalog")
+    args = parser.parse_args()
+
+    log = Logger(LOG_FILE)
+    commands = {"backup": cmd_backup, "restore": cmd_restore, "list": cmd_list}
+    try:
+        return commands[args.command](args, log)
+    except (RuntimeError, subprocess.CalledProcessError) as e:
+        log(f"ERROR: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        sys.exit(1)
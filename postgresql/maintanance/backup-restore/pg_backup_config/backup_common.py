@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Shared settings and helpers for the Python backup tools
+Mirrors the configuration block of pg_basebackup.sh / wal_cleanup.sh
+"""
+
+import os
+import subprocess
+import time
+
+# Configuration
+BACKUP_ROOT = "/var/backups/postgresql"
+BACKUP_DIR = f"{BACKUP_ROOT}/base"
+WAL_ARCHIVE_DIR = f"{BACKUP_ROOT}/wal_archive"
+LOG_DIR = "/var/log/postgresql"
+RETENTION_DAYS = 14
+
+# SMB Configuration for remote copy
+SMB_CRED_FILE = "/root/.smbcred_backup"
+SMB_SHARE = "//192.168.180.161/db_backups$"
+SMB_MOUNT_POINT = "/mnt/db_backup_share"
+REMOTE_BACKUP_DIR = f"{SMB_MOUNT_POINT}/CLAIMANTSDB-TEST"
+REMOTE_WAL_DIR = f"{REMOTE_BACKUP_DIR}/wal_archive"
+
+# Catalog (public.backup_metadata from postgresql_backup_restore_automation.sql)
+CATALOG_DB = "postgres"
+PSQL_CMD = ["sudo", "-u", "postgres", "psql"]
+
+
+class Logger:
+    """Same line format as the shell scripts' log(): timestamp - message, to file and stdout"""
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+
+    def __call__(self, message):
+        line = f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {message}"
+        print(line, flush=True)
+        with open(self.log_file, "a") as fh:
+            fh.write(line + "\n")
+
+
+def is_mounted(mount_point=SMB_MOUNT_POINT):
+    return subprocess.run(["mountpoint", "-q", mount_point]).returncode == 0
+
+
+def ensure_mount(log, mount_point=SMB_MOUNT_POINT, share=SMB_SHARE, cred_file=SMB_CRED_FILE):
+    """Mount the SMB share unless it is already mounted; return True if it is available"""
+    if is_mounted(mount_point):
+        return True
+    if not os.path.isfile(cred_file):
+        log("No SMB credentials found. Backup stored locally only.")
+        return False
+    os.makedirs(mount_point, exist_ok=True)
+    result = subprocess.run(
+        ["mount", "-t", "cifs", share, mount_point,
+         "-o", f"credentials={cred_file},vers=3.0,sec=ntlmssp"],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        log(f"WARNING: Could not mount SMB share: {result.stderr.strip()}")
+        return False
+    return True
+
+
+def run_sql(sql, dbname=CATALOG_DB, **variables):
+    """Run sql through psql and return the result rows as lists of strings.
+
+    Values are passed as psql variables, so reference them as :'name' in sql.
+    """
+    cmd = PSQL_CMD + ["-X", "-q", "-A", "-t", "-F", "\t", "-v", "ON_ERROR_STOP=1", "-d", dbname]
+    for name, value in variables.items():
+        cmd += ["-v", f"{name}={'' if value is None else value}"]
+    result = subprocess.run(cmd, input=sql, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"psql failed: {result.stderr.strip()}")
+    return [line.split("\t") for line in result.stdout.splitlines() if line]
+
+
+def mb_per_s(nbytes, seconds):
+    return nbytes / (1 << 20) / seconds if seconds > 0 else 0.0
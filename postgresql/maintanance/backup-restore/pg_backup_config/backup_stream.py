@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL Streaming Base Backup
+Replacement for pg_basebackup.sh: streams pg_basebackup's tar output through
+multi-threaded zstd (or lz4) and writes it to the local backup directory and
+the SMB share at the same time, hashing it on the way.
+
+Compared with `pg_basebackup -Ft -z` followed by `cp -r`, the data is
+compressed on all cores and written once per target, with no second read of
+the local copy.
+
+Layout (same directory names as pg_basebackup.sh):
+  /var/backups/postgresql/base/basebackup_<date>/base.tar.zst
+  /var/backups/postgresql/base/basebackup_<date>/base.tar.zst.sha256
+  /var/backups/postgresql/base/basebackup_<date>/backup_stream.json   (per-phase MB/s)
+and the same files under /mnt/db_backup_share/CLAIMANTSDB-TEST/basebackup_<date>/
+
+WAL is fetched into the tar (-X fetch; -X stream cannot write to stdout), so
+the archive_command + WAL archive keep covering the backup window.
+Restore: zstd -dc base.tar.zst | tar -xf - -C <data_dir>
+
+The backup_manifest member is picked out of the tar stream as it passes and
+saved next to the archive, so it can seed a PostgreSQL 17 --incremental
+backup (see backup_chain.py) without reading the archive back.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import backup_telemetry
+from backup_common import (
+    BACKUP_DIR, LOG_DIR, REMOTE_BACKUP_DIR, RETENTION_DAYS,
+    Logger, ensure_mount, mb_per_s,
+)
+
+LOG_FILE = f"{LOG_DIR}/pg_basebackup.log"
+CHUNK_SIZE = 1 << 20
+QUEUE_DEPTH = 64
+
+COMPRESSORS = {
+    # name: (command builder, file extension)
+    "zstd": (lambda level, threads: ["zstd", f"-{level}", f"-T{threads}", "-q", "-c"], "zst"),
+    "lz4": (lambda level, threads: ["lz4", f"-{level}", "-q", "-c"], "lz4"),
+}
+
+
+class TarMemberTap:
+    """Captures one member of a tar stream as the stream is fed through in chunks"""
+
+    BLOCK = 512
+
+    def __init__(self, member_name):
+        self.member_name = member_name
+        self.data = None
+        self._pending = bytearray()
+        self._skip = 0          # bytes of the current member (incl. padding) still to pass
+        self._capture = None    # bytearray while inside the wanted member
+        self._capture_left = 0
+        self._long_name = None  # GNU 'L' long-name record for the next header
+        self._reading_long_name = False
+
+    @staticmethod
+    def _size(field):
+        if field[0] & 0x80:  # base-256 for members over 8 GiB
+            return int.from_bytes(field[1:], "big")
+        return int(field.strip(b"\0 ") or b"0", 8)
+
+    def feed(self, chunk):
+        if self.data is not None:
+            return
+        self._pending += chunk
+        while True:
+            if self._skip:
+                n = min(self._skip, len(self._pending))
+                if not n:
+                    return
+                if self._capture is not None and self._capture_left:
+                    take = min(n, self._capture_left)
+                    self._capture += self._pending[:take]
+                    self._capture_left -= take
+                del self._pending[:n]
+                self._skip -= n
+                if not self._skip and self._capture is not None:
+                    if self._reading_long_name:
+                        self._long_name = bytes(self._capture).rstrip(b"\0").decode()
+                        self._reading_long_name = False
+                    else:
+                        self.data = bytes(self._capture)
+                        self._pending.clear()
+                        return
+                    self._capture = None
+                continue
+
+            if len(self._pending) < self.BLOCK:
+                return
+            header = bytes(self._pending[:self.BLOCK])
+            del self._pending[:self.BLOCK]
+            if header == bytes(self.BLOCK):
+                continue
+            name = header[:100].rstrip(b"\0").decode(errors="replace")
+            prefix = header[345:500].rstrip(b"\0").decode(errors="replace")
+            if prefix:
+                name = f"{prefix}/{name}"
+            if self._long_name:
+                name, self._long_name = self._long_name, None
+            size = self._size(header[124:136])
+            typeflag = header[156:157]
+            self._skip = -(-size // self.BLOCK) * self.BLOCK
+            if typeflag == b"L":
+                self._reading_long_name = True
+                self._capture, self._capture_left = bytearray(), size
+            elif name.lstrip("./") == self.member_name:
+                self._capture, self._capture_left = bytearray(), size
+                if not size:
+                    self.data = b""
+                    return
+
+
+class TargetWriter(threading.Thread):
+    """Writes the compressed stream to one file from its own bounded queue"""
+
+    def __init__(self, name, path, required):
+        super().__init__(name=f"writer-{name}", daemon=True)
+        self.label = name
+        self.path = path
+        self.required = required
+        self.queue = queue.Queue(maxsize=QUEUE_DEPTH)
+        self.bytes = 0
+        self.busy = 0.0
+        self.error = None
+
+    def run(self):
+        fh = None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fh = open(self.path, "wb")
+            while True:
+                chunk = self.queue.get()
+                if chunk is None:
+                    break
+                start = time.perf_counter()
+                fh.write(chunk)
+                self.busy += time.perf_counter() - start
+                self.bytes += len(chunk)
+            start = time.perf_counter()
+            fh.flush()
+            os.fsync(fh.fileno())
+            self.busy += time.perf_counter() - start
+        except OSError as e:
+            self.error = e
+            # Keep draining so the producer never blocks on a dead target
+            while self.queue.get() is not None:
+                pass
+        finally:
+            if fh:
+                fh.close()
+
+    def put(self, chunk):
+        self.queue.put(chunk)
+
+
+def stream_backup(args, writers, log, tap=None):
+    """Run pg_basebackup | compressor and fan the output out to writers; return phase metrics"""
+    pg_cmd = ["pg_basebackup", "-D", "-", "-Ft", "-X", "fetch", "--checkpoint", args.checkpoint]
+    if args.incremental_from:
+        pg_cmd += ["--incremental", args.incremental_from]
+    if args.sudo_user:
+        pg_cmd = ["sudo", "-u", args.sudo_user] + pg_cmd
+    make_cmd, _ = COMPRESSORS[args.compress]
+    comp_cmd = make_cmd(args.level, args.threads)
+    log(f"Running: {' '.join(pg_cmd)} | {' '.join(comp_cmd)}")
+
+    with open(LOG_FILE, "ab") as pg_log:
+        pg = subprocess.Popen(pg_cmd, stdout=subprocess.PIPE, stderr=pg_log)
+        comp = subprocess.Popen(comp_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        raw = {"bytes": 0, "seconds": 0.0}
+        start = time.perf_counter()
+
+        def feed():
+            try:
+                while True:
+                    chunk = pg.stdout.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    raw["bytes"] += len(chunk)
+                    if tap:
+                        tap.feed(chunk)
+                    comp.stdin.write(chunk)
+            finally:
+                raw["seconds"] = time.perf_counter() - start
+                comp.stdin.close()
+
+        feeder = threading.Thread(target=feed, name="feeder", daemon=True)
+        feeder.start()
+
+        digest = hashlib.sha256()
+        compressed = 0
+        while True:
+            chunk = comp.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            compressed += len(chunk)
+            for w in writers:
+                w.put(chunk)
+        for w in writers:
+            w.put(None)
+
+        feeder.join()
+        pg_rc = pg.wait()
+        comp_rc = comp.wait()
+        for w in writers:
+            w.join()
+        total = time.perf_counter() - start
+
+    if pg_rc != 0:
+        raise RuntimeError(f"pg_basebackup exited with {pg_rc} (see {LOG_FILE})")
+    if comp_rc != 0:
+        raise RuntimeError(f"{args.compress} exited with {comp_rc}")
+
+    phases = {
+        "pg_basebackup": {"bytes": raw["bytes"], "seconds": round(raw["seconds"], 2),
+                          "mb_per_s": round(mb_per_s(raw["bytes"], raw["seconds"]), 1)},
+        "compress": {"bytes": compressed, "seconds": round(total, 2),
+                     "mb_per_s": round(mb_per_s(raw["bytes"], total), 1),
+                     "ratio": round(raw["bytes"] / compressed, 2) if compressed else None},
+    }
+    for w in writers:
+        phases[f"write_{w.label}"] = {
+            "bytes": w.bytes, "busy_seconds": round(w.busy, 2),
+            "mb_per_s": round(mb_per_s(w.bytes, w.busy), 1),
+            "error": str(w.error) if w.error else None,
+        }
+    return digest.hexdigest(), phases, total
+
+
+def write_sidecars(directory, file_name, sha256, metrics):
+    with open(os.path.join(directory, f"{file_name}.sha256"), "w") as fh:
+        fh.write(f"{sha256}  {file_name}\n")
+    with open(os.path.join(directory, "backup_stream.json"), "w") as fh:
+        json.dump(metrics, fh, indent=2)
+
+
+def cleanup_old_backups(directory, retention_days, log):
+    """Same rule as pg_basebackup.sh: remove basebackup_* directories older than retention_days"""
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - retention_days * 86400
+    deleted = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith("basebackup_") and os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            deleted += 1
+    log(f"Deleted {deleted} old backup(s) from {directory}")
+    return deleted
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stream pg_basebackup through zstd/lz4 to local and SMB targets")
+    parser.add_argument("--compress", choices=sorted(COMPRESSORS), default="zstd")
+    parser.add_argument("--level", type=int, default=3, help="compression level")
+    parser.add_argument("--threads", type=int, default=0, help="zstd worker threads (0 = all cores)")
+    parser.add_argument("--checkpoint", choices=("fast", "spread"), default="spread")
+    parser.add_argument("--backup-dir", default=BACKUP_DIR)
+    parser.add_argument("--remote-dir", default=REMOTE_BACKUP_DIR)
+    parser.add_argument("--no-remote", action="store_true", help="write the local copy only")
+    parser.add_argument("--sudo-user", default="postgres", help="run pg_basebackup as this user ('' to skip sudo)")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS,
+                        help="delete basebackup_* directories older than this (0 = keep all)")
+    parser.add_argument("--incremental-from", metavar="BACKUP_MANIFEST",
+                        help="take a PostgreSQL 17+ incremental backup relative to this manifest")
+    parser.add_argument("--backup-name", help="directory name (default basebackup_<timestamp>)")
+    return parser.parse_args(argv)
+
+
+def run(args, log):
+    """Take one streamed backup; return its metrics dict, or None on failure"""
+    backup_name = args.backup_name or f"basebackup_{datetime.datetime.now():%Y-%m-%d_%H%M%S}"
+    _, ext = COMPRESSORS[args.compress]
+    file_name = f"base.tar.{ext}"
+
+    log("========== Starting Streaming Base Backup ==========")
+    log(f"Backup name: {backup_name}")
+    telemetry = backup_telemetry.Run("backup_stream", backup_name, log=log)
+
+    local_dir = os.path.join(args.backup_dir, backup_name)
+    writers = [TargetWriter("local", os.path.join(local_dir, file_name), required=True)]
+    remote_dir = None
+    if not args.no_remote and ensure_mount(log):
+        remote_dir = os.path.join(args.remote_dir, backup_name)
+        writers.append(TargetWriter("remote", os.path.join(remote_dir, file_name), required=False))
+    for w in writers:
+        w.start()
+
+    tap = TarMemberTap("backup_manifest")
+    try:
+        sha256, phases, total = stream_backup(args, writers, log, tap)
+    except Exception as e:
+        log(f"ERROR: Backup failed: {e}")
+        for directory in (local_dir, remote_dir):
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+        telemetry.finish("FAILED", error=str(e))
+        return None
+
+    for w in writers:
+        if w.error:
+            level = "ERROR" if w.required else "WARNING"
+            log(f"{level}: {w.label} copy failed: {w.error}")
+    if writers[0].error:
+        telemetry.finish("FAILED", error=f"local copy failed: {writers[0].error}")
+        return None
+
+    metrics = {
+        "backup_name": backup_name,
+        "file": file_name,
+        "sha256": sha256,
+        "compress": args.compress,
+        "incremental_from": args.incremental_from,
+        "total_seconds": round(total, 2),
+        "phases": phases,
+    }
+    targets = [local_dir] + ([remote_dir] if remote_dir and not writers[1].error else [])
+    for directory in targets:
+        write_sidecars(directory, file_name, sha256, metrics)
+        if tap.data is not None:
+            with open(os.path.join(directory, "backup_manifest"), "wb") as fh:
+                fh.write(tap.data)
+    if tap.data is None:
+        log("WARNING: backup_manifest not found in the tar stream")
+
+    for phase, m in phases.items():
+        log(f"  {phase:<14} {m['bytes'] / (1 << 20):>10,.1f} MB  {m['mb_per_s']:>8,.1f} MB/s")
+    log(f"Backup completed in {total:.1f}s, sha256 {sha256}")
+    if len(targets) > 1:
+        log(f"Backup copied to remote share: {remote_dir}")
+
+    raw, compressed = phases["pg_basebackup"]["bytes"], phases["compress"]["bytes"]
+    telemetry.add_phase("pg_basebackup", phases["pg_basebackup"]["seconds"], bytes_in=raw)
+    telemetry.add_phase("compress", phases["compress"]["seconds"], bytes_in=raw, bytes_out=compressed)
+    for w in writers:
+        telemetry.add_phase(f"write_{w.label}", w.busy, bytes_in=w.bytes, error=str(w.error) if w.error else None)
+
+    if args.retention_days:
+        with telemetry.phase("cleanup"):
+            log(f"Cleaning up backups older than {args.retention_days} days...")
+            cleanup_old_backups(args.backup_dir, args.retention_days, log)
+            if len(targets) > 1:
+                cleanup_old_backups(args.remote_dir, args.retention_days, log)
+
+    telemetry.finish(bytes_in=raw, bytes_out=compressed, incremental=bool(args.incremental_from))
+    log("========== Streaming Base Backup Complete ==========")
+    metrics.update(local_dir=local_dir, remote_dir=targets[1] if len(targets) > 1 else None,
+                   manifest_found=tap.data is not None)
+    return metrics
+
+
+def main():
+    args = parse_args()
+    return run(args, Logger(LOG_FILE)) is not None
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        sys.exit(1)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Backup telemetry shared by the backup and WAL tools
+Every run is recorded as one structured record instead of free-text log
+lines: per-phase seconds, bytes in/out, compression ratio and MB/s.
+
+Records are appended to /var/log/postgresql/backup_telemetry.jsonl (always,
+one line per run) and inserted into public.backup_run_metrics when the
+catalog is reachable. public.backup_health_report() in
+postgresql_backup_restore_automation.sql, or `backup_telemetry.py report`
+on the JSONL file, shows moving averages per tool and flags runs at risk of
+overrunning the maintenance window.
+
+In Python:
+    run = telemetry.Run("backup_stream", backup_name)
+    with run.phase("cleanup"):
+        ...
+    run.add_phase("compress", seconds, bytes_in=raw, bytes_out=compressed)
+    run.finish(bytes_in=raw, bytes_out=compressed)
+
+From the shell scripts:
+    backup_telemetry.py record --tool pg_basebackup.sh --name X --seconds 812 --bytes-out 123456 \
+        --phase backup=690 --phase copy=118 --phase cleanup=4
+
+Run with:
+  python3 backup_telemetry.py report [--window-minutes 120] [--runs 7]
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import socket
+import statistics
+import sys
+import time
+
+from backup_common import LOG_DIR, mb_per_s, run_sql
+
+TELEMETRY_FILE = f"{LOG_DIR}/backup_telemetry.jsonl"
+WINDOW_MINUTES = 120
+MOVING_RUNS = 7
+AT_RISK = 0.8  # share of the window a run may take before it is flagged
+
+TELEMETRY_DDL = """
+CREATE TABLE IF NOT EXISTS public.backup_run_metrics (
+    run_id BIGSERIAL PRIMARY KEY,
+    tool VARCHAR(100) NOT NULL,
+    run_name VARCHAR(255),
+    kind VARCHAR(20) NOT NULL DEFAULT 'run',
+    host VARCHAR(255),
+    started_at TIMESTAMP NOT NULL,
+    finished_at TIMESTAMP NOT NULL,
+    duration_seconds NUMERIC(12,2),
+    status VARCHAR(50) NOT NULL,
+    bytes_in BIGINT,
+    bytes_out BIGINT,
+    compression_ratio NUMERIC(10,2),
+    mb_per_s NUMERIC(10,1),
+    phases JSONB,
+    error_message TEXT
+);
+CREATE INDEX IF NOT EXISTS backup_run_metrics_tool_idx ON public.backup_run_metrics (tool, started_at);
+"""
+
+
+def _ratio(bytes_in, bytes_out):
+    return round(bytes_in / bytes_out, 2) if bytes_in and bytes_out else None
+
+
+class Run:
+    """One tool run (or, with kind='interval', one reporting interval of a daemon)"""
+
+    def __init__(self, tool, name=None, kind="run", log=None):
+        self.log = log
+        self.start = time.time()
+        self.record = {
+            "tool": tool,
+            "name": name,
+            "kind": kind,
+            "host": socket.gethostname(),
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "phases": {},
+        }
+        self.finished = False
+
+    @contextlib.contextmanager
+    def phase(self, name, **fields):
+        """Time a block; the yielded dict takes bytes_in/bytes_out or any other fields"""
+        entry = dict(fields)
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            self.add_phase(name, time.perf_counter() - start, **entry)
+
+    def add_phase(self, name, seconds, bytes_in=None, bytes_out=None, **extra):
+        entry = {"seconds": round(seconds, 2)}
+        if bytes_in is not None:
+            entry["bytes_in"] = bytes_in
+            entry["mb_per_s"] = round(mb_per_s(bytes_in, seconds), 1)
+        if bytes_out is not None:
+            entry["bytes_out"] = bytes_out
+            entry["ratio"] = _ratio(bytes_in, bytes_out)
+        entry.update(extra)
+        self.record["phases"][name] = entry
+
+    def finish(self, status="SUCCESS", bytes_in=None, bytes_out=None, error=None, **extra):
+        """Write the record to the JSONL file and the catalog; never raises"""
+        if self.finished:
+            return self.record
+        self.finished = True
+        duration = time.time() - self.start
+        moved = bytes_in if bytes_in is not None else bytes_out
+        self.record.update(
+            finished_at=datetime.datetime.now().isoformat(timespec="seconds"),
+            duration_seconds=round(duration, 2),
+            status=status,
+            bytes_in=bytes_in,
+            bytes_out=bytes_out,
+            compression_ratio=_ratio(bytes_in, bytes_out),
+            mb_per_s=round(mb_per_s(moved, duration), 1) if moved else None,
+            error=error,
+            **extra,
+        )
+        try:
+            append_jsonl(self.record)
+        except OSError as e:
+            self._warn(f"could not write {TELEMETRY_FILE}: {e}")
+        try:
+            insert_record(self.record)
+        except (RuntimeError, OSError) as e:
+            self._warn(f"telemetry not stored in the catalog: {e}")
+        return self.record
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.finish("FAILED", error=str(exc))
+        else:
+            self.finish()
+        return False
+
+    def _warn(self, message):
+        if self.log:
+            self.log(f"WARNING: {message}")
+        else:
+            print(f"[!] {message}", file=sys.stderr)
+
+
+def append_jsonl(record, path=TELEMETRY_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as fh:
+        fh.write(json.dumps(record, default=str) + "\n")
+
+
+def insert_record(record):
+    run_sql(TELEMETRY_DDL + """
+        INSERT INTO public.backup_run_metrics
+            (tool, run_name, kind, host, started_at, finished_at, duration_seconds, status,
+             bytes_in, bytes_out, compression_ratio, mb_per_s, phases, error_message)
+        VALUES
+            (:'tool', NULLIF(:'name', ''), :'kind', :'host', :'started_at'::timestamp, :'finished_at'::timestamp,
+             :'duration'::numeric, :'status', NULLIF(:'bytes_in', '')::bigint, NULLIF(:'bytes_out', '')::bigint,
+             NULLIF(:'ratio', '')::numeric, NULLIF(:'mbps', '')::numeric, :'phases'::jsonb, NULLIF(:'error', ''))
+    """, tool=record["tool"], name=record["name"], kind=record["kind"], host=record["host"],
+        started_at=record["started_at"], finished_at=record["finished_at"], duration=record["duration_seconds"],
+        status=record["status"], bytes_in=record["bytes_in"], bytes_out=record["bytes_out"],
+        ratio=record["compression_ratio"], mbps=record["mb_per_s"], phases=json.dumps(record["phases"]),
+        error=record["error"])
+
+
+# ---------------------------------------------------------------------------
+# report (same rules as public.backup_health_report())
+# ---------------------------------------------------------------------------
+
+def read_records(path=TELEMETRY_FILE):
+    records = []
+    with open(path) as fh:
+        for line in fh:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def health(records, window_minutes=WINDOW_MINUTES, runs=MOVING_RUNS):
+    """Per tool: moving averages over the last `runs` runs and a status flag"""
+    window = window_minutes * 60
+    by_tool = {}
+    for r in sorted(records, key=lambda r: r["started_at"]):
+        if r.get("kind", "run") == "run":
+            by_tool.setdefault(r["tool"], []).append(r)
+    rows = []
+    for tool, history in sorted(by_tool.items()):
+        recent = history[-runs:]
+        last = recent[-1]
+        durations = [r["duration_seconds"] for r in recent]
+        rates = [r["mb_per_s"] for r in recent if r.get("mb_per_s")]
+        avg = statistics.fmean(durations)
+        projected = avg + 2 * (statistics.stdev(durations) if len(durations) > 1 else 0)
+        avg_rate = statistics.fmean(rates) if rates else None
+        failures = sum(r["status"] != "SUCCESS" for r in recent)
+        if last["status"] != "SUCCESS":
+            flag = "FAILING"
+        elif last["duration_seconds"] > AT_RISK * window or projected > window:
+            flag = "AT RISK"
+        elif avg_rate and last.get("mb_per_s") and last["mb_per_s"] < 0.7 * avg_rate:
+            flag = "DEGRADED"
+        else:
+            flag = "OK"
+        rows.append({
+            "tool": tool, "last_run": last["started_at"], "last_seconds": last["duration_seconds"],
+            "avg_seconds": round(avg, 1), "projected_seconds": round(projected, 1),
+            "last_mb_per_s": last.get("mb_per_s"), "avg_mb_per_s": round(avg_rate, 1) if avg_rate else None,
+            "failures": failures, "runs": len(recent), "flag": flag,
+        })
+    return rows
+
+
+def cmd_report(args):
+    try:
+        rows = health(read_records(args.file), args.window_minutes, args.runs)
+    except FileNotFoundError:
+        print(f"[!] No telemetry yet at {args.file}")
+        return False
+    print(f"Maintenance window {args.window_minutes} min, moving average over the last {args.runs} runs")
+    print(f"{'tool':<20} {'last run':<20} {'last s':>8} {'avg s':>8} {'avg+2sd':>8} "
+          f"{'last MB/s':>10} {'avg MB/s':>9} {'fail':>5}  flag")
+    print("-" * 100)
+    for r in rows:
+        print(f"{r['tool']:<20} {r['last_run']:<20} {r['last_seconds']:>8,.0f} {r['avg_seconds']:>8,.0f} "
+              f"{r['projected_seconds']:>8,.0f} {r['last_mb_per_s'] or 0:>10,.1f} {r['avg_mb_per_s'] or 0:>9,.1f} "
+              f"{r['failures']:>2}/{r['runs']:<2}  {r['flag']}")
+    return all(r["flag"] == "OK" for r in rows)
+
+
+def cmd_record(args):
+    run = Run(args.tool, args.name)
+    run.start = time.time() - args.seconds
+    run.record["started_at"] = datetime.datetime.fromtimestamp(run.start).isoformat(timespec="seconds")
+    for phase in args.phase:
+        name, _, seconds = phase.partition("=")
+        run.add_phase(name, float(seconds or 0))
+    run.finish(args.status, bytes_in=args.bytes_in, bytes_out=args.bytes_out, error=args.error)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backup run telemetry and health report")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("report", help="moving averages and window-overrun flags per tool")
+    p.add_argument("--file", default=TELEMETRY_FILE)
+    p.add_argument("--window-minutes", type=int, default=WINDOW_MINUTES)
+    p.add_argument("--runs", type=int, default=MOVING_RUNS)
+
+    p = sub.add_parser("record", help="record a run from a shell script")
+    p.add_argument("--tool", required=True)
+    p.add_argument("--name")
+    p.add_argument("--seconds", type=float, required=True)
+    p.add_argument("--status", default="SUCCESS")
+    p.add_argument("--bytes-in", type=int)
+    p.add_argument("--bytes-out", type=int)
+    p.add_argument("--error")
+    p.add_argument("--phase", action="append", default=[], metavar="NAME=SECONDS", help="repeat per phase")
+    args = parser.parse_args()
+
+    return cmd_report(args) if args.command == "report" else cmd_record(args)
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        sys.exit(1)
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL Backup Verification
+"Backup exists" is not "backup restores". Two checks:
+
+  verify   pg_verifybackup-style check of one backup: the archive against its
+           .sha256 sidecar, the backup_manifest's own checksum, then every file
+           in the manifest (size + checksum, missing/extra files) with the file
+           list split into size-balanced groups across a process pool
+  drill    restore the latest backup (or --backup) into a throwaway instance
+           on a private socket, replay archived WAL to --target-time, then run
+           check_database_integrity() and get_table_row_counts() in every
+           database; restore MB/s and time-to-consistent go into
+           public.restore_history
+
+Backups are looked up in public.backup_metadata (backup_chain.py); without a
+catalog entry the newest basebackup_* directory (backup_stream.py) is used,
+or pass --path. A clean verify or drill of a catalogued backup marks it
+VERIFIED.
+
+The drill instance runs with archive_mode = off and listen_addresses = '',
+so it can never write to the real WAL archive or accept remote clients.
+Row counts come from pg_stat_user_tables, which a physical restore starts
+empty, so every database is ANALYZEd before they are read.
+
+Run with:
+  python3 backup_verify.py verify [--backup NAME | --path DIR] [--jobs N]
+  python3 backup_verify.py drill [--backup NAME] [--target-time '2026-02-01 12:00']
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import backup_chain
+import backup_telemetry
+from backup_common import BACKUP_DIR, LOG_DIR, WAL_ARCHIVE_DIR, Logger, mb_per_s, run_sql
+
+try:
+    import crc32c as _crc32c  # optional, C implementation
+except ImportError:
+    _crc32c = None
+
+LOG_FILE = f"{LOG_DIR}/pg_backup_verify.log"
+JOBS = os.cpu_count() or 4
+DRILL_PORT = 5499
+READ_SIZE = 1 << 20
+STARTUP_TIMEOUT = 3600
+
+# Files pg_verifybackup does not expect to find in the manifest
+IGNORED = ("backup_manifest", "postgresql.auto.conf", "standby.signal", "recovery.signal")
+IGNORED_DIRS = ("pg_wal/",)
+
+RESTORE_HISTORY_DDL = """
+ALTER TABLE public.restore_history
+    ADD COLUMN IF NOT EXISTS restore_type VARCHAR(50),
+    ADD COLUMN IF NOT EXISTS restored_bytes BIGINT,
+    ADD COLUMN IF NOT EXISTS restore_mb_per_s NUMERIC(10,1),
+    ADD COLUMN IF NOT EXISTS time_to_consistent_seconds NUMERIC(10,1),
+    ADD COLUMN IF NOT EXISTS recovery_target TEXT;
+"""
+
+
+# ---------------------------------------------------------------------------
+# Manifest checks (run in pool workers, so module level)
+# ---------------------------------------------------------------------------
+
+def _crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+class Crc32c:
+    """hashlib-like CRC-32C; hexdigest() matches backup_manifest (little-endian bytes)"""
+
+    _table = None
+
+    def __init__(self):
+        self.crc = 0
+
+    def update(self, data):
+        if _crc32c is not None:
+            self.crc = _crc32c.crc32c(data, self.crc)
+            return
+        if Crc32c._table is None:
+            Crc32c._table = _crc32c_table()
+        table, crc = Crc32c._table, self.crc ^ 0xFFFFFFFF
+        for byte in data:
+            crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+        self.crc = crc ^ 0xFFFFFFFF
+
+    def hexdigest(self):
+        return struct.pack("<I", self.crc).hex()
+
+
+def new_checksum(algorithm):
+    if algorithm == "CRC32C":
+        return Crc32c()
+    return hashlib.new(algorithm.replace("SHA", "sha"))
+
+
+def manifest_path(entry):
+    if "Path" in entry:
+        return entry["Path"]
+    return bytes.fromhex(entry["Encoded-Path"]).decode("utf-8", "surrogateescape")
+
+
+def verify_group(root, entries):
+    """Check size and checksum of each manifest entry under root; return (errors, bytes read)"""
+    errors, nbytes = [], 0
+    for entry in entries:
+        path = os.path.join(root, manifest_path(entry))
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            errors.append(f"missing: {manifest_path(entry)}")
+            continue
+        if size != entry["Size"]:
+            errors.append(f"size mismatch: {manifest_path(entry)} ({size} != {entry['Size']})")
+            continue
+        algorithm = entry.get("Checksum-Algorithm", "NONE")
+        if algorithm == "NONE":
+            continue
+        checksum = new_checksum(algorithm)
+        with open(path, "rb") as fh:
+            while chunk := fh.read(READ_SIZE):
+                checksum.update(chunk)
+                nbytes += len(chunk)
+        if checksum.hexdigest() != entry["Checksum"]:
+            errors.append(f"checksum mismatch: {manifest_path(entry)}")
+    return errors, nbytes
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while chunk := fh.read(READ_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def split_groups(entries, jobs):
+    """Size-balanced groups: largest files first, each into the lightest group"""
+    groups = [[] for _ in range(max(1, jobs))]
+    weights = [0] * len(groups)
+    for entry in sorted(entries, key=lambda e: e["Size"], reverse=True):
+        i = weights.index(min(weights))
+        groups[i].append(entry)
+        weights[i] += entry["Size"]
+    return [g for g in groups if g]
+
+
+def check_manifest(root, jobs, log):
+    """Verify a data directory against its backup_manifest; return the list of errors"""
+    with open(os.path.join(root, "backup_manifest"), "rb") as fh:
+        raw = fh.read()
+    manifest = json.loads(raw)
+    errors = []
+    cut = raw.rfind(b'"Manifest-Checksum"')
+    if hashlib.sha256(raw[:cut]).hexdigest() != manifest.get("Manifest-Checksum"):
+        errors.append("backup_manifest checksum mismatch")
+
+    entries = manifest["Files"]
+    expected = {manifest_path(e) for e in entries}
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            rel = os.path.relpath(os.path.join(dirpath, name), root)
+            if rel not in expected and rel not in IGNORED and not rel.startswith(IGNORED_DIRS):
+                errors.append(f"extra file: {rel}")
+
+    if _crc32c is None and any(e.get("Checksum-Algorithm") == "CRC32C" for e in entries):
+        log("WARNING: crc32c module not installed, using the slow pure-Python CRC-32C")
+    groups = split_groups(entries, jobs)
+    log(f"Checking {len(entries):,} files in {len(groups)} groups")
+    start, total = time.time(), 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, len(groups))) as pool:
+        for group_errors, nbytes in pool.map(verify_group, [root] * len(groups), groups):
+            errors += group_errors
+            total += nbytes
+    elapsed = time.time() - start
+    log(f"Checksummed {total / (1 << 20):,.1f} MB in {elapsed:.1f}s ({mb_per_s(total, elapsed):,.1f} MB/s)")
+    return errors
+
+
+# ---------------------------------------------------------------------------
+# Locating backups
+# ---------------------------------------------------------------------------
+
+def archive_in(directory):
+    names = [f for f in os.listdir(directory) if f.startswith("base.tar.") and not f.endswith(".sha256")]
+    if not names:
+        raise RuntimeError(f"no base.tar.* archive in {directory}")
+    return os.path.join(directory, names[0])
+
+
+def find_backup(name):
+    """Catalog row of backup name, or of the newest FULL/INCREMENTAL backup"""
+    if name:
+        rows = backup_chain.fetch_rows("backup_name = :'name'", name=name)
+    else:
+        rows = backup_chain.fetch_rows("backup_type IN ('FULL', 'INCREMENTAL')",
+                                       order="backup_date DESC LIMIT 1")
+    if not rows:
+        raise RuntimeError(f"backup {name or '(latest)'} not found in the catalog")
+    if rows[0]["backup_type"] == "WAL":
+        raise RuntimeError(f"{name} is a WAL range; verify its chain's FULL/INCREMENTAL backups")
+    return rows[0]
+
+
+def resolve(args, log):
+    """Return (catalog row or None, backup directory) for --backup / --path / latest"""
+    if args.path:
+        return None, args.path
+    try:
+        row = find_backup(args.backup)
+        return row, row["backup_location"]
+    except RuntimeError:
+        if args.backup:
+            raise
+    dirs = sorted(d for d in os.listdir(BACKUP_DIR) if d.startswith("basebackup_")) if os.path.isdir(BACKUP_DIR) else []
+    if not dirs:
+        raise RuntimeError(f"no backups in the catalog or in {BACKUP_DIR}")
+    log(f"No catalogued backup, using the newest directory in {BACKUP_DIR}")
+    return None, os.path.join(BACKUP_DIR, dirs[-1])
+
+
+def mark_verified(backup_name):
+    run_sql("UPDATE public.backup_metadata SET status = 'VERIFIED' WHERE backup_name = :'name'",
+            name=backup_name)
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+# ---------------------------------------------------------------------------
+# verify
+# ---------------------------------------------------------------------------
+
+def cmd_verify(args, log):
+    row, directory = resolve(args, log)
+    archive = archive_in(directory)
+    log(f"========== Verifying {os.path.basename(directory)} ==========")
+    telemetry = backup_telemetry.Run("backup_verify", os.path.basename(directory), log=log)
+
+    work = tempfile.mkdtemp(prefix="pg_verify_", dir=args.work_dir)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
+            sha = pool.submit(sha256_file, archive)
+            start = time.time()
+            with telemetry.phase("extract", bytes_in=os.path.getsize(archive)):
+                backup_chain.extract(archive, work)
+            log(f"Extracted {archive} in {time.time() - start:.1f}s")
+            with telemetry.phase("checksum", bytes_in=dir_size(work)):
+                errors = check_manifest(work, args.jobs, log)
+            expected = open(f"{archive}.sha256").read().split()[0] if os.path.isfile(f"{archive}.sha256") else None
+            if expected is None:
+                log("WARNING: no .sha256 sidecar, archive checksum not checked")
+            elif sha.result() != expected:
+                errors.insert(0, f"archive sha256 mismatch: {archive}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    for error in errors[:50]:
+        log(f"  {error}")
+    if errors:
+        log(f"ERROR: {len(errors)} problem(s) found")
+        telemetry.finish("FAILED", error=errors[0])
+        return False
+    if row:
+        mark_verified(row["backup_name"])
+    telemetry.finish()
+    log("========== Backup Verified ==========")
+    return True
+
+
+# ---------------------------------------------------------------------------
+# drill
+# ---------------------------------------------------------------------------
+
+def as_user(args, cmd):
+    return (["sudo", "-u", args.sudo_user] if args.sudo_user else []) + cmd
+
+
+def pg_bin(args, name):
+    return os.path.join(args.bin_dir, name) if args.bin_dir else name
+
+
+def configure_drill(data_dir, socket_dir, args):
+    """Make the restored directory a private, non-archiving recovery instance"""
+    conf = os.path.join(data_dir, "postgresql.conf")
+    if not os.path.isfile(conf):  # Debian layout keeps it in /etc/postgresql
+        with open(conf, "w") as fh:
+            fh.write("# written by backup_verify.py drill\n")
+    with open(os.path.join(data_dir, "pg_hba.conf"), "w") as fh:
+        fh.write("local all all trust\n")
+    settings = {
+        "port": args.port,
+        "listen_addresses": "''",
+        "unix_socket_directories": f"'{socket_dir}'",
+        "hba_file": f"'{os.path.join(data_dir, 'pg_hba.conf')}'",
+        "archive_mode": "off",
+        "ssl": "off",
+        "logging_collector": "off",
+        "hot_standby": "on",
+        "restore_command": f"'gunzip -c {args.wal_dir}/%f.gz > %p'",
+        "recovery_target_action": "'promote'",
+    }
+    if args.target_time:
+        settings["recovery_target_time"] = f"'{args.target_time}'"
+    with open(os.path.join(data_dir, "postgresql.auto.conf"), "a") as fh:
+        fh.write("\n# backup_verify.py drill\n")
+        fh.writelines(f"{key} = {value}\n" for key, value in settings.items())
+    for name in ("standby.signal", "postmaster.pid"):
+        if os.path.exists(os.path.join(data_dir, name)):
+            os.remove(os.path.join(data_dir, name))
+    open(os.path.join(data_dir, "recovery.signal"), "w").close()
+
+
+def wait_for_recovery(dsn, server_log, log):
+    """Return (seconds to consistent, seconds to promotion) measured from now"""
+    start, consistent = time.time(), None
+    while time.time() - start < STARTUP_TIMEOUT:
+        if consistent is None and os.path.isfile(server_log):
+            with open(server_log, errors="replace") as fh:
+                if "consistent recovery state reached" in fh.read():
+                    consistent = time.time() - start
+                    log(f"Consistent after {consistent:.1f}s")
+        try:
+            if run_sql("SELECT pg_is_in_recovery()", dbname=dsn)[0][0] == "f":
+                promoted = time.time() - start
+                return consistent if consistent is not None else promoted, promoted
+        except RuntimeError:
+            pass  # not accepting connections yet
+        time.sleep(2)
+    raise RuntimeError(f"drill instance did not finish recovery within {STARTUP_TIMEOUT}s, see {server_log}")
+
+
+def run_checks(socket_dir, port, log):
+    """check_database_integrity() + get_table_row_counts() in every database; return (ok, tables, rows)"""
+    base = f"host={socket_dir} port={port}"
+    databases = [r[0] for r in run_sql("SELECT datname FROM pg_database WHERE datallowconn AND NOT datistemplate",
+                                       dbname=f"{base} dbname=postgres")]
+    ok, tables, rows = True, 0, 0
+    for db in databases:
+        dsn = f"{base} dbname={db}"
+        run_sql("ANALYZE", dbname=dsn)
+        has_checks = run_sql("SELECT to_regprocedure('public.check_database_integrity()') IS NOT NULL",
+                             dbname=dsn)[0][0] == "t"
+        if has_checks:
+            for check_name, status, details in run_sql("SELECT * FROM public.check_database_integrity()", dbname=dsn):
+                log(f"  [{db}] {check_name}: {status} - {details}")
+                ok = ok and status != "ERROR"
+            counts = run_sql("SELECT row_count FROM public.get_table_row_counts()", dbname=dsn)
+        else:
+            counts = run_sql("SELECT n_live_tup FROM pg_stat_user_tables", dbname=dsn)
+        db_rows = sum(int(c[0]) for c in counts)
+        log(f"  [{db}] {len(counts):,} tables, {db_rows:,} rows"
+            + ("" if has_checks else " (integrity functions not installed)"))
+        tables += len(counts)
+        rows += db_rows
+    return ok, tables, rows
+
+
+def record_drill(name, row, target, started, metrics, status, error):
+    run_sql(RESTORE_HISTORY_DDL)
+    run_sql("""
+        INSERT INTO public.restore_history
+            (restore_name, source_backup_id, source_database, target_database, restore_start_time,
+             restore_end_time, duration_seconds, status, rows_restored, tables_restored, error_message,
+             verified, verification_date, restore_type, restored_bytes, restore_mb_per_s,
+             time_to_consistent_seconds, recovery_target)
+        VALUES
+            (:'name', (SELECT backup_id FROM public.backup_metadata WHERE backup_name = :'backup_name'),
+             :'source', :'target', :'started'::timestamp, CURRENT_TIMESTAMP,
+             EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - :'started'::timestamp)::int, :'status',
+             NULLIF(:'rows', '')::bigint, NULLIF(:'tables', '')::int, NULLIF(:'error', ''),
+             :'status' = 'SUCCESS', CASE WHEN :'status' = 'SUCCESS' THEN CURRENT_TIMESTAMP END, 'DRILL',
+             NULLIF(:'bytes', '')::bigint, NULLIF(:'mbps', '')::numeric, NULLIF(:'consistent', '')::numeric,
+             NULLIF(:'recovery_target', ''))
+    """, name=name, backup_name=row["backup_name"] if row else "", source=backup_chain.DATABASE_NAME,
+        target=target, started=started, status=status, rows=metrics.get("rows"), tables=metrics.get("tables"),
+        error=error, bytes=metrics.get("bytes"), mbps=metrics.get("mb_per_s"),
+        consistent=metrics.get("consistent"), recovery_target=metrics.get("recovery_target"))
+
+
+def cmd_drill(args, log):
+    row, directory = resolve(args, log)
+    name = f"drill_{datetime.datetime.now():%Y-%m-%d_%H%M%S}"
+    started = time.strftime("%Y-%m-%d %H:%M:%S")
+    work = tempfile.mkdtemp(prefix="pg_drill_", dir=args.work_dir)
+    data_dir, socket_dir = os.path.join(work, "data"), os.path.join(work, "socket")
+    server_log = os.path.join(work, "server.log")
+    metrics, status, error, running = {"recovery_target": args.target_time}, "FAILED", None, False
+    log(f"========== Restore Drill {name}: {os.path.basename(directory)} ==========")
+    telemetry = backup_telemetry.Run("backup_verify_drill", name, log=log)
+    try:
+        start = time.time()
+        if row:
+            restore_args = types.SimpleNamespace(target=data_dir, backup=row["backup_name"], work_dir=args.work_dir)
+            if not backup_chain.cmd_restore(restore_args, log):
+                raise RuntimeError("restore failed")
+        else:
+            backup_chain.extract(archive_in(directory), data_dir)
+        restore_seconds = time.time() - start
+        metrics["bytes"] = dir_size(data_dir)
+        metrics["mb_per_s"] = round(mb_per_s(metrics["bytes"], restore_seconds), 1)
+        log(f"Restored {metrics['bytes'] / (1 << 20):,.1f} MB in {restore_seconds:.1f}s "
+            f"({metrics['mb_per_s']:,.1f} MB/s)")
+        telemetry.add_phase("restore", restore_seconds, bytes_in=metrics["bytes"])
+
+        if not args.skip_manifest:
+            errors = check_manifest(data_dir, args.jobs, log)
+            if errors:
+                raise RuntimeError(f"manifest check failed: {errors[0]} ({len(errors)} problem(s))")
+
+        os.makedirs(socket_dir)
+        configure_drill(data_dir, socket_dir, args)
+        if args.sudo_user:
+            subprocess.run(["chown", "-R", f"{args.sudo_user}:", work], check=True)
+        os.chmod(data_dir, 0o700)
+        subprocess.run(as_user(args, [pg_bin(args, "pg_ctl"), "start", "-W", "-D", data_dir, "-l", server_log]),
+                       check=True, capture_output=True)
+        running = True
+        consistent, promoted = wait_for_recovery(f"host={socket_dir} port={args.port} dbname=postgres",
+                                                 server_log, log)
+        metrics["consistent"] = round(consistent, 1)
+        log(f"Recovery finished after {promoted:.1f}s")
+        telemetry.add_phase("recovery", promoted, time_to_consistent=metrics["consistent"])
+
+        with telemetry.phase("checks"):
+            ok, metrics["tables"], metrics["rows"] = run_checks(socket_dir, args.port, log)
+        if not ok:
+            raise RuntimeError("check_database_integrity() reported errors")
+        status = "SUCCESS"
+    except (RuntimeError, OSError, subprocess.CalledProcessError) as e:
+        error = str(e)
+        log(f"ERROR: {error}")
+    finally:
+        if running:
+            subprocess.run(as_user(args, [pg_bin(args, "pg_ctl"), "stop", "-m", "immediate", "-D", data_dir]),
+                           capture_output=True)
+        if args.keep:
+            log(f"Kept drill directory {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+    try:
+        record_drill(name, row, f"drill:{args.port}", started, metrics, status, error)
+        if status == "SUCCESS" and row:
+            mark_verified(row["backup_name"])
+    except RuntimeError as e:
+        log(f"WARNING: could not record drill in restore_history: {e}")
+    telemetry.finish(status, bytes_in=metrics.get("bytes"), error=error)
+    log(f"========== Restore Drill {status} ==========")
+    return status == "SUCCESS"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify backups and run automated restore drills")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command, text in (("verify", "check archive and manifest checksums"),
+                          ("drill", "restore into a throwaway instance and run integrity checks")):
+        p = sub.add_parser(command, help=text)
+        source = p.add_mutually_exclusive_group()
+        source.add_argument("--backup", help="backup_name in backup_metadata (default: latest)")
+        source.add_argument("--path", help="backup directory not in the catalog (FULL backups only)")
+        p.add_argument("--jobs", type=int, default=JOBS, help="checksum worker processes")
+        p.add_argument("--work-dir", default=None, help="scratch space for the extracted backup")
+
+    drill = sub.choices["drill"]
+    drill.add_argument("--target-time", help="recovery_target_time (default: replay all archived WAL)")
+    drill.add_argument("--port", type=int, default=DRILL_PORT)
+    drill.add_argument("--wal-dir", default=WAL_ARCHIVE_DIR)
+    drill.add_argument("--bin-dir", default=None, help="PostgreSQL bin directory (default: PATH)")
+    drill.add_argument("--sudo-user", default="postgres", help="run the instance as this user ('' to skip sudo)")
+    drill.add_argument("--skip-manifest", action="store_true", help="skip the manifest check of the restored data")
+    drill.add_argument("--keep", action="store_true", help="keep the drill directory for inspection")
+    args = parser.parse_args()
+
+    log = Logger(LOG_FILE)
+    commands = {"verify": cmd_verify, "drill": cmd_drill}
+    try:
+        return commands[args.command](args, log)
+    except (RuntimeError, subprocess.CalledProcessError) as e:
+        log(f"ERROR: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        sys.exit(1)
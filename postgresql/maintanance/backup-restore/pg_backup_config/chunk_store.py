@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL Deduplicated Backup Store
+Content-addressed chunk store for base backups and WAL segments.
+
+Every file of a backup is cut into content-defined chunks, each chunk is
+stored once under its SHA-256 and a backup is just a manifest of chunk lists.
+Day-to-day most relation files are unchanged, so a new base backup only adds
+the chunks that differ, locally and on the SMB share.
+
+Chunk boundaries are content-defined at PostgreSQL page granularity: a chunk
+ends after an 8 KiB page whose CRC32 hits the boundary mask (chunks are kept
+between 64 KiB and 4 MiB, ~512 KiB on average). Modifying a page only changes its own chunk, and
+pages inserted or removed mid-file do not shift the following boundaries,
+while hashing stays at zlib/hashlib speed instead of a per-byte rolling hash.
+
+  backup      stream pg_basebackup (tar to stdout) straight into the store
+  add-tar     ingest an existing base.tar / base.tar.zst / base.tar.lz4
+  add-wal     ingest WAL segments from the archive that are not stored yet
+  upload      copy chunks and manifests the remote store does not have yet
+  gc          drop backups past retention and every chunk no longer referenced
+              (plus chunk files a killed ingest left without an index row)
+  restore     rebuild a backup's files from a (local or remote) store
+  stats       logical vs stored size
+
+Layout of a store root (local and remote are identical):
+  chunks/ab/cd/<sha256>     zlib-compressed chunk
+  manifests/<backup>.json   files, modes and chunk lists of one backup
+  index.sqlite              chunk index and manifests (local store only)
+"""
+
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tarfile
+import time
+import zlib
+
+import backup_telemetry
+from backup_common import (
+    BACKUP_ROOT, LOG_DIR, REMOTE_BACKUP_DIR, RETENTION_DAYS, WAL_ARCHIVE_DIR,
+    Logger, ensure_mount, mb_per_s,
+)
+
+LOG_FILE = f"{LOG_DIR}/pg_chunk_store.log"
+STORE_DIR = f"{BACKUP_ROOT}/chunkstore"
+REMOTE_STORE_DIR = f"{REMOTE_BACKUP_DIR}/chunkstore"
+
+PAGE_SIZE = 8192
+MIN_CHUNK = 64 * 1024
+AVG_CHUNK = 512 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+COMPRESS_LEVEL = 1
+ORPHAN_GRACE_HOURS = 24  # gc leaves younger unindexed chunk files alone: an ingest may still be running
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    uploaded INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS backups (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    logical_bytes INTEGER NOT NULL DEFAULT 0,
+    new_bytes INTEGER NOT NULL DEFAULT 0,
+    uploaded INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    backup_id INTEGER NOT NULL REFERENCES backups(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    type TEXT NOT NULL,
+    mode INTEGER,
+    mtime INTEGER,
+    size INTEGER,
+    linkname TEXT
+);
+CREATE TABLE IF NOT EXISTS entry_chunks (
+    entry_id INTEGER NOT NULL REFERENCES entries(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (entry_id, seq)
+);
+CREATE INDEX IF NOT EXISTS entries_backup_idx ON entries (backup_id);
+CREATE INDEX IF NOT EXISTS entry_chunks_hash_idx ON entry_chunks (hash);
+"""
+
+
+def chunk_stream(fh, min_chunk=MIN_CHUNK, avg_chunk=AVG_CHUNK, max_chunk=MAX_CHUNK):
+    """Yield content-defined chunks of a file object, cutting only at page boundaries"""
+    mask = max(avg_chunk // PAGE_SIZE, 1)
+    chunk = bytearray()
+    while True:
+        page = fh.read(PAGE_SIZE)
+        if not page:
+            break
+        chunk += page
+        if len(chunk) >= max_chunk or (len(chunk) >= min_chunk and zlib.crc32(page) % mask == 0):
+            yield bytes(chunk)
+            chunk.clear()
+    if chunk:
+        yield bytes(chunk)
+
+
+def chunk_path(root, digest):
+    return os.path.join(root, "chunks", digest[:2], digest[2:4], digest)
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+
+class ChunkStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(root, "index.sqlite"))
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+        self.written = []  # chunk files written since the last commit, unlinked by rollback()
+
+    # -- ingest -----------------------------------------------------------
+
+    def begin_backup(self, name, kind):
+        if self.db.execute("SELECT 1 FROM backups WHERE name = ?", (name,)).fetchone():
+            raise RuntimeError(f"backup {name} already exists in {self.root}")
+        cur = self.db.execute("INSERT INTO backups (name, kind, created_at) VALUES (?, ?, ?)",
+                              (name, kind, datetime.datetime.now().isoformat(timespec="seconds")))
+        return cur.lastrowid
+
+    def put_chunk(self, data):
+        """Store data if new; return (hash, bytes newly stored)"""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.db.execute("SELECT 1 FROM chunks WHERE hash = ?", (digest,)).fetchone():
+            return digest, 0
+        packed = zlib.compress(data, COMPRESS_LEVEL)
+        write_atomic(chunk_path(self.root, digest), packed)
+        self.written.append(digest)
+        self.db.execute("INSERT INTO chunks (hash, size, stored_size) VALUES (?, ?, ?)",
+                        (digest, len(data), len(packed)))
+        return digest, len(packed)
+
+    def add_file(self, backup_id, path, fh, mode=None, mtime=None):
+        """Chunk one file into the store; return (file size, bytes newly stored)"""
+        cur = self.db.execute(
+            "INSERT INTO entries (backup_id, path, type, mode, mtime) VALUES (?, ?, 'file', ?, ?)",
+            (backup_id, path, mode, mtime))
+        entry_id = cur.lastrowid
+        size = new_bytes = 0
+        for seq, data in enumerate(chunk_stream(fh)):
+            digest, stored = self.put_chunk(data)
+            size += len(data)
+            new_bytes += stored
+            self.db.execute("INSERT INTO entry_chunks (entry_id, seq, hash) VALUES (?, ?, ?)",
+                            (entry_id, seq, digest))
+        self.db.execute("UPDATE entries SET size = ? WHERE id = ?", (size, entry_id))
+        return size, new_bytes
+
+    def add_other(self, backup_id, path, kind, mode=None, mtime=None, linkname=None):
+        self.db.execute(
+            "INSERT INTO entries (backup_id, path, type, mode, mtime, size, linkname) VALUES (?, ?, ?, ?, ?, 0, ?)",
+            (backup_id, path, kind, mode, mtime, linkname))
+
+    def add_tar_stream(self, backup_id, stream):
+        """Ingest every member of an uncompressed tar stream; return (logical, new) bytes"""
+        logical = new = 0
+        with tarfile.open(fileobj=stream, mode="r|") as tar:
+            for member in tar:
+                if member.isfile():
+                    size, stored = self.add_file(backup_id, member.name, tar.extractfile(member),
+                                                 member.mode, int(member.mtime))
+                    logical += size
+                    new += stored
+                elif member.isdir():
+                    self.add_other(backup_id, member.name, "dir", member.mode, int(member.mtime))
+                elif member.issym():
+                    self.add_other(backup_id, member.name, "symlink", member.mode, int(member.mtime),
+                                   member.linkname)
+        return logical, new
+
+    def finish_backup(self, backup_id, logical, new):
+        self.db.execute("UPDATE backups SET logical_bytes = ?, new_bytes = ? WHERE id = ?",
+                        (logical, new, backup_id))
+        self.db.commit()
+        self.written.clear()
+        self.write_manifest(backup_id)
+
+    def rollback(self):
+        """Undo an unfinished ingest: its index rows and the chunk files it wrote"""
+        self.db.rollback()
+        for digest in self.written:
+            try:
+                os.remove(chunk_path(self.root, digest))
+            except FileNotFoundError:
+                pass
+        self.written.clear()
+
+    def write_manifest(self, backup_id):
+        name, kind, created_at = self.db.execute(
+            "SELECT name, kind, created_at FROM backups WHERE id = ?", (backup_id,)).fetchone()
+        entries = []
+        for entry_id, path, kind_, mode, mtime, size, linkname in self.db.execute(
+                "SELECT id, path, type, mode, mtime, size, linkname FROM entries WHERE backup_id = ? ORDER BY id",
+                (backup_id,)):
+            chunks = [h for (h,) in self.db.execute(
+                "SELECT hash FROM entry_chunks WHERE entry_id = ? ORDER BY seq", (entry_id,))]
+            entries.append({"path": path, "type": kind_, "mode": mode, "mtime": mtime,
+                            "size": size, "linkname": linkname, "chunks": chunks})
+        manifest = {"name": name, "kind": kind, "created_at": created_at, "entries": entries}
+        write_atomic(os.path.join(self.root, "manifests", f"{name}.json"),
+                     json.dumps(manifest).encode())
+
+    # -- remote -----------------------------------------------------------
+
+    def upload(self, remote_root, log):
+        """Copy chunks and manifests the remote store does not have yet; return bytes copied"""
+        start = time.perf_counter()
+        copied = copied_bytes = 0
+        pending = self.db.execute("SELECT hash, stored_size FROM chunks WHERE uploaded = 0").fetchall()
+        for i, (digest, stored_size) in enumerate(pending, 1):
+            dest = chunk_path(remote_root, digest)
+            if not os.path.exists(dest):
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.copyfile(chunk_path(self.root, digest), f"{dest}.tmp")
+                os.replace(f"{dest}.tmp", dest)
+                copied += 1
+                copied_bytes += stored_size
+            self.db.execute("UPDATE chunks SET uploaded = 1 WHERE hash = ?", (digest,))
+            if i % 1000 == 0:
+                self.db.commit()
+        for (name,) in self.db.execute("SELECT name FROM backups WHERE uploaded = 0").fetchall():
+            manifest = os.path.join("manifests", f"{name}.json")
+            dest = os.path.join(remote_root, manifest)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(os.path.join(self.root, manifest), f"{dest}.tmp")
+            os.replace(f"{dest}.tmp", dest)
+            self.db.execute("UPDATE backups SET uploaded = 1 WHERE name = ?", (name,))
+        self.db.commit()
+        seconds = time.perf_counter() - start
+        log(f"Uploaded {copied:,} new chunks ({copied_bytes / (1 << 20):,.1f} MB, "
+            f"{mb_per_s(copied_bytes, seconds):,.1f} MB/s); {len(pending) - copied:,} already remote")
+        return copied_bytes
+
+    # -- retention --------------------------------------------------------
+
+    def gc(self, retention_days, remote_root, log, keep_min=1):
+        """Drop backups older than retention_days (keeping the newest keep_min) and unreferenced chunks"""
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=retention_days)).isoformat(timespec="seconds")
+        expired = self.db.execute("""
+            SELECT id, name FROM backups
+            WHERE created_at < ? AND kind = 'base'
+              AND id NOT IN (SELECT id FROM backups WHERE kind = 'base' ORDER BY created_at DESC LIMIT ?)
+            UNION ALL
+            SELECT id, name FROM backups WHERE created_at < ? AND kind = 'wal'
+        """, (cutoff, keep_min, cutoff)).fetchall()
+        for backup_id, name in expired:
+            self.db.execute("DELETE FROM backups WHERE id = ?", (backup_id,))
+            for root in (self.root, remote_root):
+                if root:
+                    path = os.path.join(root, "manifests", f"{name}.json")
+                    if os.path.exists(path):
+                        os.remove(path)
+        self.db.commit()
+
+        orphans = self.db.execute("""
+            SELECT hash, stored_size FROM chunks c
+            WHERE NOT EXISTS (SELECT 1 FROM entry_chunks e WHERE e.hash = c.hash)
+        """).fetchall()
+        freed = 0
+        for digest, stored_size in orphans:
+            for root in (self.root, remote_root):
+                if root:
+                    try:
+                        os.remove(chunk_path(root, digest))
+                    except FileNotFoundError:
+                        pass
+            self.db.execute("DELETE FROM chunks WHERE hash = ?", (digest,))
+            freed += stored_size
+        self.db.commit()
+        unindexed = self.sweep_unindexed()
+        log(f"GC: expired {len(expired)} backup(s), removed {len(orphans):,} unreferenced chunks "
+            f"({freed / (1 << 20):,.1f} MB) and {unindexed:,} chunk files missing from the index")
+
+    def sweep_unindexed(self, grace_hours=ORPHAN_GRACE_HOURS):
+        """Remove local chunk files with no chunks row (left by a killed ingest); return the count"""
+        cutoff = time.time() - grace_hours * 3600
+        removed = 0
+        for directory, _, files in os.walk(os.path.join(self.root, "chunks")):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                digest = file_name[:-len(".tmp")] if file_name.endswith(".tmp") else file_name
+                try:
+                    if os.path.getmtime(path) >= cutoff:
+                        continue
+                    if file_name.endswith(".tmp") or not self.db.execute(
+                            "SELECT 1 FROM chunks WHERE hash = ?", (digest,)).fetchone():
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+    def stats(self):
+        logical, = self.db.execute("SELECT coalesce(sum(logical_bytes), 0) FROM backups").fetchone()
+        stored, count = self.db.execute("SELECT coalesce(sum(stored_size), 0), count(*) FROM chunks").fetchone()
+        backups = self.db.execute(
+            "SELECT name, kind, created_at, logical_bytes, new_bytes FROM backups ORDER BY created_at").fetchall()
+        return logical, stored, count, backups
+
+
+def restore(root, name, target, log):
+    """Rebuild the files of backup `name` from the store at root (needs no index)"""
+    with open(os.path.join(root, "manifests", f"{name}.json")) as fh:
+        manifest = json.load(fh)
+    os.makedirs(target, exist_ok=True)
+    written = 0
+    start = time.perf_counter()
+    for entry in manifest["entries"]:
+        path = os.path.join(target, entry["path"])
+        if entry["type"] == "dir":
+            os.makedirs(path, exist_ok=True)
+        elif entry["type"] == "symlink":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.symlink(entry["linkname"], path)
+            continue
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as out:
+                for digest in entry["chunks"]:
+                    with open(chunk_path(root, digest), "rb") as fh:
+                        data = zlib.decompress(fh.read())
+                    if hashlib.sha256(data).hexdigest() != digest:
+                        raise RuntimeError(f"chunk {digest} of {entry['path']} is corrupt")
+                    out.write(data)
+                    written += len(data)
+        if entry.get("mode") is not None:
+            os.chmod(path, entry["mode"])
+        if entry.get("mtime") is not None:
+            os.utime(path, (entry["mtime"], entry["mtime"]))
+    seconds = time.perf_counter() - start
+    log(f"Restored {name}: {written / (1 << 20):,.1f} MB in {seconds:.1f}s ({mb_per_s(written, seconds):,.1f} MB/s)")
+
+
+def open_tar_source(path):
+    """Return (process or None, binary stream) for a plain or zstd/lz4-compressed tar"""
+    if path.endswith((".zst", ".lz4")):
+        tool = "zstd" if path.endswith(".zst") else "lz4"
+        proc = subprocess.Popen([tool, "-dc", path], stdout=subprocess.PIPE)
+        return proc, proc.stdout
+    return None, open(path, "rb")
+
+
+def ingest(store, name, kind, proc, stream, log):
+    start = time.perf_counter()
+    telemetry = backup_telemetry.Run("chunk_store", name, log=log)
+    backup_id = store.begin_backup(name, kind)
+    try:
+        logical, new = store.add_tar_stream(backup_id, stream)
+        if proc and proc.wait() != 0:
+            raise RuntimeError(f"{proc.args[0]} exited with {proc.returncode}")
+    except BaseException as e:
+        store.rollback()
+        telemetry.finish("FAILED", error=str(e))
+        raise
+    store.finish_backup(backup_id, logical, new)
+    seconds = time.perf_counter() - start
+    telemetry.add_phase("ingest", seconds, bytes_in=logical, bytes_out=new)
+    telemetry.finish(bytes_in=logical, bytes_out=new)
+    log(f"Stored {name}: {logical / (1 << 20):,.1f} MB logical, {new / (1 << 20):,.1f} MB new "
+        f"({100 * new / logical if logical else 0:.1f}%) in {seconds:.1f}s "
+        f"({mb_per_s(logical, seconds):,.1f} MB/s)")
+
+
+def cmd_backup(args, store, log):
+    name = args.name or f"basebackup_{datetime.datetime.now():%Y-%m-%d_%H%M%S}"
+    cmd = ["pg_basebackup", "-D", "-", "-Ft", "-X", "fetch", "--checkpoint", args.checkpoint]
+    if args.sudo_user:
+        cmd = ["sudo", "-u", args.sudo_user] + cmd
+    log(f"Running: {' '.join(cmd)} into {store.root}")
+    with open(LOG_FILE, "ab") as err:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err)
+        ingest(store, name, "base", proc, proc.stdout, log)
+    return True
+
+
+def cmd_add_tar(args, store, log):
+    name = args.name or os.path.basename(os.path.dirname(os.path.abspath(args.tar)))
+    proc, stream = open_tar_source(args.tar)
+    with stream:
+        ingest(store, name, "base", proc, stream, log)
+    return True
+
+
+def cmd_add_wal(args, store, log):
+    """Store each archived segment (<segment>.gz) not yet in the store as its own 'wal' backup"""
+    known = {n for (n,) in store.db.execute("SELECT name FROM backups WHERE kind = 'wal'")}
+    added = 0
+    for file_name in sorted(os.listdir(args.wal_dir)):
+        if not file_name.endswith(".gz"):
+            continue
+        name = f"wal/{file_name[:-3]}"
+        if name in known:
+            continue
+        path = os.path.join(args.wal_dir, file_name)
+        backup_id = store.begin_backup(name, "wal")
+        try:
+            with gzip.open(path, "rb") as fh:
+                size, new = store.add_file(backup_id, file_name[:-3], fh, 0o600, int(os.path.getmtime(path)))
+        except BaseException:
+            store.rollback()
+            raise
+        store.finish_backup(backup_id, size, new)
+        added += 1
+    log(f"Stored {added} new WAL segment(s)")
+    return True
+
+
+def cmd_upload(args, store, log):
+    if not ensure_mount(log):
+        return False
+    with backup_telemetry.Run("chunk_store_upload", log=log) as telemetry:
+        with telemetry.phase("upload") as phase:
+            phase["bytes_in"] = store.upload(args.remote_store, log)
+    return True
+
+
+def cmd_gc(args, store, log):
+    remote = args.remote_store if not args.local_only and ensure_mount(log) else None
+    with backup_telemetry.Run("chunk_store_gc", log=log) as telemetry, telemetry.phase("gc"):
+        store.gc(args.retention_days, remote, log)
+    return True
+
+
+def cmd_restore(args, store, log):
+    root = args.from_store or store.root
+    restore(root, args.backup, args.target, log)
+    return True
+
+
+def cmd_stats(args, store, log):
+    logical, stored, count, backups = store.stats()
+    for name, kind, created_at, logical_bytes, new_bytes in backups:
+        if kind == "base":
+            print(f"  {name:<32} {created_at}  {logical_bytes / (1 << 20):>12,.1f} MB  "
+                  f"+{new_bytes / (1 << 20):>10,.1f} MB")
+    ratio = logical / stored if stored else 0
+    print(f"{len(backups)} backups, {logical / (1 << 30):,.2f} GiB logical, "
+          f"{stored / (1 << 30):,.2f} GiB stored in {count:,} chunks (x{ratio:,.1f})")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-addressed, deduplicated backup store")
+    parser.add_argument("--store", default=STORE_DIR, help="local store root")
+    parser.add_argument("--remote-store", default=REMOTE_STORE_DIR, help="remote (SMB) store root")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("backup", help="stream pg_basebackup into the store")
+    p.add_argument("--name")
+    p.add_argument("--checkpoint", choices=("fast", "spread"), default="spread")
+    p.add_argument("--sudo-user", default="postgres")
+    p.add_argument("--upload", action="store_true", help="upload new chunks afterwards")
+
+    p = sub.add_parser("add-tar", help="ingest an existing base.tar[.zst|.lz4]")
+    p.add_argument("tar")
+    p.add_argument("--name", help="default: the tar's directory name")
+    p.add_argument("--upload", action="store_true")
+
+    p = sub.add_parser("add-wal", help="ingest archived WAL segments")
+    p.add_argument("--wal-dir", default=WAL_ARCHIVE_DIR)
+    p.add_argument("--upload", action="store_true")
+
+    sub.add_parser("upload", help="copy new chunks and manifests to the remote store")
+
+    p = sub.add_parser("gc", help="expire old backups and delete unreferenced chunks")
+    p.add_argument("--retention-days", type=int, default=RETENTION_DAYS)
+    p.add_argument("--local-only", action="store_true", help="leave the remote store alone")
+
+    p = sub.add_parser("restore", help="rebuild a backup's files")
+    p.add_argument("backup")
+    p.add_argument("--target", required=True)
+    p.add_argument("--from-store", help="restore from this store root (e.g. the remote one)")
+
+    sub.add_parser("stats", help="show dedup statistics")
+    args = parser.parse_args()
+
+    log = Logger(LOG_FILE)
+    store = ChunkStore(args.store)
+    commands = {
+        "backup": cmd_backup, "add-tar": cmd_add_tar, "add-wal": cmd_add_wal, "upload": cmd_upload,
+        "gc": cmd_gc, "restore": cmd_restore, "stats": cmd_stats,
+    }
+    try:
+        ok = commands[args.command](args, store, log)
+        if ok and getattr(args, "upload", False):
+            ok = cmd_upload(args, store, log)
+        return ok
+    except (RuntimeError, OSError, tarfile.TarError) as e:
+        log(f"ERROR: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        sys.exit(1)
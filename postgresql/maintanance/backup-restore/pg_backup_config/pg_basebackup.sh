@@ -20,6 +20,23 @@ SMB_SHARE="//192.168.180.161/db_backups$"
 SMB_MOUNT_POINT="/mnt/db_backup_share"
 REMOTE_BACKUP_DIR="${SMB_MOUNT_POINT}/CLAIMANTSDB-TEST"
 
+# Structured run record (backup_telemetry.py next to this script)
+TELEMETRY="$(dirname "$0")/backup_telemetry.py"
+START_TS=$(date +%s)
+PHASE_TS=$START_TS
+PHASES=()
+phase_done() {
+    local now
+    now=$(date +%s)
+    PHASES+=(--phase "$1=$((now - PHASE_TS))")
+    PHASE_TS=$now
+}
+record_run() {
+    python3 "$TELEMETRY" record --tool pg_basebackup.sh --name "$BACKUP_NAME" \
+        --seconds $(( $(date +%s) - START_TS )) "${PHASES[@]}" "$@" >> "$LOG_FILE" 2>&1 || true
+}
+trap 'record_run --status FAILED --error "failed at line $LINENO"' ERR
+
 # Logging function
 log() {
     echo "$(date '+%Y-%m-%d %H:%M:%S') - $1" >> "$LOG_FILE"
@@ -49,6 +66,7 @@ sudo -u postgres pg_basebackup \
     -Xs \
     -P \
     -v >> "$LOG_FILE" 2>&1
+phase_done backup
 
 # Verify backup
 if [ -f "${BACKUP_DIR}/${BACKUP_NAME}/base.tar.gz" ]; then
@@ -56,6 +74,7 @@ if [ -f "${BACKUP_DIR}/${BACKUP_NAME}/base.tar.gz" ]; then
     log "Backup completed successfully. Size: ${BACKUP_SIZE}"
 else
     log "ERROR: Backup verification failed!"
+    record_run --status FAILED --error "base.tar.gz missing"
     exit 1
 fi
 
@@ -76,15 +95,19 @@ if [ -f "$SMB_CRED_FILE" ]; then
 else
     log "No SMB credentials found. Backup stored locally only."
 fi
+phase_done copy
 
 # Cleanup old backups (local)
 log "Cleaning up backups older than ${RETENTION_DAYS} days..."
-find "$BACKUP_DIR" -maxdepth 1 -type d -name "basebackup_*" -mtime +${RETENTION_DAYS} -exec rm -rf {} \; >> "$LOG_FILE" 2>&1
-DELETED_COUNT=$(find "$BACKUP_DIR" -maxdepth 1 -type d -name "basebackup_*" -mtime +${RETENTION_DAYS} 2>/dev/null | wc -l)
+# Count while deleting (counting afterwards always found 0); retention_engine.py
+# replaces this with catalog-driven GFS retention that also knows the WAL each backup needs
+DELETED_COUNT=$(find "$BACKUP_DIR" -mindepth 1 -maxdepth 1 -type d -name "basebackup_*" -mtime +${RETENTION_DAYS} -print -exec rm -rf {} + 2>> "$LOG_FILE" | wc -l)
 log "Deleted ${DELETED_COUNT} old backup(s)"
+phase_done cleanup
 
 # List current backups
 log "Current backups:"
 ls -lh "$BACKUP_DIR" >> "$LOG_FILE" 2>&1
 
+record_run --bytes-out "$(du -sb "${BACKUP_DIR}/${BACKUP_NAME}" | cut -f1)"
 log "========== Base Backup Complete =========="
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL Monitoring Agent
+One long-running process in place of the */5 cron `system_monitor.sh` and
+monitor_* scripts, which fork psql/df and reconnect to PostgreSQL on every
+run and only see one sample every five minutes.
+
+- keeps one psql session open (a coprocess, reconnected only when it dies)
+  and reads pg_stat_activity, pg_stat_database and pg_stat_archiver with
+  one query per sample
+- reads CPU and memory from /proc and disk usage with statvfs, no df
+- samples every --interval seconds (default 15) into a ring buffer of the
+  last hour, so short spikes are seen and windowed checks (failed logins in
+  5 minutes, temp file growth) are computed from the buffer
+- evaluates the thresholds of the monitors it replaces (Active Monitors in
+  CLAIMANTS-DB-Backup&MaintananceReport.md) in-process and calls
+  send_alert.sh only when a check changes state (and again every
+  --realert-minutes while it stays bad), plus a RESOLVED notice
+- does not flap on values hovering around a threshold: CPU, memory and
+  connections are checked on their average over the last minute, an active
+  check only clears RESOLVE_MARGIN_PCT below its threshold, and RESOLVED is
+  sent once a check has stayed clear for RESOLVE_MINUTES
+- writes the latest sample, ring-buffer min/avg/max and active alerts to a
+  status file; `pg_monitor_agent.py --status` prints it
+
+Run under systemd: see pg-monitor-agent.service
+  python3 pg_monitor_agent.py --once --no-alerts   (one sample, printed)
+"""
+
+import argparse
+import collections
+import glob
+import json
+import os
+import re
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from backup_common import BACKUP_DIR, BACKUP_ROOT, LOG_DIR, PSQL_CMD, Logger
+
+LOG_FILE = f"{LOG_DIR}/pg_monitor_agent.log"
+STATUS_FILE = f"{LOG_DIR}/pg_monitor_agent_status.json"
+PG_LOG_GLOB = f"{LOG_DIR}/postgresql-*-main.log"
+ALERT_SCRIPT = "/opt/pg-maintenance/scripts/send_alert.sh"  # send_alert.sh GROUP SUBJECT BODY
+SUPPORT_GROUP = "CLAIMANTS-SUPPORT"
+DBA_GROUP = "SDBA"
+
+INTERVAL = 15
+RING_MINUTES = 60
+REALERT_MINUTES = 60
+QUERY_TIMEOUT = 10
+
+# Thresholds of the replaced cron monitors (CLAIMANTS-DB-Backup&MaintananceReport.md,
+# Active Monitors); the rest from the maintenance setup report / alert severity guide
+DISK_WARN_PCT = 85          # alert above, like monitor_disk_space.sh
+DISK_CRIT_PCT = 95
+CPU_PCT = 80
+MEMORY_PCT = 85
+CONNECTIONS_WARN_PCT = 80
+CONNECTIONS_CRIT_PCT = 95
+QUERY_WARN_MINUTES = 15
+QUERY_CRIT_MINUTES = 30
+FAILED_LOGINS = 0           # any more than this in FAILED_LOGIN_MINUTES alerts
+FAILED_LOGIN_MINUTES = 5
+TEMP_BYTES = 1 << 30        # written in TEMP_MINUTES
+TEMP_MINUTES = 15
+WAL_READY_WARN = 50
+WAL_READY_CRIT = 100
+BACKUP_AGE_HOURS = 25
+AVERAGE_MINUTES = 1         # CPU, memory and connections are checked on this average
+RESOLVE_MARGIN_PCT = 5      # ... and only clear this far below the threshold
+RESOLVE_MINUTES = 5         # a check stays clear this long before RESOLVED is sent
+
+SAMPLE_SQL = """
+SELECT
+    (SELECT count(*) FROM pg_stat_activity WHERE backend_type = 'client backend'),
+    current_setting('max_connections')::int,
+    (SELECT count(*) FROM pg_stat_activity WHERE backend_type = 'client backend' AND state = 'active'),
+    (SELECT count(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'),
+    (SELECT coalesce(round(extract(epoch FROM max(now() - query_start))), 0) FROM pg_stat_activity
+      WHERE backend_type = 'client backend' AND state = 'active' AND pid <> pg_backend_pid()),
+    sum(xact_commit), sum(xact_rollback), sum(blks_hit), sum(blks_read), sum(temp_bytes), sum(deadlocks),
+    (SELECT count(*) FROM pg_ls_dir('pg_wal/archive_status') AS f WHERE f LIKE '%.ready'),
+    (SELECT failed_count FROM pg_stat_archiver),
+    current_setting('data_directory')
+FROM pg_stat_database;
+"""
+SAMPLE_FIELDS = ("connections", "max_connections", "active", "waiting_on_locks", "longest_query_seconds",
+                 "xact_commit", "xact_rollback", "blks_hit", "blks_read", "temp_bytes", "deadlocks",
+                 "wal_ready", "archive_failed_count")
+FAILED_LOGIN_RE = re.compile(r"password authentication failed|no pg_hba\.conf entry")
+
+
+class PsqlSession:
+    """One psql process kept open; each query is followed by an \\echo marker"""
+
+    MARKER = "__pg_monitor_agent_done__"
+
+    def __init__(self, dbname="postgres"):
+        self.dbname = dbname
+        self.proc = None
+        self.buffer = b""
+
+    def _start(self):
+        self.proc = subprocess.Popen(
+            PSQL_CMD + ["-X", "-q", "-A", "-t", "-F", "\t", "-d", self.dbname],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        )
+        self.buffer = b""
+
+    def close(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait(timeout=5)
+        self.proc = None
+
+    def query(self, sql, timeout=QUERY_TIMEOUT):
+        """Rows as lists of strings; RuntimeError (and a fresh process next time) on any failure"""
+        if self.proc is None or self.proc.poll() is not None:
+            self._start()
+        try:
+            self.proc.stdin.write(f"{sql.strip()}\n\\echo {self.MARKER}\n".encode())
+            self.proc.stdin.flush()
+            lines = self._read_until_marker(timeout)
+        except (OSError, RuntimeError) as e:
+            self.close()
+            raise RuntimeError(str(e)) from e
+        errors = [line for line in lines if "ERROR:" in line or "FATAL:" in line or "could not connect" in line]
+        if errors:
+            raise RuntimeError(errors[0])
+        return [line.split("\t") for line in lines if line]
+
+    def _read_until_marker(self, timeout):
+        deadline = time.time() + timeout
+        fd = self.proc.stdout.fileno()
+        while f"{self.MARKER}\n".encode() not in self.buffer:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise RuntimeError(f"no answer from psql within {timeout}s")
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise RuntimeError(self.buffer.decode(errors="replace").strip() or "psql exited")
+                self.buffer += chunk
+        out, _, self.buffer = self.buffer.partition(f"{self.MARKER}\n".encode())
+        return out.decode(errors="replace").splitlines()
+
+
+class LogTail:
+    """Counts failed logins in the PostgreSQL log since the previous call"""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.path = None
+        self.offset = 0
+
+    def count(self):
+        paths = sorted(glob.glob(self.pattern), key=os.path.getmtime)
+        if not paths:
+            return 0
+        path = paths[-1]
+        size = os.path.getsize(path)
+        if path != self.path or size < self.offset:
+            if self.path is None:
+                self.path, self.offset = path, size  # start at the end: only new lines count
+                return 0
+            self.path, self.offset = path, 0         # rotated
+        with open(path, "rb") as fh:
+            fh.seek(self.offset)
+            data = fh.read()
+        self.offset += len(data)
+        return sum(1 for line in data.decode(errors="replace").splitlines() if FAILED_LOGIN_RE.search(line))
+
+
+def read_cpu_times():
+    with open("/proc/stat") as fh:
+        values = [int(v) for v in fh.readline().split()[1:]]
+    idle = values[3] + (values[4] if len(values) > 4 else 0)
+    return sum(values), idle
+
+
+def memory_pct():
+    info = {}
+    with open("/proc/meminfo") as fh:
+        for line in fh:
+            key, value = line.split(":", 1)
+            info[key] = int(value.split()[0])
+    return round(100 * (1 - info["MemAvailable"] / info["MemTotal"]), 1)
+
+
+def disk_pct(path):
+    st = os.statvfs(path)
+    used = (st.f_blocks - st.f_bfree) * st.f_frsize
+    usable = used + st.f_bavail * st.f_frsize
+    return round(100 * used / usable, 1) if usable else 0.0
+
+
+def newest_backup_age_hours(backup_dir=BACKUP_DIR):
+    dirs = glob.glob(os.path.join(backup_dir, "basebackup_*"))
+    if not dirs:
+        return None
+    return round((time.time() - max(os.path.getmtime(d) for d in dirs)) / 3600, 1)
+
+
+class MonitorAgent:
+    def __init__(self, args, log):
+        self.args = args
+        self.log = log
+        self.db = PsqlSession()
+        self.logins = LogTail(args.pg_log)
+        self.ring = collections.deque(maxlen=max(1, RING_MINUTES * 60 // args.interval))
+        self.alerts = {}  # check name -> {"severity", "since", "sent", "message"}
+        self.cpu = read_cpu_times()
+        self.data_directory = None
+        self.stop = threading.Event()
+
+    # ------------------------------------------------------------------
+    # sampling
+    # ------------------------------------------------------------------
+
+    def sample(self):
+        s = {"time": time.time(), "at": time.strftime("%Y-%m-%d %H:%M:%S")}
+        total, idle = read_cpu_times()
+        dt, di = total - self.cpu[0], idle - self.cpu[1]
+        self.cpu = (total, idle)
+        s["cpu_pct"] = round(100 * (1 - di / dt), 1) if dt else 0.0
+        s["memory_pct"] = memory_pct()
+        try:
+            row = self.db.query(SAMPLE_SQL)[0]
+            s.update({k: int(float(v or 0)) for k, v in zip(SAMPLE_FIELDS, row)})
+            self.data_directory = row[-1]
+            s["db_up"], s["db_error"] = True, None
+        except (RuntimeError, IndexError, ValueError) as e:
+            s["db_up"], s["db_error"] = False, str(e)
+        s["disk_pct"] = {}
+        for path in filter(None, (self.data_directory, BACKUP_ROOT, "/")):
+            try:
+                s["disk_pct"][path] = disk_pct(path)
+            except OSError:
+                continue
+        try:
+            s["failed_logins"] = self.logins.count()
+        except OSError:
+            s["failed_logins"] = 0
+        s["backup_age_hours"] = newest_backup_age_hours()
+        self.ring.append(s)
+        return s
+
+    def window(self, minutes):
+        cutoff = time.time() - minutes * 60
+        return [s for s in self.ring if s["time"] >= cutoff]
+
+    def average(self, value, minutes=AVERAGE_MINUTES):
+        """Mean of value(sample) over the window, skipping samples it returns None for"""
+        values = [v for v in map(value, self.window(minutes)) if v is not None]
+        return round(sum(values) / len(values), 1) if values else 0.0
+
+    def level(self, name, value, *thresholds):
+        """Index of the highest threshold value exceeds, or None
+
+        While the check is active every threshold is RESOLVE_MARGIN_PCT lower,
+        so a value sitting on the threshold keeps its state.
+        """
+        margin = RESOLVE_MARGIN_PCT if name in self.alerts else 0
+        exceeded = [i for i, threshold in enumerate(thresholds) if value > threshold - margin]
+        return exceeded[-1] if exceeded else None
+
+    # ------------------------------------------------------------------
+    # checks: (name, severity or None, message, group)
+    # ------------------------------------------------------------------
+
+    def evaluate(self, s):
+        results = [("Database Down", None if s["db_up"] else "CRITICAL",
+                    f"PostgreSQL not responding: {s['db_error']}", SUPPORT_GROUP)]
+        for path, pct in s["disk_pct"].items():
+            severity = "CRITICAL" if pct > self.args.disk_crit else "WARNING" if pct > self.args.disk_warn else None
+            results.append((f"Disk Space {path}", severity, f"{path} is {pct}% full", DBA_GROUP))
+        cpu = self.average(lambda x: x["cpu_pct"])
+        results.append(("High CPU", "HIGH" if self.level("High CPU", cpu, CPU_PCT) is not None else None,
+                        f"CPU at {cpu}% (average over {AVERAGE_MINUTES} min)", DBA_GROUP))
+        memory = self.average(lambda x: x["memory_pct"])
+        results.append(("High Memory", "HIGH" if self.level("High Memory", memory, MEMORY_PCT) is not None else None,
+                        f"memory at {memory}% (average over {AVERAGE_MINUTES} min)", DBA_GROUP))
+
+        failed = sum(x["failed_logins"] for x in self.window(FAILED_LOGIN_MINUTES))
+        results.append(("Failed Logins", "HIGH" if failed > FAILED_LOGINS else None,
+                        f"{failed} failed logins in {FAILED_LOGIN_MINUTES} min", DBA_GROUP))
+        age = s["backup_age_hours"]
+        results.append(("Backup Age", "MEDIUM" if age is None or age > BACKUP_AGE_HOURS else None,
+                        f"newest base backup is {age} hours old" if age is not None else "no base backup found",
+                        DBA_GROUP))
+        if not s["db_up"]:
+            return results
+
+        pct = self.average(lambda x: 100 * x["connections"] / x["max_connections"] if x.get("db_up") else None)
+        level = self.level("Connections", pct, CONNECTIONS_WARN_PCT, CONNECTIONS_CRIT_PCT)
+        results.append(("Connections", None if level is None else ("WARNING", "CRITICAL")[level],
+                        f"{s['connections']} of {s['max_connections']} connections "
+                        f"({pct:.0f}% average over {AVERAGE_MINUTES} min)", DBA_GROUP))
+        minutes = s["longest_query_seconds"] / 60
+        results.append(("Long-Running Query", "CRITICAL" if minutes >= QUERY_CRIT_MINUTES else
+                        "WARNING" if minutes >= QUERY_WARN_MINUTES else None,
+                        f"longest active query has run {minutes:.0f} min", DBA_GROUP))
+        results.append(("WAL Accumulation", "CRITICAL" if s["wal_ready"] >= WAL_READY_CRIT else
+                        "WARNING" if s["wal_ready"] >= WAL_READY_WARN else None,
+                        f"{s['wal_ready']} WAL segments waiting to be archived", DBA_GROUP))
+        recent = [x for x in self.window(TEMP_MINUTES) if x.get("db_up")]
+        temp = recent[-1]["temp_bytes"] - recent[0]["temp_bytes"] if len(recent) > 1 else 0
+        results.append(("Temp File Usage", "MEDIUM" if temp > TEMP_BYTES else None,
+                        f"{temp / (1 << 30):.1f} GB of temp files in {TEMP_MINUTES} min", DBA_GROUP))
+        return results
+
+    def alert(self, results):
+        now = time.time()
+        for name, severity, message, group in results:
+            active = self.alerts.get(name)
+            if severity is None:
+                if active:
+                    # hold-down: only resolve once the check has stayed clear for RESOLVE_MINUTES
+                    clear_since = active.setdefault("clear_since", now)
+                    if now - clear_since >= RESOLVE_MINUTES * 60:
+                        self.send(group, f"RESOLVED: {name}",
+                                  f"{message} (was {active['severity']} since {active['since']})")
+                        del self.alerts[name]
+                continue
+            if active:
+                active.pop("clear_since", None)
+            if (active is None or active["severity"] != severity
+                    or now - active["sent"] >= self.args.realert_minutes * 60):
+                self.send(group, f"{severity}: {name}", message)
+                since = active["since"] if active else time.strftime("%Y-%m-%d %H:%M:%S")
+                active = {"severity": severity, "since": since, "sent": now}
+            active["message"] = message
+            self.alerts[name] = active
+
+    def send(self, group, subject, body):
+        self.log(f"ALERT [{group}] {subject} - {body}")
+        if self.args.no_alerts or not os.path.exists(ALERT_SCRIPT):
+            return
+        try:
+            subprocess.run([ALERT_SCRIPT, group, f"CLAIMANTS-TESTDB {subject}", body],
+                           capture_output=True, timeout=60)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self.log(f"WARNING: send_alert.sh failed: {e}")
+
+    # ------------------------------------------------------------------
+    # status
+    # ------------------------------------------------------------------
+
+    def status(self):
+        latest = self.ring[-1] if self.ring else {}
+        summary = {}
+        for key in ("cpu_pct", "memory_pct", "connections", "active", "waiting_on_locks", "wal_ready"):
+            values = [s[key] for s in self.ring if key in s]
+            if values:
+                summary[key] = {"min": min(values), "avg": round(sum(values) / len(values), 1), "max": max(values)}
+        return {
+            "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "interval_seconds": self.args.interval,
+            "samples": len(self.ring),
+            "latest": {k: v for k, v in latest.items() if k != "time"},
+            "ring_summary": summary,
+            "active_alerts": {name: {k: v for k, v in a.items() if k not in ("sent", "clear_since")}
+                              for name, a in self.alerts.items()},
+        }
+
+    def write_status(self):
+        tmp = f"{self.args.status_file}.tmp"
+        with open(tmp, "w") as fh:
+            json.dump(self.status(), fh, indent=2)
+        os.replace(tmp, self.args.status_file)
+
+    def run(self):
+        self.log("========== PostgreSQL Monitoring Agent Starting ==========")
+        self.log(f"Sampling every {self.args.interval}s, ring buffer of {self.ring.maxlen} samples")
+        while not self.stop.is_set():
+            started = time.time()
+            sample = self.sample()
+            self.alert(self.evaluate(sample))
+            self.write_status()
+            self.stop.wait(max(0.0, self.args.interval - (time.time() - started)))
+        self.db.close()
+        self.log("========== PostgreSQL Monitoring Agent Stopped ==========")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent PostgreSQL and host monitoring agent")
+    parser.add_argument("--interval", type=int, default=INTERVAL, help="seconds between samples")
+    parser.add_argument("--realert-minutes", type=int, default=REALERT_MINUTES,
+                        help="repeat an alert this often while it stays bad")
+    parser.add_argument("--disk-warn", type=float, default=DISK_WARN_PCT)
+    parser.add_argument("--disk-crit", type=float, default=DISK_CRIT_PCT)
+    parser.add_argument("--pg-log", default=PG_LOG_GLOB, help="PostgreSQL log file(s) scanned for failed logins")
+    parser.add_argument("--status-file", default=STATUS_FILE)
+    parser.add_argument("--no-alerts", action="store_true", help="log alerts without calling send_alert.sh")
+    parser.add_argument("--once", action="store_true", help="take one sample, print it and the checks, exit")
+    parser.add_argument("--status", action="store_true", help="print the running agent's status and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        try:
+            with open(args.status_file) as fh:
+                print(fh.read())
+        except FileNotFoundError:
+            print(f"[!] No status file at {args.status_file}; is the agent running?")
+            return False
+        return True
+
+    agent = MonitorAgent(args, Logger(LOG_FILE))
+    if args.once:
+        time.sleep(1)  # CPU is a delta between two readings
+        sample = agent.sample()
+        print(json.dumps({k: v for k, v in sample.items() if k != "time"}, indent=2))
+        results = agent.evaluate(sample)
+        for name, severity, message, _ in results:
+            print(f"{severity or 'OK':<9} {name:<28} {message}")
+        agent.db.close()
+        return all(severity is None for _, severity, _, _ in results)
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: agent.stop.set())
+    agent.run()
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL Point-in-Time Restore
+Plans and prepares a PITR so recovery runs at disk speed instead of one WAL
+round trip per segment.
+
+  restore   pick the newest catalogued backup that finished before
+            --target-time / --target-lsn, extract its chain (all members in
+            parallel, each streamed zstd -> tar, then pg_combinebackup for
+            incrementals) into --target and write recovery settings whose
+            restore_command is `pitr_restore.py fetch`
+  fetch     the restore_command: hands PostgreSQL %f from a local cache and
+            keeps a background prefetcher filling the cache with the next
+            --prefetch segments concurrently (gunzip from the local archive,
+            falling back to the SMB share)
+  plan      show which backup and WAL range a target needs, change nothing
+
+Start PostgreSQL on --target afterwards. Recovery pauses at the target
+(recovery_target_action = 'pause') unless --promote is given; check the data,
+then SELECT pg_wal_replay_resume() to promote.
+
+Run with:
+  python3 pitr_restore.py plan --target-time '2026-02-01 12:00:00'
+  python3 pitr_restore.py restore --target /var/lib/postgresql/16/main --target-time '2026-02-01 12:00:00'
+  python3 pitr_restore.py restore --target /srv/pitr --target-lsn 1A/2B000028 --promote
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import fcntl
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import backup_chain
+from backup_common import BACKUP_DIR, BACKUP_ROOT, LOG_DIR, REMOTE_WAL_DIR, WAL_ARCHIVE_DIR, Logger
+
+LOG_FILE = f"{LOG_DIR}/pg_pitr_restore.log"
+CACHE_DIR = f"{BACKUP_ROOT}/wal_prefetch"
+PREFETCH = 8
+WAL_SEGMENT_SIZE = 16 << 20
+IDLE_TIMEOUT = 120
+IN_FLIGHT_WAIT = 60
+HEX = set("0123456789ABCDEF")
+
+
+# ---------------------------------------------------------------------------
+# WAL names
+# ---------------------------------------------------------------------------
+
+def parse_lsn(lsn):
+    hi, lo = lsn.split("/")
+    return (int(hi, 16) << 32) | int(lo, 16)
+
+
+def is_segment(name):
+    return len(name) == 24 and set(name) <= HEX
+
+
+def next_segment(name, segment_size, step=1):
+    per_id = 0x100000000 // segment_size
+    segno = int(name[8:16], 16) * per_id + int(name[16:], 16) + step
+    return f"{name[:8]}{segno // per_id:08X}{segno % per_id:08X}"
+
+
+def segment_name(timeline, lsn, segment_size):
+    per_id = 0x100000000 // segment_size
+    segno = parse_lsn(lsn) // segment_size
+    return f"{timeline:08X}{segno // per_id:08X}{segno % per_id:08X}"
+
+
+def find_wal(name, wal_dirs):
+    """Path of name (.gz or plain) in the first WAL directory that has it"""
+    for directory in wal_dirs:
+        for candidate in (f"{name}.gz", name):
+            path = os.path.join(directory, candidate)
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def copy_wal(src, dest):
+    """Decompress/copy src to dest via a temp file so dest only ever appears complete"""
+    tmp = f"{dest}.tmp"
+    opener = gzip.open if src.endswith(".gz") else open
+    with opener(src, "rb") as fin, open(tmp, "wb") as fout:
+        shutil.copyfileobj(fin, fout, 1 << 20)
+    os.replace(tmp, dest)
+
+
+# ---------------------------------------------------------------------------
+# fetch (restore_command) and the background prefetcher
+# ---------------------------------------------------------------------------
+
+def write_cursor(cache_dir, name):
+    tmp = os.path.join(cache_dir, "cursor.tmp")
+    with open(tmp, "w") as fh:
+        fh.write(name)
+    os.replace(tmp, os.path.join(cache_dir, "cursor"))
+
+
+def read_cursor(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "cursor")) as fh:
+            return fh.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def start_prefetcher(args):
+    """Spawn a detached prefetcher unless one already holds the lock"""
+    with open(os.path.join(args.cache_dir, "prefetch.lock"), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    cmd = [sys.executable, os.path.abspath(__file__), "prefetch", "--cache-dir", args.cache_dir,
+           "--prefetch", str(args.prefetch), "--segment-size", str(args.segment_size)]
+    for directory in args.wal_dir:
+        cmd += ["--wal-dir", directory]
+    subprocess.Popen(cmd, start_new_session=True, stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def cmd_fetch(args):
+    os.makedirs(args.cache_dir, exist_ok=True)
+    cached = os.path.join(args.cache_dir, args.name)
+    if is_segment(args.name):
+        write_cursor(args.cache_dir, args.name)
+        start_prefetcher(args)
+        deadline = time.time() + IN_FLIGHT_WAIT
+        while os.path.exists(f"{cached}.tmp") and time.time() < deadline:
+            time.sleep(0.05)
+        if os.path.exists(cached):
+            shutil.move(cached, args.path)
+            return True
+    src = find_wal(args.name, args.wal_dir)
+    if src is None:
+        return False  # normal at the end of the archive / for future timeline history files
+    copy_wal(src, args.path)
+    return True
+
+
+def cmd_prefetch(args):
+    """Keep the next --prefetch segments after the cursor in the cache; exit when idle"""
+    lock = open(os.path.join(args.cache_dir, "prefetch.lock"), "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+
+    def fetch_one(name):
+        src = find_wal(name, args.wal_dir)
+        if src is None:
+            return False
+        copy_wal(src, os.path.join(args.cache_dir, name))
+        return True
+
+    in_flight, missing = {}, set()
+    cursor, last_move = None, time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.prefetch) as pool:
+        while time.time() - last_move < IDLE_TIMEOUT:
+            current = read_cursor(args.cache_dir)
+            if current != cursor:
+                cursor, last_move = current, time.time()
+                missing.clear()
+                for name in os.listdir(args.cache_dir):
+                    # Consumed, skipped or from an abandoned timeline
+                    if is_segment(name) and (name[:8] != cursor[:8] or name[8:] < cursor[8:]) \
+                            and name not in in_flight:
+                        os.remove(os.path.join(args.cache_dir, name))
+            if cursor and is_segment(cursor):
+                for step in range(1, args.prefetch + 1):
+                    name = next_segment(cursor, args.segment_size, step)
+                    if name in in_flight or name in missing or os.path.exists(os.path.join(args.cache_dir, name)):
+                        continue
+                    in_flight[name] = pool.submit(fetch_one, name)
+            for name, future in list(in_flight.items()):
+                if future.done():
+                    del in_flight[name]
+                    if future.exception() is not None or not future.result():
+                        missing.add(name)  # not archived yet; retried when the cursor moves
+            time.sleep(0.1)
+    return True
+
+
+# ---------------------------------------------------------------------------
+# plan / restore
+# ---------------------------------------------------------------------------
+
+def candidate_backups():
+    """FULL/INCREMENTAL backups as dicts with end time and LSNs, newest first"""
+    try:
+        rows = backup_chain.fetch_rows("backup_type IN ('FULL', 'INCREMENTAL')", order="backup_date DESC")
+    except RuntimeError:
+        rows = []
+    for row in rows:
+        row["finished"] = datetime.datetime.strptime(row["backup_date"][:19], "%Y-%m-%d %H:%M:%S")
+    if rows:
+        return rows
+    # No catalog entries: plain backup_stream.py / pg_basebackup.sh directories
+    found = []
+    for name in sorted(os.listdir(BACKUP_DIR), reverse=True) if os.path.isdir(BACKUP_DIR) else []:
+        manifest = os.path.join(BACKUP_DIR, name, "backup_manifest")
+        if not name.startswith("basebackup_") or not os.path.isfile(manifest):
+            continue
+        with open(manifest) as fh:
+            ranges = json.load(fh).get("WAL-Ranges", [])
+        found.append({
+            "backup_name": name, "backup_type": "FULL", "chain_name": name,
+            "backup_location": os.path.join(BACKUP_DIR, name), "remote_location": "",
+            "start_lsn": ranges[0]["Start-LSN"] if ranges else "",
+            "end_lsn": ranges[-1]["End-LSN"] if ranges else "",
+            "timeline": ranges[0]["Timeline"] if ranges else 1,
+            "finished": datetime.datetime.fromtimestamp(os.path.getmtime(manifest)),
+        })
+    return found
+
+
+def choose_backup(args):
+    for row in candidate_backups():
+        if args.target_lsn:
+            if row["end_lsn"] and parse_lsn(row["end_lsn"]) <= parse_lsn(args.target_lsn):
+                return row
+        elif args.target_time:
+            if row["finished"] <= args.target_time:
+                return row
+        else:
+            return row
+    target = args.target_lsn or args.target_time or "latest"
+    raise RuntimeError(f"no backup finished before {target}")
+
+
+def backup_timeline(row):
+    if "timeline" in row:
+        return int(row["timeline"])
+    manifest = os.path.join(row["backup_location"], "backup_manifest")
+    if os.path.isfile(manifest):
+        with open(manifest) as fh:
+            ranges = json.load(fh).get("WAL-Ranges", [])
+        if ranges:
+            return int(ranges[0]["Timeline"])
+    return 1
+
+
+def chain_images(row):
+    if row["backup_type"] == "FULL":
+        return [row]
+    images, _ = backup_chain.restore_chain(row["backup_name"])
+    return images
+
+
+def image_archive(member):
+    """base.tar.* of a chain member, local copy first, then the share"""
+    for directory in (member["backup_location"], member.get("remote_location")):
+        if directory and os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.startswith("base.tar.") and not name.endswith(".sha256"):
+                    return os.path.join(directory, name)
+    raise RuntimeError(f"no archive found for {member['backup_name']}")
+
+
+def describe_plan(args, log):
+    row = choose_backup(args)
+    images = chain_images(row)
+    first = segment_name(backup_timeline(row), row["start_lsn"], args.segment_size) if row["start_lsn"] else None
+    log(f"Target: {args.target_lsn or args.target_time or 'end of archived WAL'}")
+    log(f"Base backup: {row['backup_name']} ({row['backup_type']}, finished {row['finished']:%Y-%m-%d %H:%M:%S})")
+    for member in images:
+        log(f"  extract {image_archive(member)}")
+    if first:
+        where = find_wal(first, args.wal_dir)
+        log(f"First WAL segment needed: {first} ({'found in ' + os.path.dirname(where) if where else 'NOT FOUND'})")
+    return row, images
+
+
+def extract_images(images, target, work_dir, log):
+    """Extract every chain member concurrently, combining incrementals into target"""
+    if len(images) == 1:
+        backup_chain.extract(image_archive(images[0]), target)
+        return
+    dirs = [os.path.join(work_dir, m["backup_name"]) for m in images]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(images)) as pool:
+        list(pool.map(backup_chain.extract, [image_archive(m) for m in images], dirs))
+    log(f"Running pg_combinebackup over {len(dirs)} backups")
+    subprocess.run(["pg_combinebackup", *dirs, "-o", target], check=True)
+
+
+def write_recovery(args):
+    fetch = [sys.executable, os.path.abspath(__file__), "fetch", "%f", "%p", "--cache-dir", args.cache_dir,
+             "--prefetch", str(args.prefetch), "--segment-size", str(args.segment_size)]
+    for directory in args.wal_dir:
+        fetch += ["--wal-dir", directory]
+    settings = {
+        "restore_command": "'" + " ".join(fetch) + "'",
+        "recovery_target_action": "'promote'" if args.promote else "'pause'",
+    }
+    if args.target_lsn:
+        settings["recovery_target_lsn"] = f"'{args.target_lsn}'"
+    elif args.target_time:
+        settings["recovery_target_time"] = f"'{args.target_time:%Y-%m-%d %H:%M:%S}'"
+    with open(os.path.join(args.target, "postgresql.auto.conf"), "a") as fh:
+        fh.write(f"\n# pitr_restore.py {datetime.datetime.now():%Y-%m-%d %H:%M:%S}\n")
+        fh.writelines(f"{key} = {value}\n" for key, value in settings.items())
+    standby = os.path.join(args.target, "standby.signal")
+    if os.path.exists(standby):
+        os.remove(standby)
+    open(os.path.join(args.target, "recovery.signal"), "w").close()
+
+
+def cmd_plan(args, log):
+    describe_plan(args, log)
+    return True
+
+
+def cmd_restore(args, log):
+    if os.path.isdir(args.target) and os.listdir(args.target):
+        log(f"ERROR: {args.target} is not empty; stop PostgreSQL and move the old data directory aside")
+        return False
+    log("========== Starting Point-in-Time Restore ==========")
+    row, images = describe_plan(args, log)
+
+    start = time.time()
+    work = os.path.join(args.work_dir or os.path.dirname(os.path.abspath(args.target)), f".pitr_{os.getpid()}")
+    try:
+        extract_images(images, args.target, work, log)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    log(f"Extracted {len(images)} backup(s) in {time.time() - start:.1f}s")
+
+    if os.path.isdir(args.cache_dir):
+        shutil.rmtree(args.cache_dir)
+    os.makedirs(args.cache_dir)
+    write_recovery(args)
+    if args.owner:
+        subprocess.run(["chown", "-R", f"{args.owner}:", args.target, args.cache_dir], check=True)
+    os.chmod(args.target, 0o700)
+
+    log(f"Recovery configured in {args.target}/postgresql.auto.conf "
+        f"(prefetching {args.prefetch} segments into {args.cache_dir})")
+    log("Next: start PostgreSQL on this data directory and watch its log; recovery "
+        + ("promotes at the target." if args.promote else "pauses at the target, then run SELECT pg_wal_replay_resume();"))
+    log("========== Point-in-Time Restore Prepared ==========")
+    return True
+
+
+def parse_time(value):
+    return datetime.datetime.fromisoformat(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Point-in-time restore with concurrent WAL prefetch")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def wal_options(p):
+        p.add_argument("--cache-dir", default=CACHE_DIR, help="local WAL prefetch cache")
+        p.add_argument("--prefetch", type=int, default=PREFETCH, help="segments fetched ahead concurrently")
+        p.add_argument("--segment-size", type=int, default=WAL_SEGMENT_SIZE, help="wal_segment_size in bytes")
+        p.add_argument("--wal-dir", action="append", help="WAL archive directories, searched in order "
+                       f"(default: {WAL_ARCHIVE_DIR}, {REMOTE_WAL_DIR})")
+
+    for command in ("plan", "restore"):
+        p = sub.add_parser(command)
+        target = p.add_mutually_exclusive_group()
+        target.add_argument("--target-time", type=parse_time, help="recovery_target_time, e.g. '2026-02-01 12:00:00'")
+        target.add_argument("--target-lsn", help="recovery_target_lsn, e.g. 1A/2B000028")
+        wal_options(p)
+        if command == "restore":
+            p.add_argument("--target", required=True, help="empty data directory to restore into")
+            p.add_argument("--promote", action="store_true", help="promote at the target instead of pausing")
+            p.add_argument("--owner", default="postgres", help="chown the data directory to this user ('' to skip)")
+            p.add_argument("--work-dir", default=None, help="scratch space for incremental chain members")
+
+    fetch = sub.add_parser("fetch", help="restore_command: pitr_restore.py fetch %%f %%p")
+    fetch.add_argument("name")
+    fetch.add_argument("path")
+    wal_options(fetch)
+    prefetch = sub.add_parser("prefetch", help="background prefetcher (started by fetch)")
+    wal_options(prefetch)
+    args = parser.parse_args()
+    args.wal_dir = args.wal_dir or [WAL_ARCHIVE_DIR, REMOTE_WAL_DIR]
+
+    # fetch/prefetch run as the postgres server's restore_command: no log file, stderr only
+    if args.command == "fetch":
+        return cmd_fetch(args)
+    if args.command == "prefetch":
+        return cmd_prefetch(args)
+
+    log = Logger(LOG_FILE)
+    commands = {"plan": cmd_plan, "restore": cmd_restore}
+    try:
+        return commands[args.command](args, log)
+    except (RuntimeError, subprocess.CalledProcessError) as e:
+        log(f"ERROR: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        sys.exit(1)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL Backup Retention Engine
+Replaces the `find -mtime +14 -delete` passes in pg_basebackup.sh,
+backup_stream.py and wal_cleanup.sh.
+
+1. Inventory base backups from public.backup_metadata plus the basebackup_*
+   directories in the local and remote backup roots (one top-level listing
+   each; tens of entries, not thousands)
+2. Pick the backups to keep with a GFS policy: the newest backup of each of
+   the last --daily days, --weekly ISO weeks and --monthly months. Keeping
+   an incremental keeps the chain members it is built on
+3. Work out the WAL still needed: everything from the start LSN of the
+   oldest kept backup inside the --pitr-days window. Older GFS backups carry
+   their own WAL in the tar (-X fetch / -Xs) and stay restorable to their end
+4. Delete everything else in batches: backup directories, local WAL (one
+   listing of the local archive), remote WAL taken from the wal_shipper.py
+   index instead of listing the share, and mark catalog rows EXPIRED
+
+WAL is compared the way pg_archivecleanup does (log/segment part of the
+name, timeline ignored); .history files are always kept. If a kept
+backup's start LSN cannot be found, no WAL is deleted.
+
+Run with:
+  python3 retention_engine.py --dry-run
+  python3 retention_engine.py --daily 14 --weekly 4 --monthly 3
+  python3 retention_engine.py --reindex-remote   (once, to index WAL shipped before wal_shipper.py)
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import shutil
+import sys
+import time
+
+import backup_chain
+import backup_telemetry
+from backup_common import (
+    BACKUP_DIR, LOG_DIR, REMOTE_BACKUP_DIR, REMOTE_WAL_DIR, RETENTION_DAYS, WAL_ARCHIVE_DIR,
+    Logger, ensure_mount, run_sql,
+)
+from wal_shipper import INDEX_FILE, ShippedIndex
+
+LOG_FILE = f"{LOG_DIR}/pg_retention.log"
+WEEKLY = 4
+MONTHLY = 3
+WAL_SEGMENT_SIZE = 16 << 20
+BATCH_SIZE = 500
+DELETE_WORKERS = 8
+
+
+class Backup:
+    def __init__(self, name, backup_type, date, start_lsn=None, chain=None, catalog=False):
+        self.name = name
+        self.type = backup_type
+        self.date = date
+        self.start_lsn = start_lsn
+        self.chain = chain or name
+        self.catalog = catalog
+        self.dirs = []
+        self.reasons = []
+
+
+def parse_lsn(lsn):
+    hi, lo = lsn.split("/")
+    return (int(hi, 16) << 32) | int(lo, 16)
+
+
+def segment_key(lsn, segment_size):
+    """Log/segment part (16 hex chars) of the WAL file holding lsn"""
+    segno = parse_lsn(lsn) // segment_size
+    per_id = 0x100000000 // segment_size
+    return f"{segno // per_id:08X}{segno % per_id:08X}"
+
+
+def wal_key(name):
+    """Log/segment part of an archived WAL file name, or None for .history and unknown files"""
+    base = name[:24]
+    if len(base) < 24 or ".history" in name or any(c not in "0123456789ABCDEF" for c in base):
+        return None
+    return base[8:]
+
+
+def manifest_start_lsn(directory):
+    path = os.path.join(directory, "backup_manifest")
+    if not os.path.isfile(path):
+        return None
+    with open(path) as fh:
+        ranges = json.load(fh).get("WAL-Ranges", [])
+    return ranges[0]["Start-LSN"] if ranges else None
+
+
+def inventory(roots, log):
+    """All base backups by name: catalog rows first, then uncatalogued basebackup_* directories"""
+    backups = {}
+    try:
+        rows = backup_chain.fetch_rows("TRUE")
+    except RuntimeError as e:
+        log(f"WARNING: catalog unavailable ({e}); using backup directories only")
+        rows = []
+    for row in rows:
+        date = datetime.datetime.strptime(row["backup_date"][:19], "%Y-%m-%d %H:%M:%S")
+        b = Backup(row["backup_name"], row["backup_type"], date, row["start_lsn"] or None,
+                   row["chain_name"] or row["backup_name"], catalog=True)
+        if row["backup_type"] != "WAL":
+            b.dirs = [d for d in (row["backup_location"], row["remote_location"]) if d]
+        backups[b.name] = b
+
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if not name.startswith("basebackup_") or not os.path.isdir(path):
+                continue
+            b = backups.get(name)
+            if b is None:
+                try:
+                    date = datetime.datetime.strptime(name, "basebackup_%Y-%m-%d_%H%M%S")
+                except ValueError:
+                    log(f"WARNING: skipping {path}, cannot parse a date from its name")
+                    continue
+                b = backups[name] = Backup(name, "FULL", date)
+            if path not in b.dirs:
+                b.dirs.append(path)
+            if b.start_lsn is None:
+                b.start_lsn = manifest_start_lsn(path)
+    return backups
+
+
+def gfs_keep(images, daily, weekly, monthly):
+    """Mark the newest image per day/ISO week/month bucket; the newest image is always kept"""
+    images = sorted(images, key=lambda b: b.date, reverse=True)
+    policies = (
+        ("daily", daily, lambda d: d.date()),
+        ("weekly", weekly, lambda d: d.isocalendar()[:2]),
+        ("monthly", monthly, lambda d: (d.year, d.month)),
+    )
+    for label, count, bucket in policies:
+        seen = set()
+        for b in images:
+            key = bucket(b.date)
+            if key not in seen and len(seen) < count:
+                seen.add(key)
+                b.reasons.append(label)
+    if images and not images[0].reasons:
+        images[0].reasons.append("newest")
+    return {b.name for b in images if b.reasons}
+
+
+def plan(backups, args, log):
+    """Return (names to keep, WAL cutoff key or None)"""
+    images = [b for b in backups.values() if b.type in ("FULL", "INCREMENTAL")]
+    keep = gfs_keep(images, args.daily, args.weekly, args.monthly)
+
+    # An incremental needs every earlier FULL/INCREMENTAL of its chain
+    for name in list(keep):
+        b = backups[name]
+        keep.update(m.name for m in images if m.chain == b.chain and m.date <= b.date)
+
+    window = datetime.datetime.now() - datetime.timedelta(days=args.pitr_days)
+    pitr = sorted((backups[n] for n in keep if backups[n].date >= window), key=lambda b: b.date)
+    if not pitr:
+        pitr = sorted((backups[n] for n in keep), key=lambda b: b.date)[-1:]
+    if not pitr or any(b.start_lsn is None for b in pitr):
+        missing = [b.name for b in pitr if b.start_lsn is None]
+        log(f"WARNING: start LSN unknown for {', '.join(missing) or 'every backup'}; keeping all WAL")
+        cutoff = None
+    else:
+        cutoff = min(segment_key(b.start_lsn, args.segment_size) for b in pitr)
+
+    # WAL ranges stay while the WAL they replay is kept
+    for b in backups.values():
+        if b.type == "WAL" and (cutoff is None or b.start_lsn is None
+                                or segment_key(b.start_lsn, args.segment_size) >= cutoff):
+            keep.add(b.name)
+    return keep, cutoff
+
+
+def delete_batches(paths, remove, workers, on_batch=None):
+    """Delete paths in batches of BATCH_SIZE with a thread pool; return the number deleted"""
+    deleted = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for i in range(0, len(paths), BATCH_SIZE):
+            batch = paths[i:i + BATCH_SIZE]
+            done = [p for p, ok in zip(batch, pool.map(remove, batch)) if ok]
+            if on_batch:
+                on_batch(done)
+            deleted += len(done)
+    return deleted
+
+
+def unlink(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError:
+        return False
+
+
+def cmd_reindex(args, log):
+    """List the share once and add every WAL file on it to the shipper index"""
+    index = ShippedIndex(args.index)
+    rows = [(e.name, e.stat().st_size) for e in os.scandir(args.remote_wal_dir) if e.is_file()]
+    index.add_many(rows)
+    log(f"Indexed {len(rows):,} WAL files from {args.remote_wal_dir}")
+    return True
+
+
+def run(args, log):
+    log("========== Starting Retention ==========")
+    start = time.time()
+    telemetry = backup_telemetry.Run("retention_engine", log=log)
+    # every exit (dry run, exception) still writes the run's telemetry record
+    status, error = "FAILED", None
+    try:
+        remote = not args.no_remote and ensure_mount(log)
+        roots = [args.backup_dir] + ([args.remote_dir] if remote else [])
+        with telemetry.phase("inventory"):
+            backups = inventory(roots, log)
+        with telemetry.phase("plan"):
+            keep, cutoff = plan(backups, args, log)
+
+        for b in sorted(backups.values(), key=lambda b: b.date):
+            if b.name not in keep:
+                state = "EXPIRE"
+            else:
+                state = f"keep {'/'.join(b.reasons) or '(chain)'}"
+            log(f"  {b.type:<12} {b.name:<36} {b.date:%Y-%m-%d %H:%M}  {state}")
+        log(f"WAL cutoff: {cutoff or '(none, keeping all WAL)'}")
+
+        expired = [b for b in backups.values() if b.name not in keep]
+        expire_dirs = [d for b in expired for d in b.dirs if os.path.isdir(d)]
+
+        local_wal = []
+        if cutoff:
+            local_wal = [os.path.join(args.wal_dir, n) for n in os.listdir(args.wal_dir)
+                         if wal_key(n) and wal_key(n) < cutoff]
+        index = ShippedIndex(args.index) if remote else None
+        remote_wal = sorted(n for n in index.names if wal_key(n) and wal_key(n) < cutoff) if index and cutoff else []
+
+        log(f"To delete: {len(expire_dirs)} backup directories, {len(local_wal):,} local WAL, "
+            f"{len(remote_wal):,} remote WAL")
+        if args.dry_run:
+            log("Dry run, nothing deleted")
+            status = "SUCCESS"
+            return True
+
+        with telemetry.phase("delete_backups", directories=len(expire_dirs)):
+            for d in expire_dirs:
+                shutil.rmtree(d, ignore_errors=True)
+        # Local first: the shipper re-sends anything local that is missing from its index
+        with telemetry.phase("delete_local_wal") as phase:
+            local_deleted = phase["files"] = delete_batches(local_wal, unlink, 1)
+        with telemetry.phase("delete_remote_wal") as phase:
+            remote_deleted = phase["files"] = delete_batches(
+                [os.path.join(args.remote_wal_dir, n) for n in remote_wal], unlink, args.workers,
+                on_batch=lambda done: index.remove([os.path.basename(p) for p in done]))
+        catalogued = [b.name for b in expired if b.catalog]
+        if catalogued:
+            run_sql("UPDATE public.backup_metadata SET status = 'EXPIRED' "
+                    "WHERE backup_name = ANY(string_to_array(:'names', ','))", names=",".join(catalogued))
+
+        log(f"Deleted {len(expire_dirs)} backup directories, {local_deleted:,} local WAL, "
+            f"{remote_deleted:,} remote WAL; {len(catalogued)} catalog rows EXPIRED")
+        status = "SUCCESS"
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        telemetry.finish(status, error=error, dry_run=args.dry_run)
+    log(f"========== Retention Complete in {time.time() - start:.1f}s ==========")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GFS retention for base backups and WAL, driven by the catalog")
+    parser.add_argument("--daily", type=int, default=RETENTION_DAYS, help="newest backup of each of the last N days")
+    parser.add_argument("--weekly", type=int, default=WEEKLY, help="newest backup of each of the last N ISO weeks")
+    parser.add_argument("--monthly", type=int, default=MONTHLY, help="newest backup of each of the last N months")
+    parser.add_argument("--pitr-days", type=int, default=RETENTION_DAYS,
+                        help="keep WAL from the oldest kept backup in this window")
+    parser.add_argument("--segment-size", type=int, default=WAL_SEGMENT_SIZE, help="wal_segment_size in bytes")
+    parser.add_argument("--backup-dir", default=BACKUP_DIR)
+    parser.add_argument("--remote-dir", default=REMOTE_BACKUP_DIR)
+    parser.add_argument("--wal-dir", default=WAL_ARCHIVE_DIR)
+    parser.add_argument("--remote-wal-dir", default=REMOTE_WAL_DIR)
+    parser.add_argument("--index", default=INDEX_FILE, help="wal_shipper.py index of WAL on the share")
+    parser.add_argument("--workers", type=int, default=DELETE_WORKERS, help="concurrent deletes on the share")
+    parser.add_argument("--no-remote", action="store_true", help="leave the SMB share alone")
+    parser.add_argument("--dry-run", action="store_true", help="show the plan without deleting anything")
+    parser.add_argument("--reindex-remote", action="store_true",
+                        help="list the share's WAL once into the shipper index and exit")
+    args = parser.parse_args()
+
+    log = Logger(LOG_FILE)
+    try:
+        if args.reindex_remote:
+            return ensure_mount(log) and cmd_reindex(args, log)
+        return run(args, log)
+    except RuntimeError as e:
+        log(f"ERROR: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        sys.exit(1)
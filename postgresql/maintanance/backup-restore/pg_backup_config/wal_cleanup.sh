@@ -18,6 +18,10 @@ SMB_SHARE="//192.168.180.161/db_backups$"
 SMB_MOUNT_POINT="/mnt/db_backup_share"
 REMOTE_WAL_DIR="${SMB_MOUNT_POINT}/CLAIMANTSDB-TEST/wal_archive"
 
+# Structured run record (backup_telemetry.py next to this script)
+TELEMETRY="$(dirname "$0")/backup_telemetry.py"
+START_TS=$(date +%s)
+
 # Logging function
 log() {
     echo "$(date '+%Y-%m-%d %H:%M:%S') - $1" | tee -a "$LOG_FILE"
@@ -39,7 +43,7 @@ if [ -f "$SMB_CRED_FILE" ]; then
     log "Syncing WAL archives to remote share..."
     mkdir -p "$SMB_MOUNT_POINT"
     
-    mount -t cifs "$SMB_SHARE" "$SMB_MOUNT_POINT" -o credentials="$SMB_CRED_FILE",vers=3.0,sec=ntlmssp 2>&1 || {
+    mountpoint -q "$SMB_MOUNT_POINT" || mount -t cifs "$SMB_SHARE" "$SMB_MOUNT_POINT" -o credentials="$SMB_CRED_FILE",vers=3.0,sec=ntlmssp 2>&1 || {
         log "WARNING: Could not mount SMB share."
     }
     
@@ -52,7 +56,10 @@ if [ -f "$SMB_CRED_FILE" ]; then
         find "$REMOTE_WAL_DIR" -name "*.gz" -mtime +${RETENTION_DAYS} -delete 2>&1 | tee -a "$LOG_FILE" || true
         
         log "WAL archives synced to remote share"
-        umount "$SMB_MOUNT_POINT"
+        # wal_shipper.py keeps the share mounted; leave it alone while it runs
+        if ! systemctl is-active --quiet wal-shipper; then
+            umount "$SMB_MOUNT_POINT"
+        fi
     fi
 fi
 
@@ -68,4 +75,6 @@ log "Deleted ${DELETED} old WAL archive(s)"
 FINAL_SIZE=$(du -sh "$WAL_ARCHIVE_DIR" 2>/dev/null | cut -f1)
 log "Final WAL archives: ${AFTER_COUNT} files, ${FINAL_SIZE}"
 
+python3 "$TELEMETRY" record --tool wal_cleanup.sh --seconds $(( $(date +%s) - START_TS )) \
+    >> "$LOG_FILE" 2>&1 || true
 log "========== WAL Archive Maintenance Complete =========="
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL WAL Shipper
+Long-running replacement for the */7 cron `wal_cleanup.sh` rsync loop.
+
+- watches /var/backups/postgresql/wal_archive with inotify (IN_CLOSE_WRITE /
+  IN_MOVED_TO), so a segment is shipped as soon as archive_command finishes
+  writing it instead of on the next cron tick
+- keeps the SMB share mounted and only remounts after a failed copy
+- copies with a small pool of concurrent uploaders (tmp file + rename, size
+  checked), so a partially copied segment never appears on the share
+- records every shipped segment in a local SQLite index: the archive is
+  listed once at startup to pick up anything missed while stopped, never per
+  segment, and a crash resumes from the index. The index is also the list of
+  segments on the share that retention_engine.py prunes, so the share itself
+  is never listed
+- writes lag (segments and bytes not yet shipped, age of the oldest) to a
+  status file every few seconds; `wal_shipper.py --status` prints it
+
+Retention (local and remote) is retention_engine.py. Where inotify is
+unavailable the shipper falls back to listing the archive every
+--poll-interval seconds.
+
+Run under systemd: see wal-shipper.service
+"""
+
+import argparse
+import concurrent.futures
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import shutil
+import signal
+import sqlite3
+import struct
+import sys
+import threading
+import time
+
+import backup_telemetry
+from backup_common import (
+    BACKUP_ROOT, LOG_DIR, REMOTE_WAL_DIR, WAL_ARCHIVE_DIR,
+    Logger, ensure_mount, is_mounted,
+)
+
+LOG_FILE = f"{LOG_DIR}/wal_shipper.log"
+INDEX_FILE = f"{BACKUP_ROOT}/wal_shipper.sqlite"
+STATUS_FILE = f"{LOG_DIR}/wal_shipper_status.json"
+UPLOADERS = 3
+STATUS_INTERVAL = 5
+RETRY_DELAY = 30
+TELEMETRY_INTERVAL = 3600
+POLL_INTERVAL = 10
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal inotify binding (Linux) for one directory"""
+
+    def __init__(self, path, mask=IN_CLOSE_WRITE | IN_MOVED_TO):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+
+    def read(self, timeout):
+        """Return (file names, overflowed) for events within timeout seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return [], False
+        buf = os.read(self.fd, 64 * 1024)
+        names, overflow, offset = [], False, 0
+        while offset < len(buf):
+            _, mask, _, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b"\0").decode()
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif name:
+                names.append(name)
+        return names, overflow
+
+
+class ShippedIndex:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS shipped (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                shipped_at REAL NOT NULL
+            )
+        """)
+        self.lock = threading.Lock()
+        self.names = {name for (name,) in self.db.execute("SELECT name FROM shipped")}
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def add(self, name, size):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO shipped VALUES (?, ?, ?)", (name, size, time.time()))
+            self.db.commit()
+            self.names.add(name)
+
+    def add_many(self, rows):
+        """Record (name, size) pairs already on the share"""
+        with self.lock:
+            self.db.executemany("INSERT OR IGNORE INTO shipped VALUES (?, ?, ?)",
+                                [(name, size, time.time()) for name, size in rows])
+            self.db.commit()
+            self.names.update(name for name, _ in rows)
+
+    def remove(self, names):
+        """Forget segments deleted from the share (retention_engine.py)"""
+        with self.lock:
+            self.db.executemany("DELETE FROM shipped WHERE name = ?", [(n,) for n in names])
+            self.db.commit()
+            self.names.difference_update(names)
+
+
+class WalShipper:
+    def __init__(self, args, log):
+        self.args = args
+        self.log = log
+        self.index = ShippedIndex(args.index)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=args.uploaders, thread_name_prefix="upload")
+        self.pending = {}   # name -> (size, first seen)
+        self.lock = threading.Lock()
+        self.mount_lock = threading.Lock()
+        self.stop = threading.Event()
+        self.shipped_count = 0
+        self.shipped_bytes = 0
+        self.copy_seconds = 0.0
+        self.last_error = None
+
+    def is_segment(self, name):
+        return name.endswith(".gz") and not name.startswith(".")
+
+    def enqueue(self, name):
+        path = os.path.join(self.args.wal_dir, name)
+        with self.lock:
+            if name in self.index or name in self.pending or not os.path.isfile(path):
+                return
+            self.pending[name] = (os.path.getsize(path), time.time())
+        self.pool.submit(self.ship, name)
+
+    def scan(self):
+        """List the archive once and queue every segment not in the index"""
+        present = sorted(n for n in os.listdir(self.args.wal_dir) if self.is_segment(n))
+        for name in present:
+            self.enqueue(name)
+        self.log(f"Scanned {len(present):,} archived segments, {len(self.pending):,} to ship")
+
+    def remote_ready(self):
+        with self.mount_lock:
+            if is_mounted():
+                return True
+            self.log("SMB share not mounted, mounting...")
+            return ensure_mount(self.log)
+
+    def ship(self, name):
+        src = os.path.join(self.args.wal_dir, name)
+        dest = os.path.join(self.args.remote_dir, name)
+        while not self.stop.is_set():
+            try:
+                if not self.remote_ready():
+                    raise OSError("SMB share unavailable")
+                os.makedirs(self.args.remote_dir, exist_ok=True)
+                size = os.path.getsize(src)
+                start = time.perf_counter()
+                if not (os.path.exists(dest) and os.path.getsize(dest) == size):
+                    shutil.copyfile(src, f"{dest}.tmp")
+                    if os.path.getsize(f"{dest}.tmp") != size:
+                        raise OSError(f"size mismatch copying {name}")
+                    os.replace(f"{dest}.tmp", dest)
+                self.index.add(name, size)
+                with self.lock:
+                    self.pending.pop(name, None)
+                    self.shipped_count += 1
+                    self.shipped_bytes += size
+                    self.copy_seconds += time.perf_counter() - start
+                return
+            except FileNotFoundError:
+                # Removed locally before we got to it (retention); nothing to ship
+                with self.lock:
+                    self.pending.pop(name, None)
+                return
+            except OSError as e:
+                self.last_error = f"{time.strftime('%Y-%m-%d %H:%M:%S')} {name}: {e}"
+                self.log(f"WARNING: could not ship {name}: {e}; retrying in {RETRY_DELAY}s")
+                self.stop.wait(RETRY_DELAY)
+
+    def status(self):
+        with self.lock:
+            pending = dict(self.pending)
+        now = time.time()
+        return {
+            "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "lag_segments": len(pending),
+            "lag_bytes": sum(size for size, _ in pending.values()),
+            "oldest_pending_seconds": round(now - min((t for _, t in pending.values()), default=now), 1),
+            "oldest_pending": min(pending, default=None),
+            "shipped_segments": self.shipped_count,
+            "shipped_bytes": self.shipped_bytes,
+            "indexed_segments": len(self.index.names),
+            "remote_mounted": is_mounted(),
+            "last_error": self.last_error,
+        }
+
+    def write_status(self):
+        tmp = f"{self.args.status_file}.tmp"
+        with open(tmp, "w") as fh:
+            json.dump(self.status(), fh, indent=2)
+        os.replace(tmp, self.args.status_file)
+
+    def report_interval(self, telemetry, baseline):
+        """Record the interval since baseline as one telemetry record; return the new baseline"""
+        status = self.status()
+        with self.lock:
+            now = (self.shipped_count, self.shipped_bytes, self.copy_seconds)
+        segments, nbytes, seconds = (a - b for a, b in zip(now, baseline))
+        telemetry.add_phase("ship", seconds, bytes_in=nbytes, segments=segments)
+        telemetry.finish("SUCCESS" if status["remote_mounted"] else "DEGRADED", bytes_in=nbytes,
+                         lag_segments=status["lag_segments"], lag_bytes=status["lag_bytes"])
+        return now
+
+    def run(self):
+        self.log("========== WAL Shipper Starting ==========")
+        self.log(f"Watching {self.args.wal_dir} -> {self.args.remote_dir} with {self.args.uploaders} uploaders")
+        try:
+            watcher = Inotify(self.args.wal_dir)
+        except (OSError, AttributeError) as e:
+            self.log(f"WARNING: inotify unavailable ({e}), polling every {self.args.poll_interval}s")
+            watcher = None
+        self.remote_ready()
+        self.scan()
+        last_status = last_poll = time.time()
+        telemetry, baseline = backup_telemetry.Run("wal_shipper", kind="interval", log=self.log), (0, 0, 0.0)
+        while not self.stop.is_set():
+            if watcher:
+                names, overflow = watcher.read(timeout=1.0)
+            else:
+                names, overflow = [], False
+                self.stop.wait(1.0)
+                if time.time() - last_poll >= self.args.poll_interval:
+                    names = [n for n in os.listdir(self.args.wal_dir) if n not in self.index]
+                    last_poll = time.time()
+            if overflow:
+                self.log("WARNING: inotify queue overflowed, rescanning archive")
+                self.scan()
+            for name in names:
+                if self.is_segment(name):
+                    self.enqueue(name)
+            if time.time() - last_status >= STATUS_INTERVAL:
+                self.write_status()
+                last_status = time.time()
+            if time.time() - telemetry.start >= TELEMETRY_INTERVAL:
+                baseline = self.report_interval(telemetry, baseline)
+                telemetry = backup_telemetry.Run("wal_shipper", kind="interval", log=self.log)
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.write_status()
+        self.report_interval(telemetry, baseline)
+        self.log("========== WAL Shipper Stopped ==========")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ship archived WAL segments to the SMB share as they appear")
+    parser.add_argument("--wal-dir", default=WAL_ARCHIVE_DIR)
+    parser.add_argument("--remote-dir", default=REMOTE_WAL_DIR)
+    parser.add_argument("--uploaders", type=int, default=UPLOADERS)
+    parser.add_argument("--index", default=INDEX_FILE)
+    parser.add_argument("--status-file", default=STATUS_FILE)
+    parser.add_argument("--poll-interval", type=int, default=POLL_INTERVAL,
+                        help="seconds between archive listings when inotify is unavailable")
+    parser.add_argument("--status", action="store_true", help="print the running shipper's lag and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        try:
+            with open(args.status_file) as fh:
+                print(fh.read())
+        except FileNotFoundError:
+            print(f"[!] No status file at {args.status_file}; is the shipper running?")
+            return False
+        return True
+
+    shipper = WalShipper(args, Logger(LOG_FILE))
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: shipper.stop.set())
+    shipper.run()
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+pg_hba.conf parser, rule index and in-memory editor
+The file is fetched once over SSH, parsed into typed rules and every check
+runs locally: an index keyed by (type, database, user) narrows the lookup to
+a handful of rules, then CIDR containment and overlap decide whether an
+existing rule already covers the new one or shadows some or all of it
+(matches first with a different method). The minimal edit is computed in memory and pushed back in one round
+trip: atomic replace, pg_hba_file_rules check, reload.
+
+    text, sha = pg_hba.fetch(session, PG_HBA_CONF)
+    hba = pg_hba.HbaFile(text)
+    action, other = hba.add(pg_hba.HbaRule("host", [DB_NAME], [DB_USER], "192.168.3.106/32", "md5"))
+    print(hba.diff(text))
+    ok, err = pg_hba.push(session, PG_HBA_CONF, hba.render(), sha, backup)
+
+add() returns one of:
+    present   an identical rule is already the first match
+    covered   an earlier rule with the same method already matches everything
+    append    no rule matches: appended at the end
+    conflict  a rule for the same connections exists with another method (e.g. scram-sha-256)
+    shadowed  an earlier rule with another method matches some or all of it
+              (host all all 192.168.0.0/16 scram-sha-256, a reject for its subnet)
+    insert    only with force=True: inserted before the conflicting or shadowing rule
+
+conflict and shadowed leave the file unchanged: inserting before the existing
+rule would override it (a method downgrade, a lifted reject), so add(rule,
+force=True) is needed to insert it there anyway.
+
+Run with (local file check, no changes):
+  python3 pg_hba.py /etc/postgresql/15/main/pg_hba.conf host claimant_db claimant_user 192.168.3.106/32 md5 [--force]
+"""
+
+import base64
+import difflib
+import ipaddress
+import sys
+
+CONNECTION_TYPES = ("local", "host", "hostssl", "hostnossl", "hostgssenc", "hostnogssenc")
+ADDRESS_KEYWORDS = ("all", "samehost", "samenet")
+EDITS = ("insert", "append")
+NEEDS_FORCE = ("conflict", "shadowed")
+
+
+def tokenize(line):
+    """Fields of one pg_hba.conf line: (text, quoted) pairs, comments dropped"""
+    fields, current, quoted, in_quotes, started = [], [], False, False, False
+    for ch in line:
+        if in_quotes:
+            if ch == '"':
+                in_quotes = False
+            else:
+                current.append(ch)
+        elif ch == '"':
+            in_quotes = quoted = started = True
+        elif ch == "#":
+            break
+        elif ch.isspace():
+            if started:
+                fields.append(("".join(current), quoted))
+                current, quoted, started = [], False, False
+        else:
+            current.append(ch)
+            started = True
+    if started:
+        fields.append(("".join(current), quoted))
+    return fields
+
+
+def split_list(field):
+    """'db1,db2' -> ['db1', 'db2']; a quoted "all" stays a name, marked by the quotes"""
+    text, quoted = field
+    if quoted:
+        return [f'"{text}"'] if text in ("all", "replication", "sameuser", "samerole") else [text]
+    return [item for item in text.split(",") if item]
+
+
+class HbaRule:
+    def __init__(self, conn_type, databases, users, address=None, method="md5", options=(), lineno=None):
+        self.type = conn_type
+        self.databases = list(databases)
+        self.users = list(users)
+        self.address = address
+        self.method = method
+        self.options = list(options)
+        self.lineno = lineno
+        self.network = None
+        if address and address not in ADDRESS_KEYWORDS:
+            try:
+                self.network = ipaddress.ip_network(address, strict=False)
+            except ValueError:
+                pass  # host name or .domain suffix: only an identical address matches
+
+    def key(self):
+        return (self.type, tuple(self.databases), tuple(self.users), self.address, self.method)
+
+    def render(self):
+        fields = [self.type, ",".join(self.databases), ",".join(self.users)]
+        if self.type != "local":
+            fields.append(self.address)
+        line = "    ".join(fields) + "        " + self.method
+        return " ".join([line, *self.options]) + "\n"
+
+    def covers(self, other):
+        """True when every connection `other` matches is matched by this rule"""
+        if not (self.type == other.type or (self.type == "host" and other.type.startswith("host"))):
+            return False
+        if not _names_cover(self.databases, other.databases, database=True):
+            return False
+        if not _names_cover(self.users, other.users, database=False):
+            return False
+        if self.type == "local":
+            return True
+        if self.address == "all":
+            return True
+        if self.network is not None and other.network is not None:
+            return (self.network.version == other.network.version
+                    and other.network.subnet_of(self.network))
+        return self.address == other.address
+
+    def overlaps(self, other):
+        """True when at least one connection could match both rules"""
+        if not (self.type == other.type or (self.type.startswith("host") and other.type.startswith("host")
+                                             and "host" in (self.type, other.type))):
+            return False
+        if not _names_overlap(self.databases, other.databases, database=True):
+            return False
+        if not _names_overlap(self.users, other.users, database=False):
+            return False
+        if self.type == "local" or "all" in (self.address, other.address):
+            return True
+        if self.network is not None and other.network is not None:
+            return (self.network.version == other.network.version
+                    and self.network.overlaps(other.network))
+        return self.address == other.address
+
+    def same_connections(self, other):
+        """True when both rules match exactly the same connections"""
+        return (self.type == other.type
+                and set(self.databases) == set(other.databases)
+                and set(self.users) == set(other.users)
+                and (self.address == other.address
+                     or (self.network is not None and self.network == other.network)))
+
+    def __repr__(self):
+        return f"line {self.lineno}: {self.render().strip()}"
+
+
+def _names_cover(mine, theirs, database):
+    for name in theirs:
+        if name in mine:
+            continue
+        # 'all' does not match replication connections; group (+) and file (@) entries
+        # cannot be resolved here, so they never count as covering
+        if "all" in mine and not (database and name == "replication"):
+            continue
+        return False
+    return True
+
+
+def _names_overlap(mine, theirs, database):
+    if set(mine) & set(theirs):
+        return True
+    return _names_cover(mine, theirs, database) or _names_cover(theirs, mine, database)
+
+
+def parse_line(text, lineno):
+    """HbaRule for a rule line, None for blank lines, comments and include directives"""
+    fields = tokenize(text)
+    if not fields or fields[0][0] not in CONNECTION_TYPES:
+        return None
+    conn_type = fields[0][0]
+    if len(fields) < (4 if conn_type == "local" else 5):
+        raise ValueError(f"line {lineno}: incomplete rule: {text.strip()}")
+    databases, users = split_list(fields[1]), split_list(fields[2])
+    rest = [f[0] for f in fields[3:]]
+    address = None
+    if conn_type != "local":
+        address = rest.pop(0)
+        # old-style "address mask" pair
+        if "/" not in address and rest and _is_mask(rest[0]):
+            address = str(ipaddress.ip_network(f"{address}/{rest.pop(0)}", strict=False))
+    return HbaRule(conn_type, databases, users, address, rest[0], rest[1:], lineno)
+
+
+def _is_mask(text):
+    try:
+        ipaddress.ip_address(text)
+        return True
+    except ValueError:
+        return False
+
+
+class HbaFile:
+    """Parsed pg_hba.conf; edits keep every other line byte-for-byte"""
+
+    def __init__(self, text):
+        self.lines = text.splitlines(keepends=True)
+        if self.lines and not self.lines[-1].endswith("\n"):
+            self.lines[-1] += "\n"
+        self._parse()
+
+    def _parse(self):
+        self.rules = []
+        self.index = {}
+        self.line_of = {}
+        logical, first = "", None
+        for i, line in enumerate(self.lines):
+            if first is None:
+                first = i
+            # PG16 continuation lines end in a backslash
+            if line.rstrip("\n").endswith("\\"):
+                logical += line.rstrip("\n")[:-1]
+                continue
+            rule = parse_line(logical + line, first + 1)
+            logical, start, first = "", first, None
+            if rule is None:
+                continue
+            self.rules.append(rule)
+            self.line_of[id(rule)] = start
+            for database in rule.databases:
+                for user in rule.users:
+                    self.index.setdefault((rule.type, database, user), []).append(rule)
+
+    def candidates(self, rule):
+        """Rules that may match some connection of `rule`, in file order"""
+        if rule.type.startswith("host"):
+            types = {"host", "hostssl", "hostnossl", "hostgssenc", "hostnogssenc"} if rule.type == "host" \
+                else {rule.type, "host"}
+        else:
+            types = {rule.type}
+        if "all" in rule.databases or "all" in rule.users:
+            # an 'all' rule overlaps rules for any name: the index cannot narrow it
+            return [r for r in self.rules if r.type in types]
+        found = {}
+        for conn_type in types:
+            for database in (*rule.databases, "all"):
+                for user in (*rule.users, "all"):
+                    for candidate in self.index.get((conn_type, database, user), ()):
+                        found[id(candidate)] = candidate
+        return sorted(found.values(), key=lambda r: r.lineno)
+
+    def find_covering(self, rule):
+        """First rule (file order) that matches every connection `rule` matches"""
+        return next((c for c in self.candidates(rule) if c.covers(rule)), None)
+
+    def plan(self, rule):
+        """(action, existing rule or None) for `rule`; see the module docstring"""
+        for candidate in self.candidates(rule):
+            if not candidate.overlaps(rule):
+                continue
+            same_method = candidate.method == rule.method and candidate.options == rule.options
+            if same_method:
+                if candidate.covers(rule):
+                    return ("present" if candidate.key() == rule.key() else "covered"), candidate
+                continue
+            # any earlier match with another method wins over the new rule for those connections
+            return ("conflict" if candidate.same_connections(rule) else "shadowed"), candidate
+        return "append", None
+
+    def add(self, rule, force=False):
+        """Apply the minimal edit for `rule`; return (action, existing rule or None)
+
+        conflict and shadowed change nothing unless force is set, then the
+        rule is inserted before the existing one and insert is returned.
+        """
+        action, other = self.plan(rule)
+        if action in NEEDS_FORCE and force:
+            action = "insert"
+        if action == "append":
+            self.lines.append(rule.render())
+        elif action == "insert":
+            self.lines.insert(self.line_of[id(other)], rule.render())
+        else:
+            return action, other
+        self._parse()
+        return action, other
+
+    def render(self):
+        return "".join(self.lines)
+
+    def diff(self, original, name="pg_hba.conf"):
+        return "".join(difflib.unified_diff(original.splitlines(keepends=True), self.lines,
+                                            name, f"{name} (new)"))
+
+
+# ---------------------------------------------------------------------------
+# remote side (ssh_session.SshSession): one round trip to read, one to write
+# ---------------------------------------------------------------------------
+
+def fetch(session, path):
+    """(text, sha256) of the remote file; the sha guards push() against concurrent edits"""
+    (sha_ok, sha_out, sha_err), (ok, text, err) = session.run_many(
+        [f"sudo sha256sum {path}", f"sudo cat {path}"])
+    if not (sha_ok and ok):
+        raise RuntimeError(f"could not read {path}: {(sha_err or err).strip()}")
+    return text, sha_out.split()[0]
+
+
+def push(session, path, new_text, expected_sha, backup):
+    """Back up, replace atomically, check pg_hba_file_rules, reload; (ok, error)
+
+    The file is only replaced if it still has the sha read by fetch(). If
+    PostgreSQL reports errors in the new file it is put back from the backup
+    and nothing is reloaded.
+    """
+    payload = base64.b64encode(new_text.encode()).decode()
+    script = f"""set -e
+[ "$(sudo sha256sum {path} | cut -d' ' -f1)" = "{expected_sha}" ] || {{ echo "{path} changed since it was read" >&2; exit 3; }}
+sudo cp -p {path} {backup}
+sudo cp -p {path} {path}.new
+echo '{payload}' | base64 -d | sudo tee {path}.new > /dev/null
+sudo mv {path}.new {path}
+if errors=$(sudo -u postgres psql -XtAc 'SELECT count(*) FROM pg_hba_file_rules WHERE error IS NOT NULL' 2>/dev/null) && [ "$errors" != "0" ]; then
+    sudo cp -p {backup} {path}
+    echo "new {path} has $errors error(s) in pg_hba_file_rules, restored from {backup}" >&2
+    exit 4
+fi
+sudo systemctl reload postgresql"""
+    ok, _, err = session.run(script)
+    return ok, err.strip()
+
+
+def main():
+    force = "--force" in sys.argv
+    argv = [arg for arg in sys.argv[1:] if arg != "--force"]
+    if len(argv) not in (5, 6):
+        print("usage: pg_hba.py FILE TYPE DATABASE USER ADDRESS [METHOD] [--force]")
+        return False
+    path, conn_type, database, user, address = argv[:5]
+    method = argv[5] if len(argv) == 6 else "md5"
+    with open(path) as fh:
+        text = fh.read()
+    hba = HbaFile(text)
+    rule = HbaRule(conn_type, [database], [user], address, method)
+    action, other = hba.add(rule, force=force)
+    print(f"[*] {len(hba.rules)} rules in {path}")
+    if action in NEEDS_FORCE:
+        print(f"[!] {action} ({other}), re-run with --force to insert before it")
+        return False
+    print(f"[+] {action}" + (f" ({other})" if other else ""))
+    if action in EDITS:
+        print(hba.diff(text, path))
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except (OSError, ValueError) as e:
+        print(f"[!] {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        sys.exit(1)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL Connectivity Matrix Probe
+Checks every host x port x sslmode combination concurrently with asyncio and
+a small native wire-protocol client instead of one psql per attempt: TCP
+connect, SSLRequest / TLS handshake, StartupMessage and authentication
+(trust, password, md5, SCRAM-SHA-256) up to ReadyForQuery. No PostgreSQL
+client tools needed, so it also runs from the Windows workstation.
+
+Per combination it reports the outcome (OK, HBA = no pg_hba.conf entry,
+AUTH = wrong password, NOSSL = server refused SSL, REFUSED, TIMEOUT, ...)
+and connect latency over --repeat attempts: p50/p95 per row plus a latency
+histogram for the whole sweep.
+
+Hosts: the claimants server plus every "name ip" line of ELT.txt by default,
+or --hosts name=ip,... / --hosts-file.
+
+Run with:
+  python3 pg_probe.py
+  python3 pg_probe.py --hosts 192.168.180.166 --sslmode disable,prefer,require --repeat 5
+  PGPASSWORD=... python3 pg_probe.py --hosts-file ../../../ELT.txt --user metabase --dbname metabase
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import ssl
+import statistics
+import struct
+import sys
+import time
+
+# Configuration (same claimants server as fix_postgresql_direct.py; password from PGPASSWORD)
+HOST = "192.168.180.166"
+PORT = 5432
+DB_USER = "claimant_user"
+DB_NAME = "claimant_db"
+CLIENT_IP = "192.168.3.106"
+
+ELT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "ELT.txt")
+SSLMODES = ("disable", "prefer", "require")
+CONCURRENCY = 64
+TIMEOUT = 5.0
+SSL_REQUEST = struct.pack("!ii", 8, 80877103)
+PROTOCOL_3 = 196608
+HISTOGRAM_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class ProbeError(Exception):
+    def __init__(self, status, message=""):
+        super().__init__(message or status)
+        self.status = status
+
+
+def message(kind, payload=b""):
+    return kind + struct.pack("!i", len(payload) + 4) + payload
+
+
+async def read_message(reader):
+    header = await reader.readexactly(5)
+    kind, length = header[:1], struct.unpack("!i", header[1:])[0]
+    return kind, await reader.readexactly(length - 4)
+
+
+def error_fields(payload):
+    fields = {}
+    for part in payload.split(b"\0"):
+        if part:
+            fields[part[:1].decode()] = part[1:].decode(errors="replace")
+    return fields
+
+
+def classify(fields):
+    """Status for an ErrorResponse: SQLSTATE first, pg_hba.conf text for 28000"""
+    code, text = fields.get("C", ""), fields.get("M", "")
+    if "pg_hba.conf" in text:
+        return "HBA"
+    if code in ("28P01", "28000"):
+        return "AUTH"
+    if code == "3D000":
+        return "NODB"
+    if code in ("53300", "57P03"):
+        return "BUSY"
+    return "ERROR"
+
+
+def scram_client(password):
+    """SCRAM-SHA-256 exchange as a generator: yields client messages, receives server messages"""
+    nonce = base64.b64encode(os.urandom(18)).decode()
+    first_bare = f"n=,r={nonce}"
+    server_first = yield f"n,,{first_bare}".encode()
+    attrs = dict(item.split("=", 1) for item in server_first.decode().split(","))
+    if not attrs["r"].startswith(nonce):
+        raise ProbeError("AUTH", "SCRAM nonce mismatch")
+    salted = hashlib.pbkdf2_hmac("sha256", password.encode(), base64.b64decode(attrs["s"]), int(attrs["i"]))
+    client_key = hmac.new(salted, b"Client Key", "sha256").digest()
+    final_bare = f"c=biws,r={attrs['r']}"
+    auth_message = f"{first_bare},{server_first.decode()},{final_bare}".encode()
+    signature = hmac.new(hashlib.sha256(client_key).digest(), auth_message, "sha256").digest()
+    proof = bytes(a ^ b for a, b in zip(client_key, signature))
+    yield f"{final_bare},p={base64.b64encode(proof).decode()}".encode()
+
+
+async def authenticate(reader, writer, user, password):
+    scram = None
+    while True:
+        kind, payload = await read_message(reader)
+        if kind == b"E":
+            fields = error_fields(payload)
+            raise ProbeError(classify(fields), fields.get("M", ""))
+        if kind == b"Z":
+            return
+        if kind != b"R":
+            continue  # ParameterStatus, BackendKeyData, NoticeResponse
+        code = struct.unpack("!i", payload[:4])[0]
+        if code == 0:
+            continue
+        if code == 3:
+            writer.write(message(b"p", password.encode() + b"\0"))
+        elif code == 5:
+            inner = hashlib.md5((password + user).encode()).hexdigest()
+            digest = "md5" + hashlib.md5(inner.encode() + payload[4:8]).hexdigest()
+            writer.write(message(b"p", digest.encode() + b"\0"))
+        elif code == 10:
+            if b"SCRAM-SHA-256\0" not in payload[4:]:
+                raise ProbeError("UNSUPPORTED", "no SCRAM-SHA-256 mechanism offered")
+            scram = scram_client(password)
+            first = next(scram)
+            writer.write(message(b"p", b"SCRAM-SHA-256\0" + struct.pack("!i", len(first)) + first))
+        elif code == 11:
+            writer.write(message(b"p", scram.send(payload[4:])))
+        elif code == 12:
+            continue  # server signature; AuthenticationOk follows
+        else:
+            raise ProbeError("UNSUPPORTED", f"authentication request {code}")
+        await writer.drain()
+
+
+async def connect_once(host, port, sslmode, args):
+    """One full connection attempt; returns (status, detail, {phase: ms})"""
+    timings = {}
+    start = time.perf_counter()
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), args.timeout)
+        timings["tcp"] = (time.perf_counter() - start) * 1000
+        if sslmode != "disable":
+            writer.write(SSL_REQUEST)
+            await writer.drain()
+            answer = await asyncio.wait_for(reader.readexactly(1), args.timeout)
+            if answer == b"S":
+                ctx = ssl.create_default_context()
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl.CERT_NONE
+                await asyncio.wait_for(writer.start_tls(ctx), args.timeout)
+                timings["ssl"] = (time.perf_counter() - start) * 1000 - timings["tcp"]
+            elif sslmode == "require":
+                raise ProbeError("NOSSL", "server does not accept SSL")
+        params = b"".join(k.encode() + b"\0" + v.encode() + b"\0" for k, v in
+                          (("user", args.user), ("database", args.dbname), ("application_name", "pg_probe")))
+        writer.write(struct.pack("!ii", len(params) + 9, PROTOCOL_3) + params + b"\0")
+        await writer.drain()
+        await asyncio.wait_for(authenticate(reader, writer, args.user, args.password), args.timeout)
+        timings["total"] = (time.perf_counter() - start) * 1000
+        writer.write(message(b"X"))
+        return "OK", "", timings
+    except ProbeError as e:
+        return e.status, str(e), timings
+    except asyncio.TimeoutError:
+        return "TIMEOUT", f"no answer within {args.timeout:g}s", timings
+    except ConnectionRefusedError:
+        return "REFUSED", "connection refused", timings
+    except ssl.SSLError as e:
+        return "SSLERR", str(e), timings
+    except (OSError, asyncio.IncompleteReadError) as e:
+        return "NETERR", str(e) or type(e).__name__, timings
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def probe(host, port, sslmode, args, limit):
+    attempts = []
+    for _ in range(args.repeat):
+        async with limit:
+            attempts.append(await connect_once(host, port, sslmode, args))
+    return attempts
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+def summarise(attempts):
+    """Status (the most common one), detail and p50/p95 of the successful connects"""
+    statuses = [a[0] for a in attempts]
+    status = max(set(statuses), key=statuses.count)
+    detail = next((a[1] for a in attempts if a[0] == status), "")
+    totals = sorted(a[2]["total"] for a in attempts if "total" in a[2])
+    return {"status": status, "detail": detail, "ok": statuses.count("OK"), "totals": totals,
+            "p50": percentile(totals, 50), "p95": percentile(totals, 95)}
+
+
+def read_hosts(path):
+    """[(name, address)] from a "name  ip" file like ELT.txt"""
+    hosts = []
+    with open(path) as fh:
+        for line in fh:
+            fields = line.split("#", 1)[0].split()
+            if len(fields) == 2:
+                hosts.append((fields[0], fields[1]))
+    return hosts
+
+
+def parse_hosts(args):
+    if args.hosts:
+        hosts = []
+        for item in args.hosts.split(","):
+            name, _, address = item.strip().rpartition("=")
+            hosts.append((name or address, address))
+        return hosts
+    hosts = [("claimants", HOST)]
+    if os.path.exists(args.hosts_file):
+        hosts += read_hosts(args.hosts_file)
+    return hosts
+
+
+def fmt_ms(value):
+    return f"{value:,.0f}" if value is not None else "-"
+
+
+def print_matrix(hosts, ports, sslmodes, results):
+    width = 26
+    print()
+    print(f"{'host':<28} {'port':>5}  " + "".join(f"{mode:<{width}}" for mode in sslmodes))
+    print("-" * (36 + width * len(sslmodes)))
+    for name, address in hosts:
+        for port in ports:
+            cells = []
+            for mode in sslmodes:
+                r = results[(address, port, mode)]
+                latency = f"{fmt_ms(r['p50'])}/{fmt_ms(r['p95'])}ms" if r["totals"] else ""
+                cells.append(f"{r['status']:<8}{latency:<{width - 8}}")
+            print(f"{name + ' ' + address:<28} {port:>5}  " + "".join(cells))
+    print("(status, then p50/p95 connect latency)")
+
+
+def print_details(results):
+    failures = [(key, r) for key, r in results.items() if r["status"] != "OK"]
+    if failures:
+        print()
+        for (address, port, mode), r in sorted(failures):
+            print(f"[!] {address}:{port} sslmode={mode}: {r['status']} {r['detail']}")
+
+
+def print_histogram(results):
+    totals = [t for r in results.values() for t in r["totals"]]
+    if not totals:
+        return
+    print()
+    print(f"Connect latency over {len(totals)} successful attempts: "
+          f"p50 {fmt_ms(percentile(sorted(totals), 50))}ms, p95 {fmt_ms(percentile(sorted(totals), 95))}ms")
+    lower = 0
+    for upper in (*HISTOGRAM_BUCKETS_MS, None):
+        count = sum(1 for t in totals if t >= lower and (upper is None or t < upper))
+        label = f"{lower}-{upper}ms" if upper is not None else f">={lower}ms"
+        print(f"  {label:>12} {count:>5} {'#' * round(40 * count / len(totals))}")
+        lower = upper
+
+
+async def run(args):
+    hosts = parse_hosts(args)
+    ports = [int(p) for p in str(args.port).split(",")]
+    sslmodes = [m.strip() for m in args.sslmode.split(",")]
+    limit = asyncio.Semaphore(args.concurrency)
+    keys = [(address, port, mode) for _, address in hosts for port in ports for mode in sslmodes]
+    print(f"[*] Probing {len(hosts)} hosts x {len(ports)} ports x {len(sslmodes)} sslmodes "
+          f"({len(keys)} combinations, {args.repeat} attempts each) as {args.user}@{args.dbname}")
+    start = time.perf_counter()
+    attempts = await asyncio.gather(*(probe(*key, args, limit) for key in keys))
+    results = {key: summarise(a) for key, a in zip(keys, attempts)}
+    print_matrix(hosts, ports, sslmodes, results)
+    print_details(results)
+    print_histogram(results)
+    print(f"\n[*] Sweep finished in {time.perf_counter() - start:.1f}s")
+    return results
+
+
+def check(hosts, ports=(PORT,), sslmodes=SSLMODES, user=DB_USER, dbname=DB_NAME, password="",
+          repeat=1, concurrency=CONCURRENCY, timeout=TIMEOUT):
+    """Probe [(name, address)] from other scripts; returns {(address, port, sslmode): summary}"""
+    args = argparse.Namespace(hosts=",".join(f"{name}={address}" for name, address in hosts), hosts_file="",
+                              port=",".join(map(str, ports)), sslmode=",".join(sslmodes), user=user,
+                              dbname=dbname, password=password, repeat=repeat, concurrency=concurrency,
+                              timeout=timeout)
+    return asyncio.run(run(args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent PostgreSQL connectivity matrix (TCP, SSL, auth)")
+    parser.add_argument("--hosts", help="comma-separated name=address or address entries")
+    parser.add_argument("--hosts-file", default=ELT_FILE, help="'name address' lines, added to the claimants host")
+    parser.add_argument("--port", default=str(PORT), help="port or comma-separated ports")
+    parser.add_argument("--sslmode", default=",".join(SSLMODES), help="disable, prefer and/or require")
+    parser.add_argument("--user", default=os.environ.get("PGUSER", DB_USER))
+    parser.add_argument("--dbname", default=os.environ.get("PGDATABASE", DB_NAME))
+    parser.add_argument("--password", default=os.environ.get("PGPASSWORD", ""))
+    parser.add_argument("--repeat", type=int, default=3, help="attempts per combination")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="connections in flight at once")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT, help="seconds per connect / handshake step")
+    args = parser.parse_args()
+
+    for mode in args.sslmode.split(","):
+        if mode.strip() not in ("disable", "allow", "prefer", "require"):
+            parser.error(f"unsupported sslmode {mode} (verify-ca/verify-full need certificates)")
+    # allow only differs from prefer in the order it tries; for a probe they are the same
+    args.sslmode = args.sslmode.replace("allow", "prefer")
+
+    results = asyncio.run(run(args))
+    if any(r["status"] == "HBA" for r in results.values()):
+        print(f"[*] HBA rows: add the client with fix_postgresql.py / fix_postgresql_fleet.py (this client: {CLIENT_IP})")
+    return all(r["status"] == "OK" for r in results.values())
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        sys.exit(1)
@@ -100,4 +100,5 @@ print("NEXT STEPS:")
 print("1. Get someone with server access to run the command above")
 print("2. OR try to SSH directly from terminal/PuTTY/MobaXterm")
 print("3. OR install PostgreSQL client tools on Windows and try the connection options")
+print("4. To see which sslmodes work (no psql needed), run: python pg_probe.py --hosts " + HOST)
 print()
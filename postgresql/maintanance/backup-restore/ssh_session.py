@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Persistent multiplexed SSH sessions (OpenSSH ControlMaster)
+One authenticated connection per user@host:port is opened on first use and
+every later command runs over it as a new channel: no new TCP connect, key
+exchange or password prompt per command. Several commands can also be
+pipelined into one round trip with run_many().
+
+    session = get_session(HOST, USERNAME)
+    ok, out, err = session.run("sudo systemctl reload postgresql")
+    results = session.run_many(["sudo cp a a.backup", "grep -c x a || true"])
+
+Masters are closed at interpreter exit (close_all()).
+"""
+
+import atexit
+import os
+import re
+import subprocess
+import uuid
+
+CONNECT_TIMEOUT = 20
+COMMAND_TIMEOUT = 30
+CONTROL_PERSIST = 600  # seconds an idle master stays up if close_all() never runs
+CONTROL_DIR = os.path.expanduser("~/.ssh")
+
+_sessions = {}
+
+
+class SshSession:
+    """One ControlMaster connection; run() and run_many() return (ok, stdout, stderr)"""
+
+    def __init__(self, host, username, port=22, connect_timeout=CONNECT_TIMEOUT):
+        self.host = host
+        self.username = username
+        self.port = port
+        self.connect_timeout = connect_timeout
+        # %C is a hash of local host, remote host, port and user: short enough for a socket path
+        self.control_path = os.path.join(CONTROL_DIR, "cm-%C")
+
+    def _ssh(self, *extra):
+        return [
+            "ssh",
+            "-o", "StrictHostKeyChecking=no",
+            "-o", f"ConnectTimeout={self.connect_timeout}",
+            "-o", "PasswordAuthentication=yes",
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={self.control_path}",
+            "-o", f"ControlPersist={CONTROL_PERSIST}",
+            "-p", str(self.port),
+            *extra,
+            f"{self.username}@{self.host}",
+        ]
+
+    def is_open(self):
+        result = subprocess.run(self._ssh("-O", "check"), capture_output=True, text=True)
+        return result.returncode == 0
+
+    def open(self):
+        """Authenticate once and leave the master running in the background"""
+        if self.is_open():
+            return True
+        os.makedirs(CONTROL_DIR, mode=0o700, exist_ok=True)
+        # -f backgrounds only after authentication, so a password prompt still works here
+        result = subprocess.run(self._ssh("-f", "-N"), text=True, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            print(f"[!] Could not open SSH session to {self.host}: {result.stderr.strip()}")
+        return result.returncode == 0
+
+    def close(self):
+        subprocess.run(self._ssh("-O", "exit"), capture_output=True)
+
+    def run(self, command, timeout=COMMAND_TIMEOUT):
+        try:
+            result = subprocess.run(self._ssh() + [command], capture_output=True, text=True, timeout=timeout)
+            return result.returncode == 0, result.stdout, result.stderr
+        except subprocess.TimeoutExpired:
+            return False, "", "Timeout"
+        except OSError as e:
+            return False, "", str(e)
+
+    def run_many(self, commands, timeout=COMMAND_TIMEOUT):
+        """Run commands in order in one round trip; one (ok, stdout, stderr) per command
+
+        Each command runs in its own subshell, so a failing command does not stop
+        the ones after it. Output is split on a per-call marker.
+        """
+        marker = f"__ssh_session_{uuid.uuid4().hex}__"
+        script = []
+        for i, command in enumerate(commands):
+            script.append(f"( {command}\n); __rc=$?")
+            script.append(f"printf '{marker} {i} %d\\n' $__rc; printf '{marker} {i}\\n' >&2")
+        ok, stdout, stderr = self.run("\n".join(script), timeout=timeout)
+
+        out_parts = re.split(rf"{marker} (\d+) (\d+)\n", stdout)
+        err_parts = re.split(rf"{marker} \d+\n", stderr)
+        results = []
+        for i in range(len(commands)):
+            if 3 * i + 2 >= len(out_parts):
+                # the session died part-way (timeout, dropped connection): the rest did not run
+                results.append((False, "", stderr if not ok else "No result"))
+                continue
+            out, rc = out_parts[3 * i], int(out_parts[3 * i + 2])
+            err = err_parts[i] if i < len(err_parts) else ""
+            results.append((rc == 0, out, err))
+        return results
+
+
+def get_session(host, username, port=22):
+    """Shared session per user@host:port, opened on first use"""
+    key = (username, host, port)
+    if key not in _sessions:
+        session = SshSession(host, username, port)
+        session.open()
+        _sessions[key] = session
+    return _sessions[key]
+
+
+@atexit.register
+def close_all():
+    while _sessions:
+        _, session = _sessions.popitem()
+        session.close()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Unit tests for pg_hba.py (parser, rule index and planner; no SSH)
+
+Run with:
+  python3 -m pytest test_pg_hba.py
+  python3 -m unittest test_pg_hba
+"""
+
+import unittest
+
+import pg_hba
+from pg_hba import HbaFile, HbaRule
+
+HEADER = """# PostgreSQL Client Authentication Configuration File
+local   all             postgres                                peer
+local   all             all                                     peer
+host    all             all             127.0.0.1/32            scram-sha-256
+"""
+
+
+def client_rule(method="md5", address="192.168.3.106/32"):
+    return HbaRule("host", ["claimant_db"], ["claimant_user"], address, method)
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_fields_and_comment(self):
+        self.assertEqual(pg_hba.tokenize("host  db  user  10.0.0.1/32  md5  # note"),
+                         [("host", False), ("db", False), ("user", False), ("10.0.0.1/32", False), ("md5", False)])
+
+    def test_quoted_field_keeps_spaces_and_hash(self):
+        self.assertEqual(pg_hba.tokenize('host "my db" u 10.0.0.0/8 md5'),
+                         [("host", False), ("my db", True), ("u", False), ("10.0.0.0/8", False), ("md5", False)])
+        self.assertEqual(pg_hba.tokenize('host "a#b" u all md5')[1], ("a#b", True))
+
+    def test_blank_and_comment_lines(self):
+        self.assertEqual(pg_hba.tokenize("   \n"), [])
+        self.assertEqual(pg_hba.tokenize("# host all all all md5"), [])
+
+
+class ParseLineTest(unittest.TestCase):
+    def test_host_rule_with_options(self):
+        rule = pg_hba.parse_line("hostssl db1,db2 alice 10.1.0.0/16 cert clientcert=verify-full", 7)
+        self.assertEqual(rule.type, "hostssl")
+        self.assertEqual(rule.databases, ["db1", "db2"])
+        self.assertEqual(rule.users, ["alice"])
+        self.assertEqual(str(rule.network), "10.1.0.0/16")
+        self.assertEqual(rule.method, "cert")
+        self.assertEqual(rule.options, ["clientcert=verify-full"])
+        self.assertEqual(rule.lineno, 7)
+
+    def test_local_rule_has_no_address(self):
+        rule = pg_hba.parse_line("local all postgres peer", 1)
+        self.assertIsNone(rule.address)
+        self.assertEqual(rule.method, "peer")
+
+    def test_address_mask_pair(self):
+        rule = pg_hba.parse_line("host all all 192.168.3.0 255.255.255.0 md5", 1)
+        self.assertEqual(rule.address, "192.168.3.0/24")
+        self.assertEqual(rule.method, "md5")
+
+    def test_quoted_all_is_a_name(self):
+        rule = pg_hba.parse_line('host "all" u 10.0.0.1/32 md5', 1)
+        self.assertEqual(rule.databases, ['"all"'])
+
+    def test_non_rules(self):
+        self.assertIsNone(pg_hba.parse_line("# comment", 1))
+        self.assertIsNone(pg_hba.parse_line("include_dir conf.d", 1))
+
+    def test_incomplete_rule(self):
+        with self.assertRaises(ValueError):
+            pg_hba.parse_line("host all all md5", 3)
+
+    def test_continuation_lines(self):
+        hba = HbaFile("host claimant_db \\\n  claimant_user 10.0.0.1/32 md5\n")
+        self.assertEqual(len(hba.rules), 1)
+        self.assertEqual(hba.rules[0].users, ["claimant_user"])
+
+
+class PlanTest(unittest.TestCase):
+    def plan(self, text, rule=None):
+        action, other = HbaFile(HEADER + text).plan(rule or client_rule())
+        return action, other.lineno if other else None
+
+    def test_append_when_nothing_matches(self):
+        self.assertEqual(self.plan(""), ("append", None))
+
+    def test_present(self):
+        self.assertEqual(self.plan("host claimant_db claimant_user 192.168.3.106/32 md5\n"), ("present", 5))
+
+    def test_covered_by_broader_rule_with_same_method(self):
+        self.assertEqual(self.plan("host all all 192.168.0.0/16 md5\n"), ("covered", 5))
+
+    def test_conflict_on_same_connections(self):
+        self.assertEqual(self.plan("host claimant_db claimant_user 192.168.3.106/32 scram-sha-256\n"),
+                         ("conflict", 5))
+
+    def test_broader_stronger_method_shadows(self):
+        self.assertEqual(self.plan("host all all 192.168.0.0/16 scram-sha-256\n"), ("shadowed", 5))
+
+    def test_broader_reject_shadows(self):
+        self.assertEqual(self.plan("host all all 0.0.0.0/0 reject\n"), ("shadowed", 5))
+
+    def test_partial_ssl_reject_shadows(self):
+        self.assertEqual(self.plan("hostssl claimant_db claimant_user 192.168.3.0/24 reject\n"), ("shadowed", 5))
+
+    def test_narrower_rule_with_other_method_shadows_a_broader_new_rule(self):
+        rule = client_rule(address="192.168.3.0/24")
+        self.assertEqual(self.plan("host claimant_db claimant_user 192.168.3.106/32 scram-sha-256\n", rule),
+                         ("shadowed", 5))
+
+    def test_same_method_partial_overlap_is_skipped(self):
+        rule = client_rule(address="192.168.3.0/24")
+        text = "host claimant_db claimant_user 192.168.3.106/32 md5\nhost all all 0.0.0.0/0 reject\n"
+        self.assertEqual(self.plan(text, rule), ("shadowed", 6))
+        self.assertEqual(self.plan(text.splitlines(keepends=True)[0], rule), ("append", None))
+
+    def test_unrelated_rules_do_not_match(self):
+        text = ("host other_db claimant_user 192.168.3.106/32 reject\n"
+                "host claimant_db other_user 192.168.3.106/32 reject\n"
+                "host claimant_db claimant_user 10.0.0.0/8 reject\n"
+                "hostnossl claimant_db claimant_user 192.168.3.106/32 reject\n")
+        rule = HbaRule("hostssl", ["claimant_db"], ["claimant_user"], "192.168.3.106/32", "md5")
+        self.assertEqual(self.plan(text, rule), ("append", None))
+
+    def test_replication_is_not_matched_by_all(self):
+        rule = HbaRule("host", ["replication"], ["replicator"], "10.0.0.2/32", "scram-sha-256")
+        self.assertEqual(self.plan("host all all 0.0.0.0/0 reject\n", rule), ("append", None))
+
+    def test_first_match_wins(self):
+        text = "host all all 192.168.3.0/24 md5\nhost all all 0.0.0.0/0 reject\n"
+        self.assertEqual(self.plan(text), ("covered", 5))
+
+
+class AddTest(unittest.TestCase):
+    def test_append_keeps_other_lines(self):
+        hba = HbaFile(HEADER)
+        self.assertEqual(hba.add(client_rule())[0], "append")
+        self.assertEqual(hba.render()[:len(HEADER)], HEADER)
+        self.assertEqual(hba.rules[-1].key(), client_rule().key())
+        self.assertEqual(hba.add(client_rule())[0], "present")
+
+    def test_needs_force_changes_nothing(self):
+        text = HEADER + "host all all 0.0.0.0/0 reject\n"
+        hba = HbaFile(text)
+        self.assertEqual(hba.add(client_rule())[0], "shadowed")
+        self.assertEqual(hba.render(), text)
+        self.assertEqual(hba.diff(text), "")
+
+    def test_force_inserts_before_the_shadowing_rule(self):
+        hba = HbaFile(HEADER + "host all all 0.0.0.0/0 reject\n")
+        action, other = hba.add(client_rule(), force=True)
+        self.assertEqual((action, other.method), ("insert", "reject"))
+        self.assertEqual([r.method for r in hba.rules[-2:]], ["md5", "reject"])
+        self.assertEqual(hba.plan(client_rule())[0], "present")
+
+    def test_missing_final_newline(self):
+        hba = HbaFile(HEADER.rstrip("\n"))
+        hba.add(client_rule())
+        self.assertTrue(hba.render().endswith("127.0.0.1/32            scram-sha-256\n" + client_rule().render()))
+
+
+if __name__ == "__main__":
+    unittest.main()
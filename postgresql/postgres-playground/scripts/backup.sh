@@ -7,6 +7,7 @@ set -euo pipefail
 : ${PGUSER:=postgres}
 : ${PGPASSWORD:=${PGPASSWORD:-}}
 : ${BACKUP_DIR:=./backups}
+: ${WORKERS:=4}
 
 mkdir -p "$BACKUP_DIR"
 timestamp=$(date +%Y%m%d_%H%M%S)
@@ -14,7 +15,8 @@ timestamp=$(date +%Y%m%d_%H%M%S)
 usage(){
   cat <<EOF
 Usage: $0 [--logical|--physical|--all]
-  --logical   : pg_dumpall to single SQL file + per-db custom dumps
+  --logical   : pg_dumpall --globals-only + concurrent per-db dumps (logical_backup.py, WORKERS=$WORKERS)
+  --logical-serial : previous mode, full pg_dumpall SQL + per-db custom dumps one at a time
   --physical  : pg_basebackup to capture filesystem-level basebackup
   --all       : both
 EOF
@@ -28,6 +30,7 @@ fi
 while [ "$#" -gt 0 ]; do
   case "$1" in
     --logical) MODE=logical; shift;;
+    --logical-serial) MODE=logical-serial; shift;;
     --physical) MODE=physical; shift;;
     --all) MODE=all; shift;;
     *) usage;;
@@ -37,6 +40,11 @@ done
 export PGPASSWORD="$PGPASSWORD"
 
 if [ "$MODE" = "logical" ] || [ "$MODE" = "all" ]; then
+  echo "Running parallel logical backup..."
+  python3 "$(dirname "$0")/logical_backup.py" --backup-dir "$BACKUP_DIR" --workers "$WORKERS"
+fi
+
+if [ "$MODE" = "logical-serial" ]; then
   echo "Running logical backup..."
   outfile="$BACKUP_DIR/pg_dumpall_${timestamp}.sql"
   pg_dumpall -h "$PGHOST" -p "$PGPORT" -U "$PGUSER" > "$outfile"
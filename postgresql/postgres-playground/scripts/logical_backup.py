@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Parallel logical backup (backup.sh --logical)
+
+- globals only (roles, tablespaces) with pg_dumpall --globals-only; the
+  per-database dumps below already hold the data, so the full pg_dumpall
+  data dump is not taken twice
+- every database dumped concurrently, up to --workers at a time, largest
+  first so the long dumps start early
+- databases of --large-mb or more (pg_database_size) use directory format
+  with pg_dump -j --dump-jobs; the rest use a single custom-format file
+- a per-database timing table at the end
+
+Connection settings come from PGHOST / PGPORT / PGUSER / PGPASSWORD like the
+shell scripts. Restore with restore.sh --pgrestore (both formats work with
+pg_restore), after loading the globals file with restore.sh --logical.
+
+Run with:
+  ./scripts/logical_backup.py --backup-dir ./backups --workers 4 --large-mb 1024
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import os
+import subprocess
+import sys
+import time
+
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "./backups")
+WORKERS = 4
+DUMP_JOBS = 4
+LARGE_MB = 1024
+
+
+def conn_args():
+    return ["-h", os.environ.get("PGHOST", "localhost"), "-p", os.environ.get("PGPORT", "5432"),
+            "-U", os.environ.get("PGUSER", "postgres")]
+
+
+def list_databases():
+    """(name, size in bytes) for every connectable non-template database, largest first"""
+    result = subprocess.run(
+        ["psql", *conn_args(), "-X", "-A", "-t", "-F", "\t", "-d", "postgres", "-c",
+         "SELECT datname, pg_database_size(datname) FROM pg_database "
+         "WHERE NOT datistemplate AND datallowconn ORDER BY 2 DESC"],
+        capture_output=True, text=True, check=True,
+    )
+    rows = [line.split("\t") for line in result.stdout.splitlines() if line]
+    return [(name, int(size)) for name, size in rows]
+
+
+def dump_globals(backup_dir, timestamp):
+    outfile = os.path.join(backup_dir, f"globals_{timestamp}.sql")
+    with open(outfile, "w") as fh:
+        subprocess.run(["pg_dumpall", *conn_args(), "--globals-only"], stdout=fh, check=True)
+    return outfile
+
+
+def dump_database(db, size, args, timestamp):
+    """Dump one database; return a result dict for the timing table"""
+    large = size >= args.large_mb << 20
+    if large:
+        target = os.path.join(args.backup_dir, f"{db}_{timestamp}.dir")
+        cmd = ["pg_dump", *conn_args(), "-Fd", "-j", str(args.dump_jobs), "-f", target, db]
+    else:
+        target = os.path.join(args.backup_dir, f"{db}_{timestamp}.dump")
+        cmd = ["pg_dump", *conn_args(), "-Fc", "-f", target, db]
+    start = time.time()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    return {
+        "db": db,
+        "size": size,
+        "format": f"dir -j{args.dump_jobs}" if large else "custom",
+        "seconds": time.time() - start,
+        "target": target,
+        "error": result.stderr.strip() if result.returncode != 0 else None,
+    }
+
+
+def print_table(results, total):
+    print()
+    print(f"{'database':<30} {'size MB':>10} {'format':<10} {'seconds':>9}  status")
+    print("-" * 72)
+    for r in sorted(results, key=lambda r: r["seconds"], reverse=True):
+        status = "OK" if r["error"] is None else "FAILED"
+        print(f"{r['db']:<30} {r['size'] / (1 << 20):>10,.1f} {r['format']:<10} {r['seconds']:>9.1f}  {status}")
+    serial = sum(r["seconds"] for r in results)
+    print("-" * 72)
+    print(f"wall time {total:.1f}s (sum of dumps {serial:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent per-database pg_dump with globals-only pg_dumpall")
+    parser.add_argument("--backup-dir", default=BACKUP_DIR)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="databases dumped at the same time")
+    parser.add_argument("--dump-jobs", type=int, default=DUMP_JOBS, help="pg_dump -j for directory-format dumps")
+    parser.add_argument("--large-mb", type=int, default=LARGE_MB,
+                        help="databases at least this big use directory format with -j")
+    args = parser.parse_args()
+
+    os.makedirs(args.backup_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    start = time.time()
+
+    print(f"Dumped globals -> {dump_globals(args.backup_dir, timestamp)}")
+    databases = list_databases()
+    print(f"Dumping {len(databases)} databases with {args.workers} workers...")
+
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(dump_database, db, size, args, timestamp) for db, size in databases]
+        for future in concurrent.futures.as_completed(futures):
+            r = future.result()
+            results.append(r)
+            if r["error"]:
+                print(f"[!] {r['db']} failed: {r['error']}")
+            else:
+                print(f"[+] {r['db']} -> {r['target']} ({r['seconds']:.1f}s)")
+
+    print_table(results, time.time() - start)
+    return all(r["error"] is None for r in results)
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except subprocess.CalledProcessError as e:
+        print(f"[!] {' '.join(e.cmd[:1])} failed with exit code {e.returncode}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        sys.exit(1)
@@ -7,12 +7,14 @@ set -euo pipefail
 : ${PGUSER:=postgres}
 : ${PGPASSWORD:=${PGPASSWORD:-}}
 : ${BACKUP_DIR:=./backups}
+: ${PITR_TOOL:=/opt/postgresql-backup/pitr_restore.py}
 
 usage(){
   cat <<EOF
-Usage: $0 --logical <sql-file>    # for pg_dumpall SQL
-       $0 --pgrestore <dumpfile>  # for custom-format pg_dump (-Fc) via pg_restore
+Usage: $0 --logical <sql-file>    # for pg_dumpall SQL (or globals_<ts>.sql from backup.sh --logical)
+       $0 --pgrestore <dumpfile>  # for custom-format (-Fc) or directory-format (<db>_<ts>.dir) pg_dump via pg_restore
        $0 --physical <basebackup.tar.gz> <target_data_dir>   # notes: manual steps
+       $0 --pitr <target_data_dir> [<timestamp>|<lsn>]        # point-in-time restore from the backup catalog
 EOF
   exit 1
 }
@@ -46,6 +48,19 @@ case "$1" in
     echo "4) Create recovery configuration (standby.signal + primary_conninfo in postgresql.conf or recovery.conf equivalent)"
     echo "5) Ensure WAL archive/restore settings are correct"
     echo "6) Start PostgreSQL"
+    echo "For catalogued backups use: $0 --pitr <target_data_dir> [<timestamp>|<lsn>]"
+    ;;
+  --pitr)
+    shift
+    target="$1"
+    point="${2:-}"
+    # pitr_restore.py picks the base backup, extracts it and sets a prefetching restore_command
+    case "$point" in
+      "")  python3 "$PITR_TOOL" restore --target "$target" ;;
+      */*) python3 "$PITR_TOOL" restore --target "$target" --target-lsn "$point" ;;
+      *)   python3 "$PITR_TOOL" restore --target "$target" --target-time "$point" ;;
+    esac
+    echo "Start PostgreSQL on $target; recovery pauses at the target (SELECT pg_wal_replay_resume(); to promote)"
     ;;
   *)
     usage
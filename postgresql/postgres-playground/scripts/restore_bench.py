@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Restore-speed benchmark with the bundled dvdrental.tar
+
+Restores the sample into a scratch database once per combination of:
+  --jobs         pg_restore -j values
+  --no-owner     with and/or without --no-owner
+  --index-mode   deferred (indexes after the data, what pg_restore does) or
+                 inline (indexes created before the data is loaded)
+  --mwm          maintenance_work_mem values
+  --sync-commit  synchronous_commit on and/or off
+Settings go to every pg_restore connection through PGOPTIONS.
+
+Each restore runs as four timed phases from the archive's TOC:
+schema (pre-data), data, index (post-data INDEX entries) and constraints
+(the rest of post-data: PK/FK/unique constraints, triggers, rules).
+Reports wall time, rows/sec over the data phase and the per-phase split.
+
+dvdrental.tar is tar format, which pg_restore cannot restore in parallel, so
+it is first restored once and re-dumped in directory format (-Fd); every run
+uses that copy so the results compare like with like.
+
+Targets the docker/docker-compose.yml server by default (PGHOST / PGPORT /
+PGUSER / PGPASSWORD, as in the other scripts).
+
+Run with:
+  PGPASSWORD=example ./scripts/restore_bench.py
+  ./scripts/restore_bench.py --jobs 1,2,4,8 --mwm 64MB,1GB --sync-commit off --csv results.csv
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from logical_backup import conn_args
+
+ARCHIVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "dvdrental.tar")
+BENCH_DB = "dvdrental_bench"
+PHASES = ("schema", "data", "index", "constraints")
+ORDER = {"deferred": PHASES, "inline": ("schema", "index", "data", "constraints")}
+
+
+def psql(sql, db="postgres"):
+    result = subprocess.run(["psql", *conn_args(), "-X", "-A", "-t", "-v", "ON_ERROR_STOP=1", "-d", db, "-c", sql],
+                            capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+def recreate(db):
+    psql(f'DROP DATABASE IF EXISTS "{db}" WITH (FORCE)')
+    psql(f'CREATE DATABASE "{db}"')
+
+
+def archive_format(archive):
+    toc = subprocess.run(["pg_restore", "-l", archive], capture_output=True, text=True, check=True).stdout
+    for line in toc.splitlines():
+        if "Format:" in line:
+            return line.split("Format:")[1].strip()
+    return "UNKNOWN"
+
+
+def prepare_archive(archive, work):
+    """Return an archive pg_restore -j can use, converting tar format to directory format"""
+    fmt = archive_format(archive)
+    if fmt in ("CUSTOM", "DIRECTORY"):
+        return archive
+    print(f"[*] {os.path.basename(archive)} is {fmt} format, converting to directory format for -j")
+    seed = f"{BENCH_DB}_seed"
+    recreate(seed)
+    subprocess.run(["pg_restore", *conn_args(), "--no-owner", "-d", seed, archive], check=True)
+    target = os.path.join(work, "dvdrental.dir")
+    subprocess.run(["pg_dump", *conn_args(), "-Fd", "-f", target, seed], check=True)
+    psql(f'DROP DATABASE "{seed}" WITH (FORCE)')
+    return target
+
+
+def phase_lists(archive, work):
+    """Split the archive TOC into one pg_restore -L list file per phase"""
+    def section(name):
+        out = subprocess.run(["pg_restore", "-l", f"--section={name}", archive],
+                             capture_output=True, text=True, check=True).stdout
+        return [line for line in out.splitlines() if line and not line.startswith(";")]
+
+    post = section("post-data")
+    entries = {
+        "schema": section("pre-data"),
+        "data": section("data"),
+        "index": [line for line in post if " INDEX " in line],
+        "constraints": [line for line in post if " INDEX " not in line],
+    }
+    lists = {}
+    for phase, lines in entries.items():
+        lists[phase] = os.path.join(work, f"{phase}.list")
+        with open(lists[phase], "w") as fh:
+            fh.write("\n".join(lines) + "\n")
+    return lists
+
+
+def run_restore(archive, lists, combo):
+    jobs, no_owner, index_mode, mwm, sync_commit = combo
+    recreate(BENCH_DB)
+    env = dict(os.environ, PGOPTIONS=f"-c maintenance_work_mem={mwm} -c synchronous_commit={sync_commit}")
+    timings = {}
+    start = time.time()
+    for phase in ORDER[index_mode]:
+        cmd = ["pg_restore", *conn_args(), "-d", BENCH_DB, "-j", str(jobs), "-L", lists[phase], archive]
+        if no_owner:
+            cmd.insert(1, "--no-owner")
+        phase_start = time.time()
+        subprocess.run(cmd, env=env, check=True, capture_output=True)
+        timings[phase] = time.time() - phase_start
+    timings["wall"] = time.time() - start
+    return timings
+
+
+def count_rows(db):
+    sql = ("SELECT coalesce(sum((xpath('/row/c/text()', query_to_xml("
+           "format('SELECT count(*) AS c FROM %I.%I', schemaname, tablename), false, true, '')))[1]::text::bigint), 0) "
+           "FROM pg_tables WHERE schemaname NOT IN ('pg_catalog', 'information_schema')")
+    return int(psql(sql, db))
+
+
+def split_list(value, cast=str):
+    return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pg_restore settings on dvdrental.tar")
+    parser.add_argument("--archive", default=ARCHIVE)
+    parser.add_argument("--jobs", default="1,2,4", help="comma-separated pg_restore -j values")
+    parser.add_argument("--no-owner", default="on", help="on, off or on,off")
+    parser.add_argument("--index-mode", default="deferred,inline", help="deferred, inline or both")
+    parser.add_argument("--mwm", default="64MB,512MB", help="maintenance_work_mem values")
+    parser.add_argument("--sync-commit", default="on,off", help="synchronous_commit values")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per combination (best is reported)")
+    parser.add_argument("--csv", help="also write the results to this CSV file")
+    parser.add_argument("--keep", action="store_true", help=f"keep the {BENCH_DB} database afterwards")
+    args = parser.parse_args()
+
+    combos = list(itertools.product(
+        split_list(args.jobs, int),
+        [v == "on" for v in split_list(args.no_owner)],
+        split_list(args.index_mode),
+        split_list(args.mwm),
+        split_list(args.sync_commit),
+    ))
+    work = tempfile.mkdtemp(prefix="restore_bench_")
+    results = []
+    try:
+        archive = prepare_archive(os.path.abspath(args.archive), work)
+        lists = phase_lists(archive, work)
+        rows = None
+        print(f"[*] {len(combos)} combinations x {args.repeat} run(s)")
+        for combo in combos:
+            best = None
+            for _ in range(args.repeat):
+                timings = run_restore(archive, lists, combo)
+                if best is None or timings["wall"] < best["wall"]:
+                    best = timings
+            if rows is None:
+                rows = count_rows(BENCH_DB)
+            jobs, no_owner, index_mode, mwm, sync_commit = combo
+            result = {"jobs": jobs, "no_owner": no_owner, "index_mode": index_mode, "mwm": mwm,
+                      "sync_commit": sync_commit, "rows": rows,
+                      "rows_per_s": round(rows / best["data"]) if best["data"] > 0 else 0,
+                      **{k: round(v, 2) for k, v in best.items()}}
+            results.append(result)
+            print(f"[+] -j{jobs:<2} no_owner={'on ' if no_owner else 'off'} {index_mode:<8} mwm={mwm:<6} "
+                  f"sync={sync_commit:<3} wall {best['wall']:6.2f}s")
+    except subprocess.CalledProcessError as e:
+        print(f"[!] {' '.join(map(str, e.cmd[:2]))} failed: {(e.stderr or '').strip()}")
+        return False
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+        if not args.keep:
+            subprocess.run(["psql", *conn_args(), "-X", "-q", "-d", "postgres", "-c",
+                            f'DROP DATABASE IF EXISTS "{BENCH_DB}" WITH (FORCE)'], capture_output=True)
+
+    print()
+    print(f"{'jobs':>4} {'owner':<5} {'indexes':<8} {'mwm':<6} {'sync':<4} {'wall s':>7} {'rows/s':>10}  "
+          + " ".join(f"{p:>11}" for p in PHASES))
+    print("-" * 110)
+    for r in sorted(results, key=lambda r: r["wall"]):
+        print(f"{r['jobs']:>4} {'skip' if r['no_owner'] else 'keep':<5} {r['index_mode']:<8} {r['mwm']:<6} "
+              f"{r['sync_commit']:<4} {r['wall']:>7.2f} {r['rows_per_s']:>10,}  "
+              + " ".join(f"{r[p]:>6.2f} ({r[p] / r['wall']:>3.0%})" for p in PHASES))
+    if results:
+        best = min(results, key=lambda r: r["wall"])
+        print(f"\nFastest: -j {best['jobs']}, {'--no-owner, ' if best['no_owner'] else ''}{best['index_mode']} "
+              f"indexes, maintenance_work_mem={best['mwm']}, synchronous_commit={best['sync_commit']}")
+
+    if args.csv and results:
+        with open(args.csv, "w", newline="") as fh:
+            writer = csv.DictWriter(fh, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"Results written to {args.csv}")
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(0 if main() else 1)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        sys.exit(1)
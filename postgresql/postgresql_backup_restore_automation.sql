@@ -50,6 +50,15 @@ CREATE TABLE IF NOT EXISTS public.backup_metadata (
     notes TEXT
 );
 
+-- 1.3b: Chain columns used by backup_chain.py (full/incremental/WAL chains)
+ALTER TABLE public.backup_metadata
+    ADD COLUMN IF NOT EXISTS chain_name VARCHAR(255),          -- backup_name of the chain's FULL backup
+    ADD COLUMN IF NOT EXISTS parent_backup_name VARCHAR(255),  -- previous member of the chain
+    ADD COLUMN IF NOT EXISTS start_lsn PG_LSN,
+    ADD COLUMN IF NOT EXISTS end_lsn PG_LSN,
+    ADD COLUMN IF NOT EXISTS remote_location TEXT;
+CREATE INDEX IF NOT EXISTS backup_metadata_chain_idx ON public.backup_metadata (chain_name, backup_date);
+
 -- 1.4: Insert sample backup records
 INSERT INTO public.backup_metadata (backup_name, database_name, backup_type, backup_size_bytes, backup_location, duration_seconds, status)
 VALUES 
@@ -108,6 +117,14 @@ CREATE TABLE IF NOT EXISTS public.restore_history (
     verification_date TIMESTAMP
 );
 
+-- 2.1b: Restore drill columns used by backup_verify.py
+ALTER TABLE public.restore_history
+    ADD COLUMN IF NOT EXISTS restore_type VARCHAR(50),                -- 'DRILL'
+    ADD COLUMN IF NOT EXISTS restored_bytes BIGINT,
+    ADD COLUMN IF NOT EXISTS restore_mb_per_s NUMERIC(10,1),
+    ADD COLUMN IF NOT EXISTS time_to_consistent_seconds NUMERIC(10,1),
+    ADD COLUMN IF NOT EXISTS recovery_target TEXT;
+
 -- 2.2: Check database integrity after restore
 CREATE OR REPLACE FUNCTION public.check_database_integrity()
 RETURNS TABLE(
@@ -355,6 +372,92 @@ $$ LANGUAGE plpgsql;
 -- 4.3: Run health check
 SELECT * FROM public.system_health_check();
 
+-- 4.4: Backup run telemetry written by backup_telemetry.py (one row per run / reporting interval)
+CREATE TABLE IF NOT EXISTS public.backup_run_metrics (
+    run_id BIGSERIAL PRIMARY KEY,
+    tool VARCHAR(100) NOT NULL,             -- 'backup_stream', 'pg_basebackup.sh', 'wal_shipper', ...
+    run_name VARCHAR(255),
+    kind VARCHAR(20) NOT NULL DEFAULT 'run', -- 'run' or 'interval' (daemons)
+    host VARCHAR(255),
+    started_at TIMESTAMP NOT NULL,
+    finished_at TIMESTAMP NOT NULL,
+    duration_seconds NUMERIC(12,2),
+    status VARCHAR(50) NOT NULL,            -- 'SUCCESS', 'FAILED'
+    bytes_in BIGINT,
+    bytes_out BIGINT,
+    compression_ratio NUMERIC(10,2),
+    mb_per_s NUMERIC(10,1),
+    phases JSONB,                           -- {"compress": {"seconds": .., "bytes_in": ..}, ...}
+    error_message TEXT
+);
+CREATE INDEX IF NOT EXISTS backup_run_metrics_tool_idx ON public.backup_run_metrics (tool, started_at);
+
+-- 4.5: Moving averages per tool and maintenance-window overrun flags
+-- (same rules as `backup_telemetry.py report`)
+CREATE OR REPLACE FUNCTION public.backup_health_report(
+    p_window_minutes INT DEFAULT 120,
+    p_runs INT DEFAULT 7
+)
+RETURNS TABLE(
+    tool VARCHAR,
+    last_run TIMESTAMP,
+    last_seconds NUMERIC,
+    avg_seconds NUMERIC,
+    projected_seconds NUMERIC,
+    last_mb_per_s NUMERIC,
+    avg_mb_per_s NUMERIC,
+    failures BIGINT,
+    runs BIGINT,
+    flag VARCHAR
+) AS $$
+BEGIN
+    RETURN QUERY
+    WITH ranked AS (
+        SELECT m.*,
+               row_number() OVER (PARTITION BY m.tool ORDER BY m.started_at DESC) AS rn
+        FROM public.backup_run_metrics m
+        WHERE m.kind = 'run'
+    ),
+    recent AS (
+        SELECT r.tool,
+               max(r.started_at) AS last_run,
+               max(r.duration_seconds) FILTER (WHERE r.rn = 1) AS last_seconds,
+               max(r.mb_per_s) FILTER (WHERE r.rn = 1) AS last_mb_per_s,
+               max(r.status) FILTER (WHERE r.rn = 1) AS last_status,
+               avg(r.duration_seconds) AS avg_seconds,
+               avg(r.duration_seconds) + 2 * coalesce(stddev_samp(r.duration_seconds), 0) AS projected_seconds,
+               avg(r.mb_per_s) FILTER (WHERE r.mb_per_s > 0) AS avg_mb_per_s,
+               count(*) FILTER (WHERE r.status <> 'SUCCESS') AS failures,
+               count(*) AS runs
+        FROM ranked r
+        WHERE r.rn <= p_runs
+        GROUP BY r.tool
+    )
+    SELECT
+        r.tool,
+        r.last_run,
+        r.last_seconds,
+        round(r.avg_seconds, 1),
+        round(r.projected_seconds, 1),
+        r.last_mb_per_s,
+        round(r.avg_mb_per_s, 1),
+        r.failures,
+        r.runs,
+        CASE
+            WHEN r.last_status <> 'SUCCESS' THEN 'FAILING'
+            WHEN r.last_seconds > 0.8 * p_window_minutes * 60
+                 OR r.projected_seconds > p_window_minutes * 60 THEN 'AT RISK'
+            WHEN r.last_mb_per_s < 0.7 * r.avg_mb_per_s THEN 'DEGRADED'
+            ELSE 'OK'
+        END::VARCHAR
+    FROM recent r
+    ORDER BY r.tool;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 4.6: Run backup health report
+SELECT * FROM public.backup_health_report();
+
 -- ============================================================================
 -- SECTION 5: COOL AUTOMATIONS - DATA MANAGEMENT
 -- ============================================================================